@@ -1,3 +1,29 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import AnalysisJob, AnalysisResult, Screenshot, ScreenshotDirectory
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'completed', 'total', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('id', 'created_at', 'updated_at', 'started_at', 'finished_at')
+
+
+@admin.register(ScreenshotDirectory)
+class ScreenshotDirectoryAdmin(admin.ModelAdmin):
+    list_display = ('path', 'scanned_at')
+
+
+@admin.register(Screenshot)
+class ScreenshotAdmin(admin.ModelAdmin):
+    list_display = ('file_name', 'page', 'language', 'theme', 'captured_at', 'size')
+    list_filter = ('directory', 'language', 'theme')
+    search_fields = ('file_name', 'page', 'content_hash')
+
+
+@admin.register(AnalysisResult)
+class AnalysisResultAdmin(admin.ModelAdmin):
+    list_display = ('screenshot', 'provider', 'model', 'completion_tokens', 'created_at')
+    list_filter = ('language', 'theme', 'provider')
+    search_fields = ('screenshot', 'page', 'source')
@@ -0,0 +1,990 @@
+"""Shared analysis flow for the AI provider clients.
+
+The OpenRouter and Gemini clients only differ in how a prepared image and
+prompt are sent to the provider. Image preparation, rate limiting, result
+caching and batch processing live here so both behave the same way.
+"""
+
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+from django.conf import settings
+
+from . import image_prep
+from .cache import make_cache_key
+from .metrics import get_metrics
+from .rate_limit import BATCH, TokenBucket, rate_limit_priority
+from .resilience import CircuitBreaker, ResilienceStats, RetryPolicy, is_retryable_error, parse_retry_after
+
+
+class BaseScreenshotClient:
+    """Base class for screenshot analysis clients.
+
+    Subclasses set ``provider``, ``default_prompt``, ``max_image_resolution``,
+    ``requests_per_minute`` and ``rate_limit_burst`` and implement
+    ``_send_request``. Subclasses that can analyze several images in one
+    request also set ``max_images_per_request`` and implement
+    ``_send_group_request``.
+    """
+
+    provider = None
+    default_prompt = None
+    max_image_resolution = (1920, 1080)
+    requests_per_minute = 10
+    rate_limit_burst = 1
+    max_images_per_request = 1
+
+    def __init__(self, model, cache=None, rate_limiter=None, retry_policy=None, circuit_breaker=None,
+                 single_flight=None):
+        """Initialize the client.
+
+        Args:
+            model (str): Name of the provider model used for analysis
+            cache (AnalysisCache, optional): Cache for analysis results. Disabled if not provided.
+            rate_limiter (TokenBucket, optional): Rate limiter shared by concurrent requests.
+                Defaults to a bucket built from ``requests_per_minute`` and ``rate_limit_burst``.
+            retry_policy (RetryPolicy, optional): Backoff for transient failures.
+                Defaults to one built from the AI_RETRY_* settings.
+            circuit_breaker (CircuitBreaker, optional): Circuit breaker of the provider.
+                Defaults to a breaker private to this client.
+            single_flight (SingleFlight, optional): Shares one upstream request between concurrent
+                analyses of the same image, prompt and model. Disabled if not provided.
+        """
+        self.model = model
+        self.cache = cache
+        self.rate_limiter = rate_limiter or TokenBucket(self.requests_per_minute, self.rate_limit_burst)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.single_flight = single_flight
+        self.image_stats = image_prep.ImageStats()
+        self.resilience = ResilienceStats()
+        # Per-phase timings, payload sizes and token usage, shared process-wide
+        self.metrics = get_metrics()
+
+        # Called as listener(client, latency, error) after every upstream request,
+        # where error is the failed result or None
+        self.request_listeners = []
+
+        # Images prepared ahead of time by a batch pipeline, keyed by path
+        self._prefetched = {}
+        self._prefetched_lock = threading.Lock()
+
+    def image_options(self):
+        """Return the keyword arguments used to prepare images for this client.
+
+        Returns:
+            dict: Keyword arguments for image_prep.prepare_image
+        """
+        return image_prep.get_image_options(self.max_image_resolution)
+
+    def prefetch_image(self, image_path, prepared):
+        """Hand over an image that was prepared ahead of time.
+
+        The next analyze_screenshot call for ``image_path`` uses it instead of
+        preparing the image again.
+
+        Args:
+            image_path (str): Path to the image file
+            prepared (PreparedImage): The prepared image
+        """
+        with self._prefetched_lock:
+            self._prefetched[image_path] = prepared
+
+    def clear_prefetched(self):
+        """Drop prepared images that were never used."""
+        with self._prefetched_lock:
+            self._prefetched.clear()
+
+    def _prepare_image(self, screenshot):
+        """Prepare an image for upload.
+
+        Args:
+            screenshot (str | bytes | file): Path to the image file, its bytes, or a file-like object
+
+        Returns:
+            PreparedImage: The encoded image and its MIME type
+        """
+        prepared = None
+        if image_prep.is_path(screenshot):
+            with self._prefetched_lock:
+                prepared = self._prefetched.pop(screenshot, None)
+        if prepared is None:
+            prepared = image_prep.prepare_image(screenshot, **self.image_options())
+        self.image_stats.record(prepared)
+        if prepared.prep_seconds is not None:
+            self.metrics.observe(self.provider, 'prep_seconds', prepared.prep_seconds)
+        return prepared
+
+    def _apply_rate_limit(self):
+        """Apply rate limiting to avoid hitting API limits.
+
+        Returns:
+            float: Seconds spent waiting for the rate limiter
+        """
+        waited = self.rate_limiter.acquire()
+        self.metrics.observe(self.provider, 'rate_limit_wait_seconds', waited or 0.0)
+        return waited
+
+    async def _apply_rate_limit_async(self):
+        """Wait for the rate limiter without blocking the event loop.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        acquire_async = getattr(self.rate_limiter, 'acquire_async', None)
+        if acquire_async is None:
+            waited = await asyncio.to_thread(self.rate_limiter.acquire)
+        else:
+            waited = await acquire_async()
+        self.metrics.observe(self.provider, 'rate_limit_wait_seconds', waited or 0.0)
+        return waited
+
+    def _timed(self, phase):
+        """Return a context manager recording the duration of a request phase.
+
+        Args:
+            phase (str): 'encode', 'upstream' or 'parse'
+        """
+        return self.metrics.timer(self.provider, f"{phase}_seconds")
+
+    def _record_usage(self, usage):
+        """Record the token usage reported by the provider.
+
+        Args:
+            usage (dict): ``prompt_tokens`` and ``completion_tokens`` in the OpenRouter format
+        """
+        if not isinstance(usage, dict):
+            return
+        for name in ('prompt_tokens', 'completion_tokens'):
+            if isinstance(usage.get(name), int):
+                self.metrics.observe(self.provider, name, usage[name])
+
+    def _tag_result(self, result, latency):
+        """Record the provider, model and latency of an upstream request in its successful results.
+
+        The tags are stored with the result, so the results store can filter and
+        sort on them. OpenRouter's own ``provider`` field, naming the host that
+        served the model, is replaced by the client's provider. Error results are
+        left as they are.
+
+        Args:
+            result (dict | list): The result, or the results of a multi-image request
+            latency (float): Seconds the request took
+        """
+        for item in result if isinstance(result, list) else [result]:
+            if isinstance(item, dict) and 'error' not in item:
+                item['provider'] = self.provider
+                item.setdefault('model', self.model)
+                item['latency'] = round(latency, 3)
+
+    def _notify_request(self, started, result):
+        """Report the latency and outcome of an upstream request to the listeners.
+
+        Args:
+            started (float): time.monotonic() when the request was sent
+            result (dict | list): The result, or the results of a multi-image request
+        """
+        if not self.request_listeners:
+            return
+        latency = time.monotonic() - started
+        if isinstance(result, list):
+            errors = [r for r in result if 'error' in r]
+            error = errors[0] if result and len(errors) == len(result) else None
+        else:
+            error = result if result is not None and 'error' in result else None
+        for listener in self.request_listeners:
+            listener(self, latency, error)
+
+    def _call_upstream(self, send, *args):
+        """Send a request with rate limiting, retries and circuit breaking.
+
+        Every attempt waits for the rate limiter. Transient failures are retried
+        with backoff while the circuit breaker allows it; when the circuit is
+        open the request fails fast with a 503 error result.
+
+        Args:
+            send (callable): Called as ``send(*args)``; returns a result, a list of
+                results, or None
+            *args: Arguments for ``send``
+
+        Returns:
+            The return value of the last attempt
+        """
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                return self._circuit_open_result(args)
+
+            self._apply_rate_limit()
+            started = time.monotonic()
+            result = send(*args)
+            self._tag_result(result, time.monotonic() - started)
+            self._notify_request(started, result)
+            attempt += 1
+
+            delay = self._retry_delay(attempt, result)
+            if delay is None:
+                return result
+            time.sleep(delay)
+
+    async def _call_upstream_async(self, send, *args):
+        """Send a request like _call_upstream, from a coroutine.
+
+        Args:
+            send (callable): Coroutine function called as ``send(*args)``
+            *args: Arguments for ``send``
+
+        Returns:
+            The return value of the last attempt
+        """
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                return self._circuit_open_result(args)
+
+            await self._apply_rate_limit_async()
+            started = time.monotonic()
+            result = await send(*args)
+            self._tag_result(result, time.monotonic() - started)
+            self._notify_request(started, result)
+            attempt += 1
+
+            delay = self._retry_delay(attempt, result)
+            if delay is None:
+                return result
+            await asyncio.sleep(delay)
+
+    def _circuit_open_result(self, args):
+        """Return the error result of a request short-circuited by the open circuit breaker."""
+        self.resilience.record_short_circuit()
+        error = {"error": f"{self.provider} circuit breaker is open", "status": 503}
+        return [dict(error) for _ in args[0]] if isinstance(args[0], list) else error
+
+    def _retry_delay(self, attempt, result):
+        """Record the outcome of an attempt and decide whether to retry it.
+
+        Args:
+            attempt (int): Number of attempts made so far
+            result (dict | list): The result of the last attempt
+
+        Returns:
+            float: Seconds to wait before the next attempt, or None to return the result
+        """
+        error = _retryable_error(result)
+        if error is None:
+            self.circuit_breaker.record_success()
+            if isinstance(result, dict):
+                self._record_usage(result.get('usage'))
+            return None
+        self.circuit_breaker.record_failure()
+
+        delay = self.retry_policy.delay(attempt, error.get('retry_after'))
+        if delay is not None:
+            self.resilience.record_retry()
+        return delay
+
+    def _send_request(self, image, prompt):
+        """Send a prepared image and prompt to the provider.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Returns:
+            dict: The analysis result in the OpenRouter response format,
+                or ``{"error": ...}`` if the request failed
+        """
+        raise NotImplementedError
+
+    async def _send_request_async(self, image, prompt):
+        """Send a prepared image and prompt to the provider from a coroutine.
+
+        Providers without an asyncio API run _send_request in a worker thread.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Returns:
+            dict: The analysis result, as returned by _send_request
+        """
+        return await asyncio.to_thread(self._send_request, image, prompt)
+
+    def _send_group_request(self, images, labels, prompt):
+        """Send several prepared images in one request with a structured answer per image.
+
+        Args:
+            images (list): The prepared images
+            labels (list): Label of each image, in the same order
+            prompt (str): The analysis prompt
+
+        Returns:
+            list: One result per image in the OpenRouter response format (all ``{"error": ...}``
+                if the request failed), or None if the answer could not be split per image
+        """
+        raise NotImplementedError
+
+    def _stream_request(self, image, prompt):
+        """Send a prepared image and prompt to the provider, streaming the answer.
+
+        Providers without streaming support send the whole answer as one chunk.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Yields:
+            str: Chunks of the answer text as they are generated
+
+        Raises:
+            Exception: If the request failed
+        """
+        result = self._send_request(image, prompt)
+        if 'error' in result:
+            raise RuntimeError(result['error'])
+        if result.get('choices'):
+            yield result['choices'][0]['message']['content']
+
+    def _cache_identity(self):
+        """Return what identifies this client's answers in cache keys besides image and prompt.
+
+        Returns:
+            str: The model name; subclasses add parameters that change the answers
+        """
+        return self.model
+
+    def _get_cached(self, image, prompt):
+        """Look up the cached result of a prepared image and prompt.
+
+        Returns:
+            tuple: The cache key (None if caching is disabled) and the cached result or None
+        """
+        if self.cache is None:
+            return None, None
+        cache_key = make_cache_key(image.data, prompt, self._cache_identity())
+        return cache_key, self.cache.get(cache_key)
+
+    def _flight_key(self, image, prompt, cache_key):
+        """Key shared by the concurrent analyses of the same image, prompt and model."""
+        return cache_key or make_cache_key(image.data, prompt, self._cache_identity())
+
+    def analyze_screenshot(self, screenshot, prompt=None):
+        """Analyze a screenshot, reusing a cached result when available.
+
+        Args:
+            screenshot (str | bytes | file): Path to the screenshot file, its bytes, or a
+                file-like object such as an uploaded file
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            dict: The analysis results from the provider
+        """
+        _check_exists(screenshot)
+
+        # Default prompt if none provided
+        if not prompt:
+            prompt = self.default_prompt
+
+        # Resize and re-encode the image if needed
+        image = self._prepare_image(screenshot)
+
+        cache_key, cached = self._get_cached(image, prompt)
+        if cached is not None:
+            return cached
+
+        def fetch():
+            # Rate limited, retried on transient failures
+            result = self._call_upstream(self._send_request, image, prompt)
+
+            # Errors are not cached so that transient failures are retried on the next run
+            if cache_key is not None and 'error' not in result:
+                self.cache.set(cache_key, result)
+            return result
+
+        if self.single_flight is None:
+            return fetch()
+        # Concurrent analyses of the same image, prompt and model wait for one upstream request
+        return self.single_flight.do(self._flight_key(image, prompt, cache_key), fetch)
+
+    async def analyze_screenshot_async(self, screenshot, prompt=None):
+        """Analyze a screenshot from a coroutine, reusing a cached result when available.
+
+        Args:
+            screenshot (str | bytes | file): Path to the screenshot file, its bytes, or a
+                file-like object such as an uploaded file
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            dict: The analysis results from the provider
+        """
+        _check_exists(screenshot)
+
+        if not prompt:
+            prompt = self.default_prompt
+
+        # Image preparation and the on-disk cache tier block, so they run in worker threads
+        image = await asyncio.to_thread(self._prepare_image, screenshot)
+
+        cache_key, cached = await asyncio.to_thread(self._get_cached, image, prompt)
+        if cached is not None:
+            return cached
+
+        async def fetch():
+            result = await self._call_upstream_async(self._send_request_async, image, prompt)
+
+            if cache_key is not None and 'error' not in result:
+                await asyncio.to_thread(self.cache.set, cache_key, result)
+            return result
+
+        if self.single_flight is None:
+            return await fetch()
+        # Shares the flights of analyze_screenshot, so sync and async callers wait for each other
+        return await self.single_flight.do_async(self._flight_key(image, prompt, cache_key), fetch)
+
+    def analyze_screenshot_stream(self, screenshot, prompt=None):
+        """Analyze a screenshot, yielding the answer as it is generated.
+
+        Args:
+            screenshot (str | bytes | file): Path to the screenshot file, its bytes, or a
+                file-like object such as an uploaded file
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Yields:
+            tuple: ``('delta', text)`` for each chunk of the answer, then ``('result', dict)``
+                with the complete result in the format returned by analyze_screenshot
+        """
+        _check_exists(screenshot)
+
+        if not prompt:
+            prompt = self.default_prompt
+
+        image = self._prepare_image(screenshot)
+
+        cache_key, cached = self._get_cached(image, prompt)
+        if cached is not None:
+            if cached.get('choices'):
+                yield 'delta', cached['choices'][0]['message']['content']
+            yield 'result', cached
+            return
+
+        if self.single_flight is None:
+            yield from self._stream_upstream(image, prompt, cache_key)
+            return
+
+        flight_key = self._flight_key(image, prompt, cache_key)
+        flight = self.single_flight.begin(flight_key)
+        if flight is not None:
+            # An identical analysis is in flight; relay its answer once it is complete
+            result = flight.wait()
+            if result.get('choices'):
+                yield 'delta', result['choices'][0]['message']['content']
+            yield 'result', result
+            return
+
+        result = error = None
+        try:
+            for kind, value in self._stream_upstream(image, prompt, cache_key):
+                if kind == 'result':
+                    result = value
+                yield kind, value
+        except BaseException as e:
+            # Also when the consumer stops reading before the result
+            error = e if isinstance(e, Exception) else RuntimeError(f"{self.provider} stream was abandoned")
+            raise
+        finally:
+            self.single_flight.end(flight_key, result=result, error=None if result is not None else error)
+
+    def _stream_upstream(self, image, prompt, cache_key):
+        """Stream the answer for a prepared image from the provider, retrying before the first chunk.
+
+        Yields:
+            tuple: As analyze_screenshot_stream
+        """
+        parts = []
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                self.resilience.record_short_circuit()
+                yield 'result', {"error": f"{self.provider} circuit breaker is open", "status": 503}
+                return
+
+            self._apply_rate_limit()
+            started = time.monotonic()
+            attempt += 1
+            try:
+                for text in self._stream_request(image, prompt):
+                    parts.append(text)
+                    yield 'delta', text
+            except Exception as e:
+                result = error_result(e)
+                self._notify_request(started, result)
+                if not is_retryable_error(result):
+                    self.circuit_breaker.record_success()
+                    yield 'result', result
+                    return
+                self.circuit_breaker.record_failure()
+                # Chunks already relayed cannot be taken back, so only retry before the first one
+                delay = None if parts else self.retry_policy.delay(attempt, result.get('retry_after'))
+                if delay is None:
+                    yield 'result', result
+                    return
+                self.resilience.record_retry()
+                time.sleep(delay)
+                continue
+
+            self.circuit_breaker.record_success()
+            break
+
+        result = {"choices": [{"message": {"content": ''.join(parts), "role": "assistant"}}]}
+        self._tag_result(result, time.monotonic() - started)
+        self.metrics.observe(self.provider, 'upstream_seconds', time.monotonic() - started)
+        self._notify_request(started, result)
+        if cache_key is not None:
+            self.cache.set(cache_key, result)
+        yield 'result', result
+
+    def analyze_screenshot_group(self, screenshots, prompt=None):
+        """Analyze several related screenshots with as few requests as possible.
+
+        Screenshots with a cached result are not sent again; the rest are packed
+        into requests of up to ``max_images_per_request`` images. If an answer
+        cannot be split per image, those screenshots are analyzed one by one.
+
+        Args:
+            screenshots (list): ``(label, screenshot)`` tuples, where screenshot is a path,
+                bytes or a file-like object; labels identify each image to the model
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            list: The analysis result of each screenshot, in order
+        """
+        for _, screenshot in screenshots:
+            _check_exists(screenshot)
+
+        if not prompt:
+            prompt = self.default_prompt
+
+        images = [self._prepare_image(screenshot) for _, screenshot in screenshots]
+        cached = [self._get_cached(image, prompt) for image in images]
+        results = [result for _, result in cached]
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        # Screenshots already being analyzed by another caller are waited for instead of sent.
+        # Joining does not wait for other processes, which could be waiting on this group in turn.
+        claimed = {}
+        joined = {}
+        if self.single_flight is not None:
+            for i in pending:
+                key = self._flight_key(images[i], prompt, cached[i][0])
+                flight = self.single_flight.begin(key, wait=False)
+                if flight is None:
+                    claimed[i] = key
+                else:
+                    joined[i] = flight
+            pending = list(claimed)
+
+        try:
+            size = max(1, self.max_images_per_request)
+            for start in range(0, len(pending), size):
+                chunk = pending[start:start + size]
+                packed = None
+                if len(chunk) > 1:
+                    packed = self._call_upstream(
+                        self._send_group_request, [images[i] for i in chunk], [screenshots[i][0] for i in chunk],
+                        prompt
+                    )
+                if packed is None:
+                    packed = [self._call_upstream(self._send_request, images[i], prompt) for i in chunk]
+
+                for i, result in zip(chunk, packed):
+                    results[i] = result
+                    cache_key = cached[i][0]
+                    if cache_key is not None and 'error' not in result:
+                        self.cache.set(cache_key, result)
+                    if i in claimed:
+                        self.single_flight.end(claimed.pop(i), result=result)
+        finally:
+            # Calls this group claimed but did not make because a request raised
+            for key in claimed.values():
+                self.single_flight.end(key, error=RuntimeError(f"{self.provider} group analysis failed"))
+
+        for i, flight in joined.items():
+            results[i] = flight.wait()
+        return results
+
+    def batch_analyze_screenshots(self, screenshot_dir, language=None, theme=None, max_workers=None):
+        """Analyze multiple screenshots in a directory.
+
+        Args:
+            screenshot_dir (str): Directory containing screenshots
+            language (str, optional): Filter screenshots by language
+            theme (str, optional): Filter screenshots by theme (light/dark)
+            max_workers (int, optional): Number of requests in flight at once.
+                Defaults to the AI_BATCH_CONCURRENCY setting.
+
+        Returns:
+            dict: Analysis results for each screenshot
+        """
+        if not os.path.isdir(screenshot_dir):
+            raise NotADirectoryError(f"{screenshot_dir} is not a valid directory")
+
+        # Imported here because the catalog models need the Django app registry
+        from .catalog import find_screenshots
+
+        screenshots = find_screenshots(screenshot_dir, language=language, theme=theme)
+
+        jobs = [(screenshot, os.path.join(screenshot_dir, screenshot), None) for screenshot in screenshots]
+        return analyze_many(self, jobs, max_workers=max_workers)
+
+    def cache_stats(self):
+        """Return the result cache counters.
+
+        Returns:
+            dict: Hit/miss counters, or None if caching is disabled
+        """
+        return self.cache.stats() if self.cache is not None else None
+
+    def payload_stats(self):
+        """Return the image payload counters.
+
+        Returns:
+            dict: Image count and original, sent and saved bytes
+        """
+        return self.image_stats.as_dict()
+
+    def resilience_stats(self):
+        """Return the retry and circuit breaker counters.
+
+        Returns:
+            dict: Number of retries and short-circuited requests
+        """
+        return self.resilience.as_dict()
+
+
+def _check_exists(screenshot):
+    """Raise FileNotFoundError if a screenshot given by path does not exist."""
+    if image_prep.is_path(screenshot) and not os.path.exists(screenshot):
+        raise FileNotFoundError(f"Screenshot not found at {screenshot}")
+
+
+def _retryable_error(result):
+    """Return the error of a result if it is worth retrying, else None.
+
+    Multi-image requests are retried only if every image failed.
+    """
+    if isinstance(result, list):
+        if result and all(is_retryable_error(r) for r in result):
+            return result[0]
+        return None
+    if result is not None and is_retryable_error(result):
+        return result
+    return None
+
+
+def error_result(exc):
+    """Build the result returned for a failed request.
+
+    Args:
+        exc (Exception): The error raised by the HTTP client or provider SDK
+
+    Returns:
+        dict: ``{"error": message}``, with the HTTP ``status`` when the error carries one
+    """
+    result = {"error": str(exc)}
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status is None:
+        # google.api_core exceptions carry the HTTP status as ``code``
+        status = getattr(exc, 'code', None)
+    if isinstance(status, int):
+        result["status"] = int(status)
+        headers = getattr(response, 'headers', None)
+        retry_after = parse_retry_after(headers.get('Retry-After')) if hasattr(headers, 'get') else None
+        if retry_after is not None:
+            result["retry_after"] = retry_after
+    elif _is_network_error(exc):
+        result["retryable"] = True
+    return result
+
+
+def _is_network_error(exc):
+    # requests' connection errors and timeouts are OSErrors; httpx has its own hierarchy
+    return isinstance(exc, OSError) or any(cls.__name__ == 'TransportError' for cls in type(exc).__mro__)
+
+
+def _prefetches_images(client):
+    """Return whether a client takes images prepared ahead of time, like BaseScreenshotClient and RouterClient.
+
+    Checked on the class, so that mocks standing in for a client do not qualify.
+    """
+    return all(
+        callable(getattr(type(client), name, None)) for name in ('image_options', 'prefetch_image', 'clear_prefetched')
+    )
+
+
+def analyze_many(client, jobs, max_workers=None, on_result=None, prep_workers=None):
+    """Analyze several screenshots with a bounded number of requests in flight.
+
+    Requests overlap their upstream latency while the client's rate limiter
+    still enforces the provider quota. They wait for it with BATCH priority,
+    so interactive requests sharing the limiter are served first.
+
+    For provider clients and the router, images are prepared ahead of time in
+    a pool of ``prep_workers`` processes, so CPU-bound decoding and encoding
+    overlaps with the upstream calls.
+
+    Args:
+        client: Client exposing ``analyze_screenshot(path, prompt=None)``
+        jobs (list): ``(key, screenshot_path, prompt)`` tuples; a None prompt uses the client default
+        max_workers (int, optional): Number of concurrent requests.
+            Defaults to the AI_BATCH_CONCURRENCY setting.
+        on_result (callable, optional): Called as ``on_result(key, result)`` in the calling
+            thread as each analysis completes
+        prep_workers (int, optional): Number of image preparation processes; 0 prepares
+            images in the request threads. Defaults to the AI_PREP_WORKERS setting.
+
+    Returns:
+        dict: Analysis results keyed like ``jobs``, in the order of ``jobs``
+    """
+    jobs = list(jobs)
+    if max_workers is None:
+        max_workers = getattr(settings, 'AI_BATCH_CONCURRENCY', 1)
+    if prep_workers is None:
+        prep_workers = getattr(settings, 'AI_PREP_WORKERS', 0)
+
+    def analyze(path, prompt):
+        with rate_limit_priority(BATCH):
+            if prompt is None:
+                return client.analyze_screenshot(path)
+            return client.analyze_screenshot(path, prompt=prompt)
+
+    if prep_workers > 0 and len(jobs) > 1 and _prefetches_images(client):
+        results = _analyze_pipelined(client, jobs, analyze, max(1, max_workers), prep_workers, on_result)
+        return {key: results[key] for key, _, _ in jobs}
+
+    results = _run_concurrently(
+        analyze, [(key, (path, prompt)) for key, path, prompt in jobs], max_workers, on_result
+    )
+    return {key: results[key] for key, _, _ in jobs}
+
+
+def iter_analyses(client, jobs, max_workers=None):
+    """Analyze several screenshots concurrently, yielding each result as it completes.
+
+    Unlike analyze_many, results are not collected: at most ``max_workers``
+    requests are submitted at a time and each result is handed to the caller
+    as soon as it arrives, so memory stays bounded however large the batch.
+    Closing the generator stops submitting the remaining jobs.
+
+    Args:
+        client: Client exposing ``analyze_screenshot(path, prompt=None)``
+        jobs (iterable): ``(key, screenshot_path, prompt)`` tuples; a None prompt uses the client default
+        max_workers (int, optional): Number of concurrent requests.
+            Defaults to the AI_BATCH_CONCURRENCY setting.
+
+    Yields:
+        tuple: ``(key, result)`` in completion order
+    """
+    if max_workers is None:
+        max_workers = getattr(settings, 'AI_BATCH_CONCURRENCY', 1)
+    max_workers = max(1, max_workers)
+
+    def analyze(path, prompt):
+        with rate_limit_priority(BATCH):
+            if prompt is None:
+                return client.analyze_screenshot(path)
+            return client.analyze_screenshot(path, prompt=prompt)
+
+    jobs = iter(jobs)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    try:
+        while True:
+            # Keep the pool busy without queuing the whole batch
+            for key, path, prompt in itertools.islice(jobs, max_workers - len(pending)):
+                pending[executor.submit(analyze, path, prompt)] = key
+            if not pending:
+                return
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield pending.pop(future), future.result()
+    finally:
+        # Requests in flight finish in the background if the consumer went away
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def analyze_many_async(client, jobs, max_workers=None, on_result=None):
+    """Analyze several screenshots on the event loop with a bounded number of requests in flight.
+
+    The asyncio counterpart of analyze_many, for clients whose provider SDK has
+    an asyncio API: requests overlap without a thread per request.
+
+    Args:
+        client: Client exposing ``analyze_screenshot_async(path, prompt=None)``
+        jobs (list): ``(key, screenshot_path, prompt)`` tuples; a None prompt uses the client default
+        max_workers (int, optional): Number of concurrent requests.
+            Defaults to the AI_BATCH_CONCURRENCY setting.
+        on_result (callable, optional): Called as ``on_result(key, result)`` as each analysis completes
+
+    Returns:
+        dict: Analysis results keyed like ``jobs``, in the order of ``jobs``
+    """
+    jobs = list(jobs)
+    if max_workers is None:
+        max_workers = getattr(settings, 'AI_BATCH_CONCURRENCY', 1)
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    results = {}
+
+    async def analyze(key, path, prompt):
+        async with semaphore:
+            results[key] = await client.analyze_screenshot_async(path, prompt=prompt)
+        if on_result:
+            on_result(key, results[key])
+
+    # Tasks copy the context, so every request waits for the rate limiter with BATCH priority
+    with rate_limit_priority(BATCH):
+        await asyncio.gather(*(analyze(key, path, prompt) for key, path, prompt in jobs))
+    return {key: results[key] for key, _, _ in jobs}
+
+
+def analyze_groups(client, groups, max_workers=None, on_result=None):
+    """Analyze groups of related screenshots, one multi-image request per group.
+
+    Groups are analyzed concurrently like the jobs of analyze_many.
+
+    Args:
+        client: Client exposing ``analyze_screenshot_group(screenshots, prompt=None)``
+        groups (list): ``(screenshots, prompt)`` tuples as returned by packing.group_jobs,
+            where ``screenshots`` is a list of ``(key, screenshot_path, label)`` tuples
+        max_workers (int, optional): Number of concurrent requests.
+            Defaults to the AI_BATCH_CONCURRENCY setting.
+        on_result (callable, optional): Called as ``on_result(key, result)`` in the calling
+            thread for each screenshot as its group completes
+
+    Returns:
+        dict: Analysis results keyed by screenshot key, in the order of ``groups``
+    """
+    groups = list(groups)
+    if max_workers is None:
+        max_workers = getattr(settings, 'AI_BATCH_CONCURRENCY', 1)
+
+    def analyze(screenshots, prompt):
+        with rate_limit_priority(BATCH):
+            return client.analyze_screenshot_group([(label, path) for _, path, label in screenshots], prompt=prompt)
+
+    def on_group(index, group_results):
+        if on_result:
+            for (key, _, _), result in zip(groups[index][0], group_results):
+                on_result(key, result)
+
+    results = _run_concurrently(analyze, list(enumerate(groups)), max_workers, on_group)
+    return {
+        key: result
+        for index, (screenshots, _) in enumerate(groups)
+        for (key, _, _), result in zip(screenshots, results[index])
+    }
+
+
+def _run_concurrently(func, items, max_workers, on_result=None):
+    """Call ``func(*args)`` for each ``(key, args)`` item on a bounded thread pool.
+
+    Returns:
+        dict: Return values keyed like ``items``
+    """
+    results = {}
+    if max_workers <= 1 or len(items) <= 1:
+        for key, args in items:
+            results[key] = func(*args)
+            if on_result:
+                on_result(key, results[key])
+        return results
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = {executor.submit(func, *args): key for key, args in items}
+        for future in as_completed(futures):
+            key = futures[future]
+            results[key] = future.result()
+            if on_result:
+                on_result(key, results[key])
+    finally:
+        # Don't start queued requests if one of them raised
+        executor.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _analyze_pipelined(client, jobs, analyze, max_workers, prep_workers, on_result):
+    """Run the image preparation and network stages of a batch concurrently.
+
+    A producer thread submits every image to a process pool and feeds the
+    pending preparations into a bounded queue, so at most a few prepared
+    images wait in memory. Network threads take them off the queue, hand the
+    prepared image to the client and analyze the screenshot.
+
+    Returns:
+        dict: Analysis results keyed like ``jobs``
+    """
+    options = client.image_options()
+    consumers = min(max_workers, len(jobs))
+    work = queue.Queue(maxsize=consumers * 2)
+    done = queue.Queue()
+    cancelled = threading.Event()
+    prep_pool = ProcessPoolExecutor(max_workers=prep_workers)
+
+    def produce():
+        try:
+            for key, path, prompt in jobs:
+                if cancelled.is_set():
+                    break
+                work.put((key, path, prompt, prep_pool.submit(image_prep.prepare_image, path, **options)))
+        finally:
+            for _ in range(consumers):
+                work.put(None)
+
+    def consume():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            key, path, prompt, future = item
+            if cancelled.is_set():
+                future.cancel()
+                continue
+            try:
+                client.prefetch_image(path, future.result())
+            except Exception:
+                # analyze_screenshot prepares the image itself and reports the error
+                pass
+            try:
+                done.put((key, analyze(path, prompt), None))
+            except Exception as e:
+                done.put((key, None, e))
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=consume, daemon=True) for _ in range(consumers)]
+    for thread in threads:
+        thread.start()
+
+    results = {}
+    try:
+        for _ in range(len(jobs)):
+            key, result, error = done.get()
+            if error is not None:
+                raise error
+            results[key] = result
+            if on_result:
+                on_result(key, result)
+    finally:
+        # Don't start queued requests if one of them raised
+        cancelled.set()
+        for thread in threads:
+            thread.join()
+        prep_pool.shutdown(wait=True, cancel_futures=True)
+        client.clear_prefetched()
+
+    return results
@@ -0,0 +1,285 @@
+"""Result cache for AI screenshot analysis.
+
+Analysis results are keyed on the content hash of the prepared image bytes,
+the prompt and the model name, so re-analyzing an unchanged screenshot does
+not re-upload or re-pay for it. Entries are kept in a bounded in-memory LRU
+tier backed by an on-disk tier that survives process restarts.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+
+def make_cache_key(image_bytes, prompt, model):
+    """Build the cache key for an analysis request.
+
+    Args:
+        image_bytes (bytes): The prepared image bytes sent to the provider
+        prompt (str): The prompt used for the analysis
+        model (str): The provider model name
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    for part in (prompt or '', model or ''):
+        digest.update(b'\0')
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """Thread-safe LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=256, ttl=None):
+        """Initialize the memory tier.
+
+        Args:
+            max_entries (int): Maximum number of entries kept in memory
+            ttl (float, optional): Entry lifetime in seconds. None disables expiry.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entries."""
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCache:
+    """On-disk JSON cache with TTL and total-size based eviction.
+
+    Entries are stored as ``<dir>/<key[:2]>/<key>.json`` and written
+    atomically, so several processes can share the same directory.
+    """
+
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        """Initialize the disk tier.
+
+        Args:
+            directory (str): Directory holding the cache files
+            ttl (float, optional): Entry lifetime in seconds. None disables expiry.
+            max_bytes (int, optional): Size budget for the directory. None disables eviction.
+        """
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _iter_files(self):
+        if not self.directory.is_dir():
+            return
+        for shard in self.directory.iterdir():
+            if shard.is_dir():
+                yield from shard.glob('*.json')
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl and entry.get('created_at', 0) + self.ttl < time.time():
+            self._remove(path)
+            return None
+        return entry.get('value')
+
+    def set(self, key, value):
+        """Store value under key, evicting the oldest entries over the size budget."""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({'created_at': time.time(), 'value': value}).encode('utf-8')
+
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self.max_bytes:
+            with self._lock:
+                if self._size is None:
+                    self._size = sum(p.stat().st_size for p in self._iter_files())
+                else:
+                    self._size += len(data)
+                if self._size > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then the oldest ones until under 90% of the budget."""
+        files = []
+        for p in self._iter_files():
+            try:
+                stat = p.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, p))
+        files.sort()
+
+        now = time.time()
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for mtime, size, p in files:
+            expired = self.ttl and mtime + self.ttl < now
+            if not expired and total <= target:
+                break
+            self._remove(p)
+            total -= size
+        self._size = total
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            for p in list(self._iter_files()):
+                self._remove(p)
+            self._size = 0
+
+
+class AnalysisCache:
+    """Two-tier (memory + disk) cache for analysis results with hit/miss counters."""
+
+    def __init__(self, memory=None, disk=None):
+        """Initialize the cache.
+
+        Args:
+            memory (MemoryCache, optional): In-memory LRU tier
+            disk (DiskCache, optional): Persistent tier
+        """
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    def get(self, key):
+        """Look up key in the memory tier, then the disk tier.
+
+        Returns:
+            dict: The cached analysis result, or None on a miss
+        """
+        value = self.memory.get(key) if self.memory is not None else None
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        value = self.disk.get(key) if self.disk is not None else None
+        if value is not None:
+            if self.memory is not None:
+                self.memory.set(key, value)
+            self._count('disk_hits')
+            return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        """Store value in every tier."""
+        if self.memory is not None:
+            self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        """Remove all entries from every tier."""
+        if self.memory is not None:
+            self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            if counter != 'misses':
+                self.hits += 1
+
+    def stats(self):
+        """Return the hit/miss counters.
+
+        Returns:
+            dict: Counters for hits, misses and per-tier hits
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """Get the process-wide analysis cache configured from settings.
+
+    Returns:
+        AnalysisCache: The shared cache instance
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            ttl = getattr(settings, 'AI_CACHE_TTL', None)
+            _default_cache = AnalysisCache(
+                memory=MemoryCache(
+                    max_entries=getattr(settings, 'AI_CACHE_MEMORY_ENTRIES', 256),
+                    ttl=ttl,
+                ),
+                disk=DiskCache(
+                    getattr(settings, 'AI_CACHE_DIR', Path(settings.BASE_DIR) / '.ai_cache'),
+                    ttl=ttl,
+                    max_bytes=getattr(settings, 'AI_CACHE_MAX_DISK_BYTES', None),
+                ),
+            )
+        return _default_cache
@@ -0,0 +1,182 @@
+"""Persisted catalog of the screenshots of a directory.
+
+Batch analyses used to list the screenshots directory on every call and
+select screenshots by substring matching on their names, which also matched
+pages whose name contains ``_en_`` or ``_dark_``. The catalog stores each
+screenshot's page, language, theme, capture time, size and content hash in
+indexed columns, so the entry points filter with a query on exact values.
+
+The catalog is refreshed incrementally before it is queried: the directory
+is only listed again when its modification time changed (a screenshot was
+added, removed or renamed) or the last scan is older than AI_CATALOG_MAX_AGE,
+and only files whose size or modification time changed are hashed again.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Screenshot, ScreenshotDirectory
+
+TIMESTAMP_FORMAT = '%Y%m%d-%H%M%S'
+HASH_CHUNK_SIZE = 1024 * 1024
+UPDATE_FIELDS = ['page', 'language', 'theme', 'captured_at', 'size', 'mtime', 'content_hash']
+
+
+def parse_screenshot_name(file_name):
+    """Extract the metadata of a ``page_lang_theme_timestamp.png`` file name.
+
+    With a timestamp, the language and theme are the two parts before it and
+    the page is everything ahead of them, so page names may contain
+    underscores. Without one, the first three parts are used.
+
+    Args:
+        file_name (str): Screenshot file name
+
+    Returns:
+        tuple: ``(page, language, theme, captured_at)``; blank strings and None for
+            names not following the format
+    """
+    parts = file_name[:-len('.png')].split('_') if file_name.endswith('.png') else file_name.split('_')
+    captured_at = None
+    if len(parts) >= 4:
+        try:
+            captured_at = datetime.strptime(parts[-1], TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    if captured_at is not None:
+        captured_at = timezone.make_aware(captured_at, timezone.get_current_timezone())
+        return '_'.join(parts[:-3]), parts[-3], parts[-2], captured_at
+    if len(parts) >= 3:
+        return parts[0], parts[1], parts[2], None
+    return '', '', '', None
+
+
+def file_hash(path):
+    """Compute the SHA-256 of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan(directory):
+    """Bring the catalog of a directory up to date with the filesystem.
+
+    Args:
+        directory (ScreenshotDirectory): The catalogued directory
+
+    Returns:
+        dict: Number of screenshots found, added or changed, and removed
+    """
+    # Taken before listing, so a file added during the scan triggers the next one
+    mtime = os.stat(directory.path).st_mtime
+    known = {
+        file_name: (size, file_mtime)
+        for file_name, size, file_mtime in directory.screenshots.values_list('file_name', 'size', 'mtime')
+    }
+
+    seen = set()
+    changed = []
+    with os.scandir(directory.path) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.png'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                seen.add(entry.name)
+                if known.get(entry.name) == (stat.st_size, stat.st_mtime):
+                    continue
+                content_hash = file_hash(entry.path)
+            except FileNotFoundError:
+                # Deleted while scanning
+                seen.discard(entry.name)
+                continue
+
+            page, language, theme, captured_at = parse_screenshot_name(entry.name)
+            changed.append(Screenshot(
+                directory=directory,
+                file_name=entry.name,
+                page=page,
+                language=language,
+                theme=theme,
+                captured_at=captured_at,
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+                content_hash=content_hash,
+            ))
+
+    removed = [file_name for file_name in known if file_name not in seen]
+    with transaction.atomic():
+        if changed:
+            # Upsert, in case another process catalogued the same files meanwhile
+            Screenshot.objects.bulk_create(
+                changed,
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['directory', 'file_name'],
+                update_fields=UPDATE_FIELDS,
+            )
+        if removed:
+            directory.screenshots.filter(file_name__in=removed).delete()
+        directory.mtime = mtime
+        directory.scanned_at = timezone.now()
+        directory.save(update_fields=['mtime', 'scanned_at'])
+
+    return {'found': len(seen), 'changed': len(changed), 'removed': len(removed)}
+
+
+def refresh(screenshots_dir, max_age=None):
+    """Return the catalogued directory, scanning it first if it may have changed.
+
+    Args:
+        screenshots_dir (str): Screenshots directory
+        max_age (float, optional): Seconds after which the directory is scanned even
+            though its modification time is unchanged, to catch files rewritten in
+            place. Defaults to the AI_CATALOG_MAX_AGE setting; 0 always scans.
+
+    Returns:
+        ScreenshotDirectory: The up-to-date directory
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'AI_CATALOG_MAX_AGE', 300)
+
+    path = os.path.abspath(screenshots_dir)
+    mtime = os.stat(path).st_mtime
+    directory, _ = ScreenshotDirectory.objects.get_or_create(path=path)
+    fresh = (
+        directory.scanned_at is not None
+        and timezone.now() - directory.scanned_at < timedelta(seconds=max_age)
+    )
+    if directory.mtime != mtime or not fresh:
+        scan(directory)
+    return directory
+
+
+def find_screenshots(screenshots_dir, language=None, theme=None, page=None):
+    """List the screenshots of a directory matching the filters.
+
+    Args:
+        screenshots_dir (str): Directory containing ``page_lang_theme_timestamp.png`` files
+        language (str, optional): Only screenshots in this language
+        theme (str, optional): Only screenshots with this theme
+        page (str, optional): Only screenshots of this page
+
+    Returns:
+        list: Matching file names, sorted
+    """
+    screenshots = Screenshot.objects.filter(directory=refresh(screenshots_dir))
+    if language:
+        screenshots = screenshots.filter(language=language)
+    if theme:
+        screenshots = screenshots.filter(theme=theme)
+    if page:
+        screenshots = screenshots.filter(page=page)
+    return list(screenshots.values_list('file_name', flat=True))
@@ -0,0 +1,245 @@
+"""Perceptual-hash deduplication of screenshots before analysis.
+
+debug_screenshots usually holds several captures of the same page, language
+and theme that only differ by their timestamp. Each screenshot is reduced to
+a 64-bit perceptual hash (dHash or pHash); screenshots whose hashes are
+within a Hamming distance of each other and that would be analyzed with the
+same prompt are analyzed once and share the result. The most recent capture
+of each group is the one analyzed.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .catalog import parse_screenshot_name
+
+HASH_SIZE = 8
+
+
+def dhash(img, hash_size=HASH_SIZE):
+    """Compute the difference hash of an image.
+
+    Args:
+        img (PIL.Image.Image): The image
+        hash_size (int): Width and height of the hash grid
+
+    Returns:
+        int: The hash as a ``hash_size ** 2`` bit integer
+    """
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] *= np.sqrt(1.0 / n)
+    matrix[1:] *= np.sqrt(2.0 / n)
+    return matrix
+
+
+def phash(img, hash_size=HASH_SIZE, highfreq_factor=4):
+    """Compute the DCT-based perceptual hash of an image.
+
+    Args:
+        img (PIL.Image.Image): The image
+        hash_size (int): Width and height of the low-frequency block kept
+        highfreq_factor (int): Oversampling of the image before the DCT
+
+    Returns:
+        int: The hash as a ``hash_size ** 2`` bit integer
+    """
+    size = hash_size * highfreq_factor
+    small = img.convert('L').resize((size, size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return _pack_bits(low > np.median(low))
+
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+HASH_FUNCTIONS = {
+    'dhash': dhash,
+    'phash': phash,
+}
+
+
+def hamming_distances(value, values):
+    """Return the Hamming distances between one hash and an array of hashes.
+
+    Args:
+        value (int): A 64-bit hash
+        values (numpy.ndarray): Hashes as ``uint64``
+
+    Returns:
+        numpy.ndarray: The number of differing bits for each entry of ``values``
+    """
+    xor = np.bitwise_xor(values, np.uint64(value))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class HashIndex:
+    """Thread-safe LRU index of perceptual hashes.
+
+    Entries are keyed by path, modification time and size, so a screenshot is
+    only decoded again after it has been rewritten.
+    """
+
+    def __init__(self, method='dhash', max_entries=4096):
+        """Initialize the index.
+
+        Args:
+            method (str): Hash algorithm, 'dhash' or 'phash'
+            max_entries (int): Number of hashes kept
+        """
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown perceptual hash method: {method}")
+        self.method = method
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_path):
+        """Return the perceptual hash of an image.
+
+        Args:
+            image_path (str): Path to the image file
+
+        Returns:
+            int: The hash, or None if the file cannot be read as an image
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        try:
+            with Image.open(image_path) as img:
+                value = HASH_FUNCTIONS[self.method](img)
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_hash_index(method=None):
+    """Get the process-wide hash index.
+
+    Args:
+        method (str, optional): Hash algorithm. Defaults to the AI_DEDUP_HASH setting.
+
+    Returns:
+        HashIndex: The index for ``method``
+    """
+    method = method or getattr(settings, 'AI_DEDUP_HASH', 'dhash')
+    with _indexes_lock:
+        if method not in _indexes:
+            _indexes[method] = HashIndex(method)
+        return _indexes[method]
+
+
+def _capture_time(job):
+    """Return when the screenshot of a job was taken, as a POSIX timestamp.
+
+    The timestamp of the file name is used, falling back to the file's
+    modification time, or 0 if neither is available.
+    """
+    key, path, _ = job
+    captured_at = parse_screenshot_name(os.path.basename(key))[3]
+    if captured_at is not None:
+        return captured_at.timestamp()
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return 0.0
+
+
+def deduplicate(jobs, threshold=None, index=None):
+    """Group near-identical screenshots so each group is analyzed once.
+
+    Only screenshots analyzed with the same prompt are grouped. The newest
+    capture of each group is analyzed and the older ones reuse its result.
+    Screenshots that cannot be hashed are always analyzed.
+
+    Args:
+        jobs (list): ``(key, screenshot_path, prompt)`` tuples
+        threshold (int, optional): Maximum Hamming distance between two hashes for the
+            screenshots to be considered identical; negative disables deduplication.
+            Defaults to the AI_DEDUP_THRESHOLD setting.
+        index (HashIndex, optional): Hash index to use. Defaults to get_hash_index().
+
+    Returns:
+        tuple: The jobs to analyze, in their original order, and a dict mapping the key
+            of each skipped screenshot to the key of the job whose result it reuses
+    """
+    jobs = list(jobs)
+    if threshold is None:
+        threshold = getattr(settings, 'AI_DEDUP_THRESHOLD', 4)
+    if threshold < 0 or len(jobs) < 2:
+        return jobs, {}
+    index = index or get_hash_index()
+
+    unique = []
+    duplicates = {}
+    # Per prompt: keys and hashes of the screenshots that will be analyzed
+    groups = {}
+    # Newest first, so each group is represented by its most recent capture
+    order = sorted(range(len(jobs)), key=lambda i: _capture_time(jobs[i]), reverse=True)
+    for i in order:
+        key, path, prompt = jobs[i]
+        value = index.get(path)
+        if value is None:
+            unique.append(i)
+            continue
+
+        keys, hashes = groups.setdefault(prompt, ([], []))
+        if hashes:
+            distances = hamming_distances(value, np.array(hashes, dtype=np.uint64))
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= threshold:
+                duplicates[key] = keys[nearest]
+                continue
+        keys.append(key)
+        hashes.append(value)
+        unique.append(i)
+
+    return [jobs[i] for i in sorted(unique)], duplicates
+
+
+def expand_results(results, duplicates):
+    """Fill in the results of skipped screenshots.
+
+    Args:
+        results (dict): Analysis results of the analyzed jobs
+        duplicates (dict): Skipped keys mapped to the key whose result they reuse
+
+    Returns:
+        dict: ``results`` with an entry for every skipped screenshot
+    """
+    for key, source in duplicates.items():
+        if source in results:
+            results[key] = results[source]
+    return results
@@ -0,0 +1,45 @@
+"""Deferred loading of the project's .env file.
+
+The AI clients read their API keys from ``.env``. The file is loaded on
+first use rather than at import time, so importing the API modules (which
+every Django process does through the URLconf) stays cheap.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_env():
+    """Load the .env file in BASE_DIR into the environment, once per process.
+
+    Variables already set in the environment are not overridden.
+    """
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv(dotenv_path=Path(settings.BASE_DIR) / '.env')
+            _loaded = True
+
+
+def getenv(name, default=None):
+    """Return an environment variable, loading the .env file first.
+
+    Args:
+        name (str): Variable name
+        default (str, optional): Value returned if the variable is not set
+
+    Returns:
+        str: The value of the variable, or ``default``
+    """
+    load_env()
+    return os.getenv(name, default)
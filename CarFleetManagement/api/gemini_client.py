@@ -1,130 +1,157 @@
 """Gemini API client for the Car Fleet Management system.
 
 This module provides functionality to interact with the Google Gemini API
-for AI-powered analysis of screenshots and other data.
+for AI-powered analysis of screenshots and other data. The Gemini SDK and
+the .env file are only loaded when a client is first created, so importing
+this module does not slow down Django startup. The SDK is configured once
+per process and each client holds one configured model for its lifetime.
 """
 
-import os
-import base64
-import time
-import requests
-from io import BytesIO
-from pathlib import Path
-from PIL import Image
-from dotenv import load_dotenv
+import threading
 from django.conf import settings
-import google.generativeai as genai
 
-# Load environment variables from .env file
-env_path = Path(settings.BASE_DIR) / '.env'
-load_dotenv(dotenv_path=env_path)
+from .base_client import BaseScreenshotClient, error_result
+from .cache import get_default_cache
+from .env import getenv
+from .packing import packed_instructions, split_packed_answer
+from .rate_limit import get_shared_rate_limiter
+from .resilience import get_circuit_breaker
+from .singleflight import get_single_flight
 
-# Get API key from environment variables
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = 'gemini-2.0-flash'
 
 # Constants for rate limiting and image processing
 MAX_REQUESTS_PER_MINUTE = 10  # Adjust based on Gemini API limits
-REQUEST_INTERVAL = 60 / MAX_REQUESTS_PER_MINUTE  # Time between requests in seconds
+RATE_LIMIT_BURST = 3  # Requests that may be sent back to back before throttling
 MAX_IMAGE_RESOLUTION = (1920, 1080)  # FullHD resolution
+MAX_IMAGES_PER_REQUEST = 5  # Screenshots packed into one multi-image request
 
-class GeminiClient:
+
+def __getattr__(name):
+    # GEMINI_API_KEY is read from the environment (and .env) on first access
+    if name == 'GEMINI_API_KEY':
+        return getenv('GEMINI_API_KEY')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _api_key():
+    # A GEMINI_API_KEY set on the module takes precedence over the environment
+    if 'GEMINI_API_KEY' in globals():
+        return globals()['GEMINI_API_KEY']
+    return getenv('GEMINI_API_KEY')
+
+
+def _genai():
+    """Import the Gemini SDK, which takes several hundred milliseconds, on first use."""
+    import google.generativeai as genai
+    return genai
+
+
+_client = None
+_lock = threading.Lock()
+_configured_key = None
+
+
+def configure_sdk(api_key):
+    """Configure the Gemini SDK with an API key.
+    
+    The SDK configuration is process-wide, so it is only changed when a client
+    uses a different key than the last one configured.
+    
+    Args:
+        api_key (str): API key for Gemini
+        
+    Returns:
+        module: The configured ``google.generativeai`` module
+    """
+    global _configured_key
+    genai = _genai()
+    with _lock:
+        if _configured_key != api_key:
+            genai.configure(api_key=api_key)
+            _configured_key = api_key
+    return genai
+
+
+def default_generation_config():
+    """Build the generation config from the GEMINI_MAX_OUTPUT_TOKENS and GEMINI_TEMPERATURE settings.
+    
+    Returns:
+        dict: Generation parameters; unset settings are left to the model defaults
+    """
+    config = {}
+    max_output_tokens = getattr(settings, 'GEMINI_MAX_OUTPUT_TOKENS', None)
+    if max_output_tokens is not None:
+        config['max_output_tokens'] = max_output_tokens
+    temperature = getattr(settings, 'GEMINI_TEMPERATURE', None)
+    if temperature is not None:
+        config['temperature'] = temperature
+    return config
+
+
+class GeminiClient(BaseScreenshotClient):
     """Client for interacting with the Google Gemini API."""
     
-    def __init__(self, api_key=None):
+    provider = 'gemini'
+    default_prompt = "Analyze this UI screenshot focusing on UI/UX aspects: "\
+                     "1. Theme consistency and color contrast ratios "\
+                     "2. Text readability and font rendering "\
+                     "3. Layout spacing and alignment "\
+                     "4. Accessibility concerns "\
+                     "5. Visual hierarchy and element relationships"
+    max_image_resolution = MAX_IMAGE_RESOLUTION
+    requests_per_minute = MAX_REQUESTS_PER_MINUTE
+    rate_limit_burst = RATE_LIMIT_BURST
+    max_images_per_request = MAX_IMAGES_PER_REQUEST
+    
+    def __init__(self, api_key=None, model=None, cache=None, rate_limiter=None, retry_policy=None,
+                 circuit_breaker=None, generation_config=None, single_flight=None):
         """Initialize the Gemini client.
         
         Args:
             api_key (str, optional): API key for Gemini. Defaults to the one in .env file.
+            model (str, optional): Model used for analysis. Defaults to the GEMINI_MODEL setting.
+            cache (AnalysisCache, optional): Cache for analysis results. Disabled if not provided.
+            rate_limiter (TokenBucket, optional): Rate limiter. Defaults to one enforcing MAX_REQUESTS_PER_MINUTE.
+            retry_policy (RetryPolicy, optional): Backoff for transient failures. Defaults to the AI_RETRY_* settings.
+            circuit_breaker (CircuitBreaker, optional): Circuit breaker. Defaults to one private to this client.
+            generation_config (dict, optional): Generation parameters such as ``max_output_tokens``
+                and ``temperature``. Defaults to default_generation_config().
+            single_flight (SingleFlight, optional): Coalesces identical concurrent requests. Disabled if not provided.
         """
-        self.api_key = api_key or GEMINI_API_KEY
+        self.api_key = api_key or _api_key()
         if not self.api_key:
             raise ValueError("Gemini API key is not set. Please add GEMINI_API_KEY to your .env file.")
         
-        # Initialize Gemini client
-        genai.configure(api_key=self.api_key)
+        genai = configure_sdk(self.api_key)
         
-        # Rate limiting attributes
-        self.last_request_time = 0
-    
-    def _resize_image(self, image_path):
-        """Resize image to FullHD resolution if larger.
+        super().__init__(model or getattr(settings, 'GEMINI_MODEL', GEMINI_MODEL), cache=cache,
+                         rate_limiter=rate_limiter, retry_policy=retry_policy, circuit_breaker=circuit_breaker,
+                         single_flight=single_flight)
         
-        Args:
-            image_path (str): Path to the image file
-            
-        Returns:
-            BytesIO: BytesIO object containing the resized image
-        """
-        with Image.open(image_path) as img:
-            # Check if resizing is needed
-            if img.width > MAX_IMAGE_RESOLUTION[0] or img.height > MAX_IMAGE_RESOLUTION[1]:
-                img.thumbnail(MAX_IMAGE_RESOLUTION, Image.LANCZOS)
-            
-            # Save to BytesIO
-            img_byte_arr = BytesIO()
-            img_format = img.format if img.format else 'PNG'
-            img.save(img_byte_arr, format=img_format)
-            img_byte_arr.seek(0)
-            
-            return img_byte_arr
+        self.generation_config = default_generation_config() if generation_config is None else dict(generation_config)
+        # Reused for every request instead of building a model per call
+        self.generative_model = genai.GenerativeModel(self.model, generation_config=self.generation_config or None)
     
-    def _apply_rate_limit(self):
-        """Apply rate limiting to avoid hitting API limits."""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < REQUEST_INTERVAL:
-            sleep_time = REQUEST_INTERVAL - time_since_last_request
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
+    def _cache_identity(self):
+        # Answers depend on the generation parameters as well as the model
+        if not self.generation_config:
+            return self.model
+        params = ','.join(f"{name}={value}" for name, value in sorted(self.generation_config.items()))
+        return f"{self.model}?{params}"
     
-    def analyze_screenshot(self, screenshot_path, prompt=None):
-        """Analyze a screenshot using Gemini's vision capabilities.
-        
-        Args:
-            screenshot_path (str): Path to the screenshot file
-            prompt (str, optional): Custom prompt to guide the analysis
-            
-        Returns:
-            dict: The analysis results from Gemini
-        """
-        if not os.path.exists(screenshot_path):
-            raise FileNotFoundError(f"Screenshot not found at {screenshot_path}")
-        
-        # Default prompt if none provided
-        if not prompt:
-            prompt = "Analyze this UI screenshot focusing on UI/UX aspects: "\
-                    "1. Theme consistency and color contrast ratios "\
-                    "2. Text readability and font rendering "\
-                    "3. Layout spacing and alignment "\
-                    "4. Accessibility concerns "\
-                    "5. Visual hierarchy and element relationships"
-        
-        try:
-            # Apply rate limiting
-            self._apply_rate_limit()
-            
-            # Resize image if needed
-            img_data = self._resize_image(screenshot_path)
-            
-            # Get Gemini model
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            
-            # Prepare image for the model
-            image_parts = [
-                {"mime_type": "image/png", "data": base64.b64encode(img_data.getvalue()).decode('utf-8')}
-            ]
-            
-            # Generate response
-            response = model.generate_content(
-                contents=[
-                    prompt,
-                    image_parts[0]
-                ]
-            )
-            
-            # Format response to match OpenRouter format for compatibility
+    def _image_blob(self, image):
+        # The SDK transports raw bytes, so the image is passed without a base64 round trip
+        self.metrics.observe(self.provider, 'payload_bytes', image.size)
+        return {"mime_type": image.mime_type, "data": image.data}
+    
+    def _contents(self, image, prompt):
+        """Build the request contents for a prepared image and prompt."""
+        return [prompt, self._image_blob(image)]
+    
+    def _format_response(self, response):
+        """Reshape a Gemini response to the OpenRouter response format for compatibility."""
+        with self._timed('parse'):
             formatted_response = {
                 "choices": [
                     {
@@ -135,47 +162,141 @@ class GeminiClient:
                     }
                 ]
             }
+            usage = _usage(response)
+            if usage:
+                formatted_response["usage"] = usage
+        return formatted_response
+    
+    def _send_request(self, image, prompt):
+        """Send a prepared image to Gemini and reshape the answer.
+        
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
             
-            return formatted_response
+        Returns:
+            dict: The analysis results in the OpenRouter response format
+        """
+        try:
+            contents = self._contents(image, prompt)
+            with self._timed('upstream'):
+                response = self.generative_model.generate_content(contents=contents)
+            return self._format_response(response)
         except Exception as e:
-            return {"error": str(e)}
+            return error_result(e)
     
-    def batch_analyze_screenshots(self, screenshot_dir, language=None, theme=None):
-        """Analyze multiple screenshots in a directory.
+    async def _send_request_async(self, image, prompt):
+        """Send a prepared image to Gemini with the SDK's asyncio API.
         
         Args:
-            screenshot_dir (str): Directory containing screenshots
-            language (str, optional): Filter screenshots by language
-            theme (str, optional): Filter screenshots by theme (light/dark)
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
             
         Returns:
-            dict: Analysis results for each screenshot
+            dict: The analysis results in the OpenRouter response format
         """
-        results = {}
+        try:
+            contents = self._contents(image, prompt)
+            with self._timed('upstream'):
+                response = await self.generative_model.generate_content_async(contents=contents)
+            return self._format_response(response)
+        except Exception as e:
+            return error_result(e)
+    
+    def _send_group_request(self, images, labels, prompt):
+        """Send several prepared images to Gemini in one request with a JSON answer.
         
-        if not os.path.isdir(screenshot_dir):
-            raise NotADirectoryError(f"{screenshot_dir} is not a valid directory")
+        Args:
+            images (list): The prepared images
+            labels (list): Label of each image, in the same order
+            prompt (str): The analysis prompt
+            
+        Returns:
+            list: One result per image, or None if the answer could not be split per image
+        """
+        contents = [f"{prompt}\n\n{packed_instructions(labels)}"]
+        for i, (image, label) in enumerate(zip(images, labels), 1):
+            contents.append(f"Image {i}: {label}")
+            contents.append(self._image_blob(image))
         
-        # Get all PNG files in the directory
-        screenshots = [f for f in os.listdir(screenshot_dir) if f.endswith('.png')]
+        try:
+            # Merged with the client's generation config by the SDK
+            with self._timed('upstream'):
+                response = self.generative_model.generate_content(
+                    contents=contents,
+                    generation_config={"response_mime_type": "application/json"}
+                )
+            with self._timed('parse'):
+                text = response.text
+        except Exception as e:
+            return [error_result(e) for _ in images]
         
-        # Apply filters if specified
-        if language:
-            screenshots = [s for s in screenshots if f"_{language}_" in s]
-        if theme:
-            screenshots = [s for s in screenshots if f"_{theme}_" in s]
+        # Per-image results carry no usage, so the packed request's usage is recorded here
+        self._record_usage(_usage(response))
         
-        for screenshot in screenshots:
-            screenshot_path = os.path.join(screenshot_dir, screenshot)
-            results[screenshot] = self.analyze_screenshot(screenshot_path)
+        analyses = split_packed_answer(text, len(images))
+        if analyses is None:
+            return None
+        return [
+            {"choices": [{"message": {"content": analysis, "role": "assistant"}}]}
+            for analysis in analyses
+        ]
+    
+    def _stream_request(self, image, prompt):
+        """Stream the answer to a prepared image from Gemini.
         
-        return results
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+            
+        Yields:
+            str: Chunks of the answer text as they are generated
+        """
+        response = self.generative_model.generate_content(contents=self._contents(image, prompt), stream=True)
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+def _usage(response):
+    """Convert the usage metadata of a Gemini response to the OpenRouter ``usage`` format.
+    
+    Returns:
+        dict: Prompt, completion and total token counts, or None if the response has none
+    """
+    metadata = getattr(response, 'usage_metadata', None)
+    counts = {
+        'prompt_tokens': getattr(metadata, 'prompt_token_count', None),
+        'completion_tokens': getattr(metadata, 'candidates_token_count', None),
+        'total_tokens': getattr(metadata, 'total_token_count', None),
+    }
+    if not all(isinstance(count, int) for count in counts.values()):
+        return None
+    return counts
 
 
 def get_client():
-    """Get an initialized Gemini client.
+    """Get the process-wide Gemini client.
+    
+    The client is created once per process, so the SDK is configured and the
+    model instance built only once. It shares the process-wide result cache
+    with the OpenRouter client and the host-wide Gemini rate limit with every
+    other process.
     
     Returns:
         GeminiClient: An initialized client instance
     """
-    return GeminiClient()
\ No newline at end of file
+    global _client
+    client = _client
+    if client is None:
+        client = GeminiClient(
+            cache=get_default_cache(),
+            rate_limiter=get_shared_rate_limiter('gemini', MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST),
+            circuit_breaker=get_circuit_breaker('gemini'),
+            single_flight=get_single_flight(),
+        )
+        with _lock:
+            if _client is None:
+                _client = client
+            client = _client
+    return client
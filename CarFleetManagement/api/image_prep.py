@@ -0,0 +1,327 @@
+"""Image preparation for AI screenshot analysis.
+
+Screenshots are sent to the providers base64-encoded, so upload time is
+dominated by the encoded image size. Small images that already fit the
+resolution limit are passed through untouched without being decoded;
+everything else is downscaled and re-encoded as JPEG/WebP at the highest
+quality that fits the configured byte budget. Large JPEGs are decoded
+straight at a reduced DCT scale rather than at full resolution.
+
+Uploads are checked with validate_image first, which only reads the image
+header, so bogus or oversized files are rejected before any pixel is
+decoded. Pillow is imported on first use, so importing this module does not
+slow down Django startup.
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+
+# Magic numbers of the formats accepted by both providers
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+
+_FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+
+def sniff_mime_type(header):
+    """Detect the MIME type of an image from its first bytes.
+
+    Args:
+        header (bytes): At least the first 12 bytes of the image
+
+    Returns:
+        str: The MIME type, or None if the format is not recognized
+    """
+    for signature, mime_type in _SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+_MIME_TYPE_NAMES = {
+    'image/png': 'PNG',
+    'image/jpeg': 'JPEG',
+    'image/webp': 'WEBP',
+    'image/gif': 'GIF',
+}
+
+
+class InvalidImageError(ValueError):
+    """Raised for uploads that are not a supported image or exceed the size limits."""
+
+
+def is_path(source):
+    """Return whether an image source is a file path rather than data or a file object."""
+    return isinstance(source, (str, os.PathLike))
+
+
+def read_image(source):
+    """Read an encoded image.
+
+    Args:
+        source (str | bytes | file): Path to the image file, its bytes, or a file-like
+            object such as a Django UploadedFile, read from the start
+
+    Returns:
+        bytes: The encoded image
+    """
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return source.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def validate_image(source, formats=None, max_dimension=None, max_pixels=None):
+    """Check the format and dimensions of an image from its header, without decoding it.
+
+    Args:
+        source (str | bytes | file): Path to the image file, its bytes, or a file-like
+            object such as a Django UploadedFile, left at its start
+        formats (iterable, optional): Accepted MIME types. Defaults to AI_UPLOAD_FORMATS.
+        max_dimension (int, optional): Largest accepted width or height.
+            Defaults to AI_UPLOAD_MAX_DIMENSION.
+        max_pixels (int, optional): Largest accepted width times height.
+            Defaults to AI_UPLOAD_MAX_PIXELS.
+
+    Returns:
+        tuple: ``(mime_type, width, height)``
+
+    Raises:
+        InvalidImageError: If the image is not accepted
+    """
+    if formats is None:
+        formats = getattr(settings, 'AI_UPLOAD_FORMATS', list(_MIME_TYPE_NAMES))
+    if max_dimension is None:
+        max_dimension = getattr(settings, 'AI_UPLOAD_MAX_DIMENSION', 16384)
+    if max_pixels is None:
+        max_pixels = getattr(settings, 'AI_UPLOAD_MAX_PIXELS', 40_000_000)
+
+    if is_path(source):
+        with open(source, 'rb') as f:
+            return validate_image(f, formats, max_dimension, max_pixels)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return validate_image(BytesIO(source), formats, max_dimension, max_pixels)
+
+    from PIL import Image, UnidentifiedImageError
+
+    source.seek(0)
+    try:
+        mime_type = sniff_mime_type(source.read(12))
+        if mime_type is None or mime_type not in formats:
+            accepted = ', '.join(_MIME_TYPE_NAMES.get(f, f) for f in formats)
+            raise InvalidImageError(f"Unsupported image format; expected {accepted}")
+
+        source.seek(0)
+        try:
+            # Only parses the header; the pixel data is not read
+            with Image.open(source) as img:
+                width, height = img.size
+        except Image.DecompressionBombError:
+            raise InvalidImageError("Image has too many pixels")
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            raise InvalidImageError("The image header could not be read")
+    finally:
+        source.seek(0)
+
+    if max(width, height) > max_dimension:
+        raise InvalidImageError(f"Image is {width}x{height}; the largest side may be at most {max_dimension} pixels")
+    if width * height > max_pixels:
+        raise InvalidImageError(f"Image is {width}x{height}; at most {max_pixels} pixels are accepted")
+    return mime_type, width, height
+
+
+def _fit_size(size, max_resolution):
+    """Return the size of an image scaled down to fit within max_resolution."""
+    width, height = size
+    scale = min(max_resolution[0] / width, max_resolution[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class PreparedImage:
+    """Encoded image ready to be sent to a provider."""
+
+    def __init__(self, data, mime_type, original_size, width=None, height=None):
+        """Initialize the prepared image.
+
+        Args:
+            data (bytes): The encoded image
+            mime_type (str): MIME type of ``data``
+            original_size (int): Size of the source image in bytes
+            width (int, optional): Width of the encoded image
+            height (int, optional): Height of the encoded image
+        """
+        self.data = data
+        self.mime_type = mime_type
+        self.original_size = original_size
+        self.width = width
+        self.height = height
+        # Seconds prepare_image spent on this image, possibly in another process
+        self.prep_seconds = None
+
+    @property
+    def size(self):
+        """Size of the encoded image in bytes."""
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        """Bytes saved compared to sending the source image."""
+        return max(0, self.original_size - self.size)
+
+
+def _flatten(img):
+    """Convert an image to RGB, compositing transparency onto white."""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        from PIL import Image
+
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode(img, image_format, quality):
+    buffer = BytesIO()
+    img.save(buffer, format=image_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def get_image_options(max_resolution=(1920, 1080)):
+    """Resolve the image preparation settings.
+
+    The resolved options can be passed to prepare_image in worker processes
+    that do not have Django settings configured.
+
+    Args:
+        max_resolution (tuple): Maximum (width, height) sent to the provider
+
+    Returns:
+        dict: Keyword arguments for prepare_image
+    """
+    return {
+        'max_resolution': max_resolution,
+        'byte_budget': getattr(settings, 'AI_IMAGE_BYTE_BUDGET', 1024 * 1024),
+        'image_format': getattr(settings, 'AI_IMAGE_FORMAT', 'JPEG'),
+        'quality': getattr(settings, 'AI_IMAGE_QUALITY', 85),
+        'min_quality': getattr(settings, 'AI_IMAGE_MIN_QUALITY', 50),
+    }
+
+
+def prepare_image(source, max_resolution=(1920, 1080), byte_budget=None, image_format=None,
+                  quality=None, min_quality=None):
+    """Prepare an image for upload within a resolution limit and byte budget.
+
+    Args:
+        source (str | bytes | file): Path to the image file, its bytes, or a file-like object
+        max_resolution (tuple): Maximum (width, height) sent to the provider
+        byte_budget (int, optional): Target size of the encoded image. Defaults to AI_IMAGE_BYTE_BUDGET.
+        image_format (str, optional): Re-encoding format, JPEG or WEBP. Defaults to AI_IMAGE_FORMAT.
+        quality (int, optional): Starting encoder quality. Defaults to AI_IMAGE_QUALITY.
+        min_quality (int, optional): Lowest quality tried before downscaling. Defaults to AI_IMAGE_MIN_QUALITY.
+
+    Returns:
+        PreparedImage: The encoded image, its MIME type and the bytes saved
+    """
+    started = time.perf_counter()
+    prepared = _prepare(source, max_resolution, byte_budget, image_format, quality, min_quality)
+    prepared.prep_seconds = time.perf_counter() - started
+    return prepared
+
+
+def _prepare(source, max_resolution, byte_budget, image_format, quality, min_quality):
+    byte_budget = byte_budget or getattr(settings, 'AI_IMAGE_BYTE_BUDGET', 1024 * 1024)
+    image_format = (image_format or getattr(settings, 'AI_IMAGE_FORMAT', 'JPEG')).upper()
+    quality = quality or getattr(settings, 'AI_IMAGE_QUALITY', 85)
+    min_quality = min_quality or getattr(settings, 'AI_IMAGE_MIN_QUALITY', 50)
+
+    raw = read_image(source)
+    source_mime_type = sniff_mime_type(raw[:12])
+
+    from PIL import Image
+
+    with Image.open(BytesIO(raw)) as img:
+        # Image.open only parses the header, so size is known without decoding pixels
+        max_width, max_height = max_resolution
+        source_width, source_height = img.size
+        fits = source_width <= max_width and source_height <= max_height
+        if fits and source_mime_type and len(raw) <= byte_budget:
+            return PreparedImage(raw, source_mime_type, len(raw), source_width, source_height)
+
+        if not fits:
+            # JPEGs are decoded straight at the smallest DCT scale (1/2, 1/4 or 1/8) that
+            # still covers the target size, in RGB; other formats are shrunk with reduce()
+            # by thumbnail before the final resampling
+            img.draft('RGB', _fit_size(img.size, max_resolution))
+            img.thumbnail(max_resolution, Image.LANCZOS)
+        img = _flatten(img)
+
+        data = None
+        while True:
+            for q in range(quality, min_quality - 1, -10):
+                data = _encode(img, image_format, q)
+                if len(data) <= byte_budget:
+                    break
+            if len(data) <= byte_budget or min(img.size) <= 256:
+                break
+            # Still over budget at the lowest quality: trade resolution for size
+            img = img.resize((int(img.width * 0.75), int(img.height * 0.75)), Image.LANCZOS)
+
+        if fits and source_mime_type and len(raw) <= len(data):
+            # Re-encoding did not help; the original is already smaller
+            return PreparedImage(raw, source_mime_type, len(raw), source_width, source_height)
+
+        return PreparedImage(data, _FORMAT_MIME_TYPES[image_format], len(raw), img.width, img.height)
+
+
+class ImageStats:
+    """Thread-safe counters of image payload sizes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+    def record(self, prepared):
+        """Record a prepared image."""
+        with self._lock:
+            self.images += 1
+            self.original_bytes += prepared.original_size
+            self.sent_bytes += prepared.size
+
+    def as_dict(self):
+        """Return the counters, including the total bytes saved.
+
+        Returns:
+            dict: Image count, original, sent and saved bytes
+        """
+        with self._lock:
+            return {
+                'images': self.images,
+                'original_bytes': self.original_bytes,
+                'sent_bytes': self.sent_bytes,
+                'bytes_saved': max(0, self.original_bytes - self.sent_bytes),
+            }
@@ -0,0 +1,383 @@
+"""Incremental analysis of screenshots against stored baselines.
+
+On day-to-day reruns most of a page is unchanged. Each screenshot is
+compared with the baseline stored for the same page, language and theme;
+only the regions that changed (plus some surrounding context) are cropped
+and sent for analysis, and the region analyses are combined into one result
+per screenshot in the usual response format. Each baseline is stored with
+its analysis, which is the result of screenshots that did not change.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .catalog import parse_screenshot_name
+
+
+# Heading of the baseline's analysis in a result combined from region analyses
+UNCHANGED_HEADING = "Unchanged areas, from the baseline analysis:\n"
+
+
+def changed_regions(baseline, current, pixel_threshold=None, context=None, tile_size=16):
+    """Find the bounding boxes of the regions that differ between two screenshots.
+
+    Pixels are compared in one vectorized pass; changed pixels are grouped
+    into tiles, and each 8-connected group of changed tiles becomes one box.
+    Boxes are grown by ``context`` pixels and overlapping boxes are merged.
+
+    Args:
+        baseline (PIL.Image.Image): The baseline screenshot
+        current (PIL.Image.Image): The new screenshot
+        pixel_threshold (int, optional): Minimum per-channel difference for a pixel to count
+            as changed. Defaults to the AI_DIFF_PIXEL_THRESHOLD setting.
+        context (int, optional): Margin added around each region. Defaults to the
+            AI_DIFF_CONTEXT setting.
+        tile_size (int): Size of the tiles changed pixels are grouped into
+
+    Returns:
+        list: ``(left, upper, right, lower)`` boxes, or None if the screenshots differ in size
+    """
+    if baseline.size != current.size:
+        return None
+    if pixel_threshold is None:
+        pixel_threshold = getattr(settings, 'AI_DIFF_PIXEL_THRESHOLD', 24)
+    if context is None:
+        context = getattr(settings, 'AI_DIFF_CONTEXT', 32)
+
+    a = np.asarray(baseline.convert('RGB'), dtype=np.int16)
+    b = np.asarray(current.convert('RGB'), dtype=np.int16)
+    mask = np.abs(a - b).max(axis=2) > pixel_threshold
+    if not mask.any():
+        return []
+
+    height, width = mask.shape
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = mask
+    tiles = padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+    boxes = []
+    for component in _connected_components(tiles):
+        tile_rows = [r for r, _ in component]
+        tile_cols = [c for _, c in component]
+        boxes.append((
+            max(0, min(tile_cols) * tile_size - context),
+            max(0, min(tile_rows) * tile_size - context),
+            min(width, (max(tile_cols) + 1) * tile_size + context),
+            min(height, (max(tile_rows) + 1) * tile_size + context),
+        ))
+    return _merge_boxes(boxes)
+
+
+def _connected_components(grid):
+    """Yield the 8-connected groups of True cells of a boolean grid."""
+    unvisited = set(zip(*np.nonzero(grid)))
+    while unvisited:
+        stack = [unvisited.pop()]
+        component = []
+        while stack:
+            r, c = stack.pop()
+            component.append((int(r), int(c)))
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    neighbour = (r + dr, c + dc)
+                    if neighbour in unvisited:
+                        unvisited.remove(neighbour)
+                        stack.append(neighbour)
+        yield component
+
+
+def _merge_boxes(boxes):
+    """Merge overlapping boxes until none overlap."""
+    boxes = sorted(boxes)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for i, other in enumerate(result):
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = sorted(result)
+    return boxes
+
+
+def baseline_key(screenshot_name):
+    """Return the page/language/theme key of a screenshot file name.
+
+    Args:
+        screenshot_name (str): File name in the ``page_lang_theme_timestamp.png`` format
+
+    Returns:
+        str: ``page_lang_theme``, or None if the name does not follow the format
+    """
+    page, language, theme, _ = parse_screenshot_name(os.path.basename(screenshot_name))
+    if not page:
+        return None
+    return f"{page}_{language}_{theme}"
+
+
+class BaselineStore:
+    """Directory of baseline screenshots and their analyses, one per page, language and theme."""
+
+    def __init__(self, directory=None):
+        """Initialize the store.
+
+        Args:
+            directory (str, optional): Directory holding the baselines.
+                Defaults to the AI_BASELINE_DIR setting.
+        """
+        if directory is None:
+            directory = getattr(settings, 'AI_BASELINE_DIR', Path(settings.BASE_DIR) / '.ai_cache' / 'baselines')
+        self.directory = str(directory)
+
+    def path_for(self, key):
+        """Return where the baseline for a key is stored."""
+        return os.path.join(self.directory, f"{key}.png")
+
+    def analysis_path_for(self, key):
+        """Return where the analysis of the baseline for a key is stored."""
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Return the path of the baseline for a key, or None if there is none."""
+        path = self.path_for(key)
+        return path if os.path.exists(path) else None
+
+    def get_analysis(self, key):
+        """Return the stored analysis of the baseline for a key, or None if there is none."""
+        try:
+            with open(self.analysis_path_for(key), 'r') as f:
+                analysis = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return analysis if isinstance(analysis, dict) else None
+
+    def save(self, key, screenshot_path, analysis=None):
+        """Store a screenshot as the baseline for a key.
+
+        Args:
+            key (str): Page/language/theme key, as returned by baseline_key()
+            screenshot_path (str): The screenshot
+            analysis (dict, optional): Its analysis, returned for unchanged screenshots.
+                Any previously stored analysis is removed if not given.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        if analysis is None:
+            # The old analysis does not describe the new baseline
+            if os.path.exists(self.analysis_path_for(key)):
+                os.remove(self.analysis_path_for(key))
+        else:
+            self._write(self.analysis_path_for(key), lambda tmp_path: self._dump(analysis, tmp_path))
+        self._write(self.path_for(key), lambda tmp_path: shutil.copyfile(screenshot_path, tmp_path))
+
+    @staticmethod
+    def _dump(analysis, path):
+        with open(path, 'w') as f:
+            json.dump(analysis, f)
+
+    def _write(self, path, write):
+        """Replace a file atomically with what ``write(tmp_path)`` writes."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+REGION_PROMPT = (
+    "This image is a cropped region ({left}, {upper})-({right}, {lower}) of a {width}x{height} "
+    "screenshot, showing an area that changed since the previous run. Only report issues visible "
+    "in this region."
+)
+
+
+class IncrementalBatch:
+    """Turn batch jobs into jobs over the changed regions of each screenshot.
+
+    Cropped regions are written to a temporary directory that is removed by
+    close(); the batch can also be used as a context manager.
+    """
+
+    def __init__(self, store=None, default_prompt=None, update_baseline=False, max_changed_ratio=None):
+        """Initialize the batch.
+
+        Args:
+            store (BaselineStore, optional): Baseline screenshots. Defaults to BaselineStore().
+            default_prompt (str, optional): Prompt used for region jobs whose prompt is None
+            update_baseline (bool): Store every successfully analyzed screenshot as the new baseline.
+                Screenshots without a baseline are always stored.
+            max_changed_ratio (float, optional): Analyze the whole screenshot when the regions cover
+                more than this fraction of it. Defaults to the AI_DIFF_MAX_CHANGED_RATIO setting.
+        """
+        self.store = store or BaselineStore()
+        self.default_prompt = default_prompt or ''
+        self.update_baseline = update_baseline
+        if max_changed_ratio is None:
+            max_changed_ratio = getattr(settings, 'AI_DIFF_MAX_CHANGED_RATIO', 0.5)
+        self.max_changed_ratio = max_changed_ratio
+        self.work_dir = None
+        # Per screenshot key: (path, baseline key, baseline path, baseline analysis,
+        # region keys and boxes or None)
+        self._plans = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Remove the cropped regions."""
+        if self.work_dir is not None:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+
+    def build_jobs(self, jobs):
+        """Plan the analysis of each screenshot.
+
+        Args:
+            jobs (list): ``(key, screenshot_path, prompt)`` tuples
+
+        Screenshots whose baseline has no stored analysis are analyzed as a whole,
+        since there is no result to fall back on for their unchanged areas.
+
+        Returns:
+            tuple: The jobs to analyze (whole screenshots and cropped regions), and
+                the keys of screenshots that are unchanged since their baseline
+        """
+        planned = []
+        unchanged = []
+        for key, path, prompt in jobs:
+            name = baseline_key(key)
+            baseline = self.store.get(name) if name else None
+            analysis = self.store.get_analysis(name) if baseline else None
+            regions = self._crop(key, path, baseline) if analysis else None
+            self._plans[key] = (path, name, baseline, analysis, regions)
+
+            if regions is None:
+                planned.append((key, path, prompt))
+            elif not regions:
+                unchanged.append(key)
+            else:
+                for region_key, region_path, region_prompt, _ in regions:
+                    planned.append((region_key, region_path, f"{prompt or self.default_prompt}\n\n{region_prompt}"))
+        return planned, unchanged
+
+    def _crop(self, key, path, baseline_path):
+        """Crop the changed regions of a screenshot.
+
+        Returns:
+            list: ``(region_key, region_path, region_prompt, box)`` tuples, or None if the
+                whole screenshot should be analyzed
+        """
+        try:
+            with Image.open(baseline_path) as baseline, Image.open(path) as current:
+                boxes = changed_regions(baseline, current)
+                if boxes is None:
+                    return None
+                width, height = current.size
+                changed_area = sum((right - left) * (lower - upper) for left, upper, right, lower in boxes)
+                if changed_area > self.max_changed_ratio * width * height:
+                    return None
+
+                if self.work_dir is None:
+                    self.work_dir = tempfile.mkdtemp(prefix='regions_')
+                regions = []
+                for i, box in enumerate(boxes):
+                    region_key = f"{key}#region{i + 1}"
+                    region_path = os.path.join(self.work_dir, f"{len(self._plans)}_{i + 1}.png")
+                    current.crop(box).save(region_path)
+                    prompt = REGION_PROMPT.format(
+                        left=box[0], upper=box[1], right=box[2], lower=box[3], width=width, height=height
+                    )
+                    regions.append((region_key, region_path, prompt, box))
+                return regions
+        except (OSError, ValueError):
+            # Unreadable screenshots are analyzed (and reported) as a whole
+            return None
+
+    def assemble(self, results):
+        """Combine region results into one result per screenshot and update baselines.
+
+        A baseline is only stored when every request of its screenshot succeeded;
+        otherwise the failed regions would pass as unchanged on the next run.
+
+        Args:
+            results (dict): Analysis results keyed like the jobs returned by build_jobs
+
+        Returns:
+            dict: One result per screenshot key passed to build_jobs
+        """
+        assembled = {}
+        for key, (path, name, baseline, analysis, regions) in self._plans.items():
+            if regions is None:
+                result = results.get(key)
+                if result is None:
+                    continue
+                failed = 'error' in result
+            else:
+                result = self._combine(analysis, regions, results)
+                failed = 'error' in result or any('error' in region['analysis'] for region in result['regions'])
+
+            assembled[key] = result
+            if name and not failed and (baseline is None or self.update_baseline):
+                self.store.save(name, path, result)
+        return assembled
+
+    @staticmethod
+    def _combine(baseline_analysis, regions, results):
+        """Combine the analyses of the changed regions with the baseline's analysis.
+
+        Args:
+            baseline_analysis (dict): Stored analysis of the baseline
+            regions (list): Regions returned by _crop
+            results (dict): Analysis results keyed like the jobs returned by build_jobs
+
+        Returns:
+            dict: The result of the screenshot; the baseline's analysis if nothing changed
+        """
+        baseline_content = ''
+        if baseline_analysis.get('choices'):
+            # A baseline updated from a region run already carries the analysis of its
+            # unchanged areas; only that part is kept, so the text does not nest and grow
+            baseline_content = baseline_analysis['choices'][0]['message']['content']
+            baseline_content = baseline_content.split(UNCHANGED_HEADING, 1)[-1]
+        if not regions:
+            return {**baseline_analysis, 'regions': []}
+
+        sections = []
+        region_results = []
+        errors = []
+        for i, (region_key, _, _, box) in enumerate(regions):
+            result = results.get(region_key, {'error': 'Region was not analyzed'})
+            region_results.append({'box': list(box), 'analysis': result})
+            if 'error' in result:
+                errors.append(result['error'])
+            elif result.get('choices'):
+                sections.append(f"Region {i + 1}:\n{result['choices'][0]['message']['content']}")
+
+        if errors and not sections:
+            return {'error': errors[0], 'regions': region_results}
+        if baseline_content:
+            sections.append(f"{UNCHANGED_HEADING}{baseline_content}")
+        return {
+            'choices': [{'message': {'role': 'assistant', 'content': '\n\n'.join(sections)}}],
+            'regions': region_results,
+        }
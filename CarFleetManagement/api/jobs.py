@@ -0,0 +1,231 @@
+"""Database-backed queue of batch screenshot analyses.
+
+Analyzing a batch takes minutes because of the provider rate limit, far
+longer than an HTTP request should. The batch endpoint therefore only
+enqueues an AnalysisJob row; ``manage.py analysis_worker`` claims queued jobs,
+analyzes their screenshots and records the results as they complete, so
+clients can poll the progress and fetch the results when the job is done.
+Results of succeeded jobs are also added to the AnalysisResult store.
+
+Jobs are claimed with a conditional UPDATE, so any number of worker processes
+can drain the same queue without a broker. A job whose worker stopped
+updating it for AI_JOB_STALE_SECONDS is considered abandoned and claimed again;
+every later update is conditional on the claim, so the original worker cannot
+overwrite the job once it has been claimed by another.
+"""
+
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .base_client import analyze_many
+from .catalog import parse_screenshot_name
+from .models import AnalysisJob
+from .results import ingest_results
+
+logger = logging.getLogger(__name__)
+
+# Jobs looked at per claim attempt; more than one in case other workers win the race
+CLAIM_CANDIDATES = 10
+
+SCREENSHOT_PROMPT = """Analyze this UI screenshot of the {page} page in {language} language with {theme} theme.
+Identify any issues with:
+1. Text rendering and translations
+2. Layout and alignment
+3. Theme consistency (colors, contrast)
+4. Responsive design issues
+5. UI element spacing and positioning
+
+Provide a concise summary of findings and recommendations for improvement."""
+
+
+class JobReclaimed(Exception):
+    """Raised when a running job has been claimed by another worker."""
+
+
+def build_jobs(screenshots_dir, screenshots):
+    """Build the analysis jobs of screenshots, with a prompt matching their metadata.
+
+    Returns:
+        list: ``(file_name, screenshot_path, prompt)`` tuples; the prompt is None for
+            screenshots whose name does not follow ``page_lang_theme_timestamp.png``
+    """
+    jobs = []
+    for screenshot in screenshots:
+        screenshot_path = os.path.join(screenshots_dir, screenshot)
+
+        # Extract metadata from filename (format: page_lang_theme_timestamp.png)
+        page_name, lang, theme_name, _ = parse_screenshot_name(screenshot)
+        if page_name:
+            # Create a custom prompt based on metadata
+            prompt = SCREENSHOT_PROMPT.format(page=page_name, language=lang, theme=theme_name)
+        else:
+            prompt = None  # Use default prompt
+
+        jobs.append((screenshot, screenshot_path, prompt))
+    return jobs
+
+
+def enqueue_batch(screenshots_dir, screenshots, filters=None):
+    """Queue the analysis of screenshots.
+
+    Args:
+        screenshots_dir (str): Directory containing the screenshots
+        screenshots (list): File names to analyze
+        filters (dict, optional): Filters the screenshots were selected with, kept for reference
+
+    Returns:
+        AnalysisJob: The queued job
+    """
+    return AnalysisJob.objects.create(
+        screenshots_dir=str(screenshots_dir),
+        screenshots=list(screenshots),
+        filters={key: value for key, value in (filters or {}).items() if value},
+    )
+
+
+def default_worker_name():
+    """Identify this worker process in the jobs it claims."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job(worker=None, stale_after=None):
+    """Claim the oldest queued or abandoned job.
+
+    Args:
+        worker (str, optional): Name recorded in the claimed job. Defaults to host and PID.
+        stale_after (float, optional): Seconds without progress after which a running job
+            is claimed again. Defaults to the AI_JOB_STALE_SECONDS setting.
+
+    Returns:
+        AnalysisJob: The claimed job, now running, or None if the queue is empty
+    """
+    if worker is None:
+        worker = default_worker_name()
+    if stale_after is None:
+        stale_after = getattr(settings, 'AI_JOB_STALE_SECONDS', 600)
+
+    now = timezone.now()
+    claimable = Q(status=AnalysisJob.QUEUED) | Q(
+        status=AnalysisJob.RUNNING, updated_at__lt=now - timedelta(seconds=stale_after)
+    )
+    candidates = AnalysisJob.objects.filter(claimable).order_by('created_at').values_list('pk', flat=True)
+    for job_id in candidates[:CLAIM_CANDIDATES]:
+        # Only one worker's conditional update matches; the others move on to the next candidate
+        claimed = AnalysisJob.objects.filter(claimable, pk=job_id).update(
+            status=AnalysisJob.RUNNING,
+            worker=worker,
+            attempts=F('attempts') + 1,
+            results={},
+            completed=0,
+            error='',
+            started_at=now,
+            updated_at=now,
+        )
+        if claimed:
+            return AnalysisJob.objects.get(pk=job_id)
+    return None
+
+
+def save_job(job, **fields):
+    """Update a running job, unless another worker has claimed it since this worker did.
+
+    Args:
+        job (AnalysisJob): The job, as claimed by this worker
+        **fields: Field values to store
+
+    Returns:
+        bool: Whether the job was updated
+    """
+    # The worker name and attempt count identify the claim
+    claim = AnalysisJob.objects.filter(pk=job.pk, worker=job.worker, attempts=job.attempts)
+    return claim.update(updated_at=timezone.now(), **fields) > 0
+
+
+def run_job(job, client, max_workers=None, prep_workers=None, save_interval=None):
+    """Analyze the screenshots of a claimed job and record the results.
+
+    Progress is saved at most every ``save_interval`` seconds while the job runs,
+    since each save rewrites all the results so far. Near-identical screenshots
+    are analyzed once and share the result. If another worker claims the job in
+    the meantime (because this one looked stale), the job is left to it.
+
+    Args:
+        job (AnalysisJob): A running job, as returned by claim_job()
+        client: Client exposing ``analyze_screenshot(path, prompt=None)``
+        max_workers (int, optional): Number of concurrent requests.
+            Defaults to the AI_BATCH_CONCURRENCY setting.
+        prep_workers (int, optional): Number of image preparation processes.
+            Defaults to the AI_PREP_WORKERS setting.
+        save_interval (float, optional): Seconds between progress saves; 0 saves every result.
+            Defaults to the AI_JOB_SAVE_INTERVAL setting.
+
+    Returns:
+        AnalysisJob: The job, succeeded or failed; still running if it was claimed by another worker
+    """
+    if save_interval is None:
+        save_interval = getattr(settings, 'AI_JOB_SAVE_INTERVAL', 5.0)
+    last_save = time.monotonic()
+
+    try:
+        # Imported here because NumPy would otherwise load with the API views
+        from .dedup import deduplicate, expand_results
+
+        jobs = build_jobs(job.screenshots_dir, job.screenshots)
+        unique_jobs, duplicates = deduplicate(jobs)
+        copies = {}
+        for key, source in duplicates.items():
+            copies.setdefault(source, []).append(key)
+
+        job.duplicates_skipped = len(duplicates)
+
+        def record(key, result):
+            nonlocal last_save
+            job.results[key] = result
+            for copy in copies.get(key, ()):
+                job.results[copy] = result
+            job.completed = len(job.results)
+            if time.monotonic() - last_save < save_interval:
+                return
+            last_save = time.monotonic()
+            if not save_job(job, results=job.results, completed=job.completed,
+                            duplicates_skipped=job.duplicates_skipped):
+                raise JobReclaimed(f"Job {job.id} was claimed by another worker")
+
+        results = analyze_many(
+            client, unique_jobs, max_workers=max_workers, on_result=record, prep_workers=prep_workers
+        )
+        results = expand_results(results, duplicates)
+        job.results = {key: results[key] for key in job.screenshots if key in results}
+        job.completed = len(job.results)
+
+        job.status = AnalysisJob.SUCCEEDED
+    except JobReclaimed:
+        return job
+    except Exception as e:
+        job.status = AnalysisJob.FAILED
+        job.error = str(e)
+
+    job.finished_at = timezone.now()
+    fields = ['status', 'results', 'completed', 'duplicates_skipped', 'error', 'finished_at']
+    if not save_job(job, **{name: getattr(job, name) for name in fields}):
+        logger.warning("Analysis job %s was claimed by another worker; its results are discarded", job.id)
+        job.status = AnalysisJob.RUNNING
+        return job
+
+    if job.status == AnalysisJob.SUCCEEDED:
+        # Keep the results queryable once the job is gone; the analyses succeeded either way
+        prompts = {key: prompt for key, _, prompt in jobs if prompt}
+        try:
+            with transaction.atomic():
+                ingest_results(f"job:{job.id}", job.results, prompts=prompts)
+        except Exception:
+            logger.exception("Could not store the results of analysis job %s", job.id)
+    return job
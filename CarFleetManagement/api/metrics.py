@@ -0,0 +1,234 @@
+"""Per-phase instrumentation of the AI provider clients.
+
+Every request to a provider goes through the same phases: image preparation,
+base64 encoding, waiting for the rate limiter, the upstream call and parsing
+of the response. The clients record the duration of each phase, the encoded
+payload size and the token usage reported by the provider into fixed-bucket
+histograms, kept per provider in a process-wide registry. The registry is
+exposed by the metrics endpoint and summarized at the end of batch commands.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(2 ** power for power in range(10, 25))  # 1 KiB to 16 MiB
+TOKENS_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# Recorded metrics, in the order they are reported
+METRICS = {
+    'prep_seconds': SECONDS_BUCKETS,
+    'encode_seconds': SECONDS_BUCKETS,
+    'rate_limit_wait_seconds': SECONDS_BUCKETS,
+    'upstream_seconds': SECONDS_BUCKETS,
+    'parse_seconds': SECONDS_BUCKETS,
+    'payload_bytes': BYTES_BUCKETS,
+    'prompt_tokens': TOKENS_BUCKETS,
+    'completion_tokens': TOKENS_BUCKETS,
+}
+
+
+class Histogram:
+    """Thread-safe histogram with fixed bucket boundaries."""
+
+    def __init__(self, buckets):
+        """Initialize the histogram.
+
+        Args:
+            buckets (tuple): Increasing upper bounds of the buckets; larger values
+                fall into an implicit overflow bucket
+        """
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record a value."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def percentile(self, percentile):
+        """Estimate a percentile as the upper bound of the bucket it falls into.
+
+        Args:
+            percentile (float): Percentile between 0 and 100
+
+        Returns:
+            float: The estimate, capped at the largest recorded value, or None if
+                nothing was recorded
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, percentile / 100 * self.count)
+            seen = 0
+            for bound, count in zip(self.buckets + (self.max,), self._counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max)
+            return self.max
+
+    def as_dict(self):
+        """Return the histogram.
+
+        Returns:
+            dict: Count, sum, mean, p50/p95/max estimates and the cumulative count
+                of each bucket as ``[upper_bound, count]`` pairs
+        """
+        p50, p95 = self.percentile(50), self.percentile(95)
+        with self._lock:
+            cumulative = []
+            seen = 0
+            for bound, count in zip(self.buckets, self._counts):
+                seen += count
+                cumulative.append([bound, seen])
+            cumulative.append(['+Inf', self.count])
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': p50,
+                'p95': p95,
+                'max': self.max,
+                'buckets': cumulative,
+            }
+
+
+class MetricsRegistry:
+    """Thread-safe histograms of each metric, per provider."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, provider, name, value):
+        """Record a value of a metric.
+
+        Args:
+            provider (str): Provider the value was measured for
+            name (str): Metric name, one of METRICS
+            value (float): The value
+        """
+        key = (provider, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(METRICS[name]))
+        histogram.observe(value)
+
+    @contextmanager
+    def timer(self, provider, name):
+        """Record the duration of a block as a metric, in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(provider, name, time.perf_counter() - started)
+
+    def snapshot(self):
+        """Return every histogram.
+
+        Returns:
+            dict: Histogram.as_dict() keyed by provider and metric name
+        """
+        with self._lock:
+            items = sorted(self._histograms.items(), key=lambda item: (item[0][0], list(METRICS).index(item[0][1])))
+        snapshot = {}
+        for (provider, name), histogram in items:
+            snapshot.setdefault(provider, {})[name] = histogram.as_dict()
+        return snapshot
+
+    def reset(self):
+        """Drop every recorded value."""
+        with self._lock:
+            self._histograms.clear()
+
+
+def format_summary(snapshot):
+    """Summarize a metrics snapshot as human-readable lines.
+
+    Args:
+        snapshot (dict): As returned by MetricsRegistry.snapshot()
+
+    Returns:
+        list: One line per provider and metric
+    """
+    lines = []
+    for provider, metrics in snapshot.items():
+        for name, histogram in metrics.items():
+            if not histogram['count']:
+                continue
+            if name.endswith('_seconds'):
+                label = name[:-len('_seconds')]
+                values = [f"{histogram[stat] * 1000:.0f} ms" for stat in ('mean', 'p50', 'p95', 'max')]
+            elif name.endswith('_bytes'):
+                label = name[:-len('_bytes')]
+                values = [f"{histogram[stat] / 1024:.0f} KB" for stat in ('mean', 'p50', 'p95', 'max')]
+            else:
+                label = name
+                values = [f"{histogram[stat]:.0f}" for stat in ('mean', 'p50', 'p95', 'max')]
+            mean, p50, p95, maximum = values
+            lines.append(
+                f"{provider} {label}: n={histogram['count']}, mean {mean}, p50 {p50}, p95 {p95}, max {maximum}"
+            )
+    return lines
+
+
+def format_client_stats(client):
+    """Summarize a client's counters and the process-wide metrics as human-readable lines.
+
+    Reports result cache hits, the image bytes saved by re-encoding, upstream
+    retries and the per-phase timing, payload and token usage histograms.
+
+    Args:
+        client: Provider client or router the batch ran with
+
+    Returns:
+        list: Lines to print after a batch
+    """
+    lines = []
+    stats = client.cache_stats()
+    if isinstance(stats, dict):
+        lines.append(f"Result cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    payload = client.payload_stats()
+    if isinstance(payload, dict) and payload['images']:
+        lines.append(
+            f"Image payload: {payload['sent_bytes'] / 1024:.0f} KB sent, "
+            f"{payload['bytes_saved'] / 1024:.0f} KB saved"
+        )
+
+    resilience = client.resilience_stats()
+    if isinstance(resilience, dict) and (resilience['retries'] or resilience['short_circuits']):
+        lines.append(
+            f"Upstream: {resilience['retries']} retries, "
+            f"{resilience['short_circuits']} requests short-circuited by the circuit breaker"
+        )
+
+    summary = format_summary(get_metrics().snapshot())
+    if summary:
+        lines.append("Request metrics:")
+        lines.extend(f"  {line}" for line in summary)
+    return lines
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics():
+    """Get the process-wide metrics registry.
+
+    Returns:
+        MetricsRegistry: The registry every client records into by default
+    """
+    return _registry
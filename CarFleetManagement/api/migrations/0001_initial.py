@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:58
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('screenshots_dir', models.CharField(max_length=1024)),
+                ('screenshots', models.JSONField(default=list, help_text='File names of the screenshots to analyze')),
+                ('filters', models.JSONField(default=dict, help_text='Language, theme and page filters of the request')),
+                ('results', models.JSONField(default=dict, help_text='Analysis results keyed by file name')),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('duplicates_skipped', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='api_analysi_status_45c851_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScreenshotDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('mtime', models.FloatField(blank=True, help_text='Directory modification time at the last scan', null=True)),
+                ('scanned_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Screenshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255)),
+                ('page', models.CharField(blank=True, max_length=255)),
+                ('language', models.CharField(blank=True, max_length=32)),
+                ('theme', models.CharField(blank=True, max_length=32)),
+                ('captured_at', models.DateTimeField(blank=True, null=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('mtime', models.FloatField()),
+                ('content_hash', models.CharField(help_text='SHA-256 of the file content', max_length=64)),
+                ('directory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='screenshots', to='api.screenshotdirectory')),
+            ],
+            options={
+                'ordering': ['file_name'],
+                'indexes': [models.Index(fields=['directory', 'language', 'theme'], name='api_screens_directo_b0fe79_idx'), models.Index(fields=['directory', 'page'], name='api_screens_directo_722b90_idx'), models.Index(fields=['content_hash'], name='api_screens_content_185aa9_idx')],
+                'constraints': [models.UniqueConstraint(fields=('directory', 'file_name'), name='unique_screenshot_file')],
+            },
+        ),
+    ]
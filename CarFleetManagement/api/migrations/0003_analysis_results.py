@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_screenshot_catalog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Job or file the result was recorded from', max_length=1024)),
+                ('screenshot', models.CharField(max_length=255)),
+                ('page', models.CharField(blank=True, max_length=255)),
+                ('language', models.CharField(blank=True, max_length=32)),
+                ('theme', models.CharField(blank=True, max_length=32)),
+                ('provider', models.CharField(blank=True, max_length=64)),
+                ('model', models.CharField(blank=True, max_length=255)),
+                ('prompt_hash', models.CharField(blank=True, help_text='SHA-256 of the prompt, if known', max_length=64)),
+                ('latency', models.FloatField(blank=True, help_text='Seconds, if known', null=True)),
+                ('prompt_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('completion_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('content', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['-created_at', '-id'], name='api_analysi_created_a0904e_idx'), models.Index(fields=['page', '-created_at'], name='api_analysi_page_32b37c_idx'), models.Index(fields=['language', 'theme', '-created_at'], name='api_analysi_languag_a59f98_idx')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'screenshot'), name='unique_result_per_source')],
+            },
+        ),
+    ]
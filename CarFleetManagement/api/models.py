@@ -1,3 +1,132 @@
+import uuid
+
 from django.db import models
+from django.utils import timezone
+
+
+class AnalysisJob(models.Model):
+    """A batch screenshot analysis queued by the API and run by the analysis_worker command."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    screenshots_dir = models.CharField(max_length=1024)
+    screenshots = models.JSONField(default=list, help_text="File names of the screenshots to analyze")
+    filters = models.JSONField(default=dict, help_text="Language, theme and page filters of the request")
+    results = models.JSONField(default=dict, help_text="Analysis results keyed by file name")
+    completed = models.PositiveIntegerField(default=0)
+    duplicates_skipped = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.id} ({self.status}, {self.completed}/{self.total})"
+
+    @property
+    def total(self):
+        """Number of screenshots in the job."""
+        return len(self.screenshots)
+
+    @property
+    def finished(self):
+        """Whether the job succeeded or failed."""
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+
+class ScreenshotDirectory(models.Model):
+    """A screenshots directory indexed by the catalog, with the state of its last scan."""
+
+    path = models.CharField(max_length=1024, unique=True)
+    mtime = models.FloatField(null=True, blank=True, help_text="Directory modification time at the last scan")
+    scanned_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.path
+
+
+class Screenshot(models.Model):
+    """A screenshot file of a catalogued directory.
+
+    Page, language and theme come from the ``page_lang_theme_timestamp.png``
+    file name; they are blank for files not following that format.
+    """
+
+    directory = models.ForeignKey(ScreenshotDirectory, on_delete=models.CASCADE, related_name='screenshots')
+    file_name = models.CharField(max_length=255)
+    page = models.CharField(max_length=255, blank=True)
+    language = models.CharField(max_length=32, blank=True)
+    theme = models.CharField(max_length=32, blank=True)
+    captured_at = models.DateTimeField(null=True, blank=True)
+    size = models.PositiveBigIntegerField()
+    mtime = models.FloatField()
+    content_hash = models.CharField(max_length=64, help_text="SHA-256 of the file content")
+
+    class Meta:
+        ordering = ['file_name']
+        constraints = [
+            models.UniqueConstraint(fields=['directory', 'file_name'], name='unique_screenshot_file'),
+        ]
+        indexes = [
+            models.Index(fields=['directory', 'language', 'theme']),
+            models.Index(fields=['directory', 'page']),
+            models.Index(fields=['content_hash']),
+        ]
+
+    def __str__(self):
+        return self.file_name
+
+
+class AnalysisResult(models.Model):
+    """The analysis of one screenshot, kept for querying runs over time.
+
+    Rows come from batch jobs and from ingested analysis JSON files; page,
+    language and theme are parsed from the screenshot file name.
+    """
+
+    source = models.CharField(max_length=1024, help_text="Job or file the result was recorded from")
+    screenshot = models.CharField(max_length=255)
+    page = models.CharField(max_length=255, blank=True)
+    language = models.CharField(max_length=32, blank=True)
+    theme = models.CharField(max_length=32, blank=True)
+    provider = models.CharField(max_length=64, blank=True)
+    model = models.CharField(max_length=255, blank=True)
+    prompt_hash = models.CharField(max_length=64, blank=True, help_text="SHA-256 of the prompt, if known")
+    latency = models.FloatField(null=True, blank=True, help_text="Seconds, if known")
+    prompt_tokens = models.PositiveIntegerField(null=True, blank=True)
+    completion_tokens = models.PositiveIntegerField(null=True, blank=True)
+    content = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'screenshot'], name='unique_result_per_source'),
+        ]
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['page', '-created_at']),
+            models.Index(fields=['language', 'theme', '-created_at']),
+        ]
 
-# Create your models here.
+    def __str__(self):
+        return f"{self.screenshot} ({self.created_at:%Y-%m-%d %H:%M})"
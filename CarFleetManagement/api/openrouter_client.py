@@ -2,176 +2,487 @@
 
 This module provides functionality to interact with the OpenRouter API
 for AI-powered analysis of screenshots and other data. Includes rate limiting
-and image resizing to prevent hitting API limits.
+and image resizing to prevent hitting API limits, and caches results so
+unchanged screenshots are not analyzed twice. Requests go over a pooled,
+keep-alive session with connect/read timeouts that is shared process-wide,
+and images are base64-encoded chunk by chunk while the request body is sent.
+Requests made from coroutines go over an httpx AsyncClient of the running
+event loop instead, so they do not hold a thread while waiting. The HTTP
+library and the .env file are only loaded when they are first needed, so
+importing this module does not slow down Django startup.
 """
 
-import os
-import requests
+import asyncio
+import functools
 import json
-import time
-from io import BytesIO
-from pathlib import Path
-from PIL import Image
-from dotenv import load_dotenv
+import threading
+import weakref
 from django.conf import settings
 
-# Load environment variables from .env file
-env_path = Path(settings.BASE_DIR) / '.env'
-load_dotenv(dotenv_path=env_path)
+from .base_client import BaseScreenshotClient, error_result
+from .cache import get_default_cache
+from .env import getenv
+from .packing import packed_instructions, split_packed_answer
+from .payload import Base64Image, JsonBody
+from .rate_limit import get_shared_rate_limiter
+from .resilience import get_circuit_breaker
+from .singleflight import get_single_flight
 
-# Get API key from environment variables
-OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 OPENROUTER_BASE_URL = 'https://openrouter.ai/api/v1'
+OPENROUTER_MODEL = 'anthropic/claude-3-opus'  # Vision-capable model
 
 # Constants for rate limiting and image processing
 MAX_REQUESTS_PER_MINUTE = 10  # Adjust based on OpenRouter API limits
-REQUEST_INTERVAL = 60 / MAX_REQUESTS_PER_MINUTE  # Time between requests in seconds
+RATE_LIMIT_BURST = 3  # Requests that may be sent back to back before throttling
 MAX_IMAGE_RESOLUTION = (1920, 1080)  # FullHD resolution
+MAX_IMAGES_PER_REQUEST = 5  # Screenshots packed into one multi-image request
 
-class OpenRouterClient:
+
+def __getattr__(name):
+    # Resolved on first access so importing this module stays cheap
+    if name == 'OPENROUTER_API_KEY':
+        return getenv('OPENROUTER_API_KEY')
+    if name == 'requests':
+        import requests
+        return requests
+    if name == 'TimeoutSession':
+        return _timeout_session_class()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _api_key():
+    # An OPENROUTER_API_KEY set on the module takes precedence over the environment
+    if 'OPENROUTER_API_KEY' in globals():
+        return globals()['OPENROUTER_API_KEY']
+    return getenv('OPENROUTER_API_KEY')
+
+
+@functools.lru_cache(maxsize=None)
+def _timeout_session_class():
+    """Define TimeoutSession, importing requests, on first use."""
+    import requests
+
+    class TimeoutSession(requests.Session):
+        """requests Session that applies a default (connect, read) timeout to every request."""
+
+        def __init__(self, timeout):
+            super().__init__()
+            self.timeout = timeout
+
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault('timeout', self.timeout)
+            return super().request(method, url, **kwargs)
+
+    TimeoutSession.__module__ = __name__
+    return TimeoutSession
+
+
+def build_session():
+    """Build a pooled, keep-alive HTTP session for OpenRouter.
+
+    Uses an HTTP/2 capable httpx client when OPENROUTER_HTTP2 is enabled and
+    httpx with HTTP/2 support is installed, and a pooled requests Session otherwise.
+
+    Returns:
+        requests.Session | httpx.Client: The HTTP session
+    """
+    pool_size = getattr(settings, 'OPENROUTER_POOL_SIZE', 10)
+    connect_timeout = getattr(settings, 'OPENROUTER_CONNECT_TIMEOUT', 10)
+    read_timeout = getattr(settings, 'OPENROUTER_READ_TIMEOUT', 120)
+
+    if getattr(settings, 'OPENROUTER_HTTP2', False):
+        try:
+            import h2  # noqa: F401 - required by httpx for HTTP/2
+            import httpx
+        except ImportError:
+            pass
+        else:
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+
+    from requests.adapters import HTTPAdapter
+
+    session = _timeout_session_class()(timeout=(connect_timeout, read_timeout))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def build_async_session():
+    """Build a pooled httpx AsyncClient for OpenRouter requests made from coroutines.
+
+    Returns:
+        httpx.AsyncClient: The HTTP session, or None if httpx is not installed
+    """
+    try:
+        import httpx
+    except ImportError:
+        return None
+
+    pool_size = getattr(settings, 'OPENROUTER_ASYNC_POOL_SIZE', 100)
+    connect_timeout = getattr(settings, 'OPENROUTER_CONNECT_TIMEOUT', 10)
+    read_timeout = getattr(settings, 'OPENROUTER_READ_TIMEOUT', 120)
+    http2 = False
+    if getattr(settings, 'OPENROUTER_HTTP2', False):
+        try:
+            import h2  # noqa: F401 - required by httpx for HTTP/2
+        except ImportError:
+            pass
+        else:
+            http2 = True
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+    )
+
+
+_session = None
+_async_sessions = weakref.WeakKeyDictionary()
+_client = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Get the process-wide OpenRouter HTTP session.
+
+    Returns:
+        requests.Session | httpx.Client: The shared session
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+
+def get_async_session():
+    """Get the OpenRouter async HTTP session of the running event loop.
+
+    Connections of an AsyncClient belong to the event loop that opened them,
+    so each loop (one per ASGI worker) gets its own pooled session. The session
+    is closed when the loop shuts down its async generators, as asyncio.run()
+    does before closing the loop.
+
+    Returns:
+        httpx.AsyncClient: The session, or None if httpx is not installed
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if loop not in _async_sessions:
+            session = build_async_session()
+            closer = None
+            if session is not None:
+                closer = _close_on_shutdown(session)
+                # Runs up to its yield right away; the loop now tracks it and closes it on shutdown
+                try:
+                    closer.__anext__().send(None)
+                except StopIteration:
+                    pass
+            # The closer is kept alive with the loop, so it is not finalized early
+            _async_sessions[loop] = (session, closer)
+        return _async_sessions[loop][0]
+
+
+async def _close_on_shutdown(session):
+    """Async generator that closes an async session when the event loop finalizes it."""
+    try:
+        yield
+    finally:
+        await session.aclose()
+
+
+class OpenRouterClient(BaseScreenshotClient):
     """Client for interacting with the OpenRouter API."""
-    
-    def __init__(self, api_key=None):
+
+    provider = 'openrouter'
+    default_prompt = "Analyze this UI screenshot. Focus on critical layout issues "\
+                     "and text rendering problems. Keep response concise and actionable."
+    max_image_resolution = MAX_IMAGE_RESOLUTION
+    requests_per_minute = MAX_REQUESTS_PER_MINUTE
+    rate_limit_burst = RATE_LIMIT_BURST
+    max_images_per_request = MAX_IMAGES_PER_REQUEST
+
+    def __init__(self, api_key=None, model=None, cache=None, rate_limiter=None, session=None,
+                 retry_policy=None, circuit_breaker=None, async_session=None, single_flight=None):
         """Initialize the OpenRouter client.
-        
+
         Args:
             api_key (str, optional): API key for OpenRouter. Defaults to the one in .env file.
+            model (str, optional): Model used for analysis. Defaults to OPENROUTER_MODEL.
+            cache (AnalysisCache, optional): Cache for analysis results. Disabled if not provided.
+            rate_limiter (TokenBucket, optional): Rate limiter. Defaults to one enforcing MAX_REQUESTS_PER_MINUTE.
+            session (requests.Session, optional): HTTP session. Defaults to the process-wide pooled session.
+            retry_policy (RetryPolicy, optional): Backoff for transient failures. Defaults to the AI_RETRY_* settings.
+            circuit_breaker (CircuitBreaker, optional): Circuit breaker. Defaults to one private to this client.
+            async_session (httpx.AsyncClient, optional): HTTP session of async requests.
+                Defaults to the pooled session of the running event loop.
+            single_flight (SingleFlight, optional): Coalesces identical concurrent requests. Disabled if not provided.
         """
-        self.api_key = api_key or OPENROUTER_API_KEY
+        self.api_key = api_key or _api_key()
         if not self.api_key:
             raise ValueError("OpenRouter API key is not set. Please add it to your .env file.")
-            
-        # Rate limiting attributes
-        self.last_request_time = 0
-    
-    def _resize_image(self, image_path):
-        """Resize image to FullHD resolution if larger.
-        
+
+        # Keep-alive connections are reused across requests
+        self.session = session or get_session()
+        self.async_session = async_session
+
+        super().__init__(model or OPENROUTER_MODEL, cache=cache, rate_limiter=rate_limiter,
+                         retry_policy=retry_policy, circuit_breaker=circuit_breaker, single_flight=single_flight)
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    @staticmethod
+    def _image_part(image):
+        # Encoded as base64 while the request body is sent
+        return {"type": "image", "image": {"data": Base64Image(image.data, f"data:{image.mime_type};base64,")}}
+
+    def _request_body(self, payload):
+        """Serialize a request payload into a streamed JSON body.
+
+        Returns:
+            tuple: The JsonBody and the request headers
+        """
+        body = JsonBody(payload)
+        self.metrics.observe(self.provider, 'payload_bytes', len(body))
+        return body, {**self._headers(), "Content-Length": str(len(body))}
+
+    def _post(self, payload):
+        """Send a chat completions request and wait for the response.
+
         Args:
-            image_path (str): Path to the image file
-            
+            payload (dict): Request payload, possibly holding Base64Image values
+
         Returns:
-            BytesIO: BytesIO object containing the resized image
+            requests.Response | httpx.Response: The response
         """
-        with Image.open(image_path) as img:
-            # Check if resizing is needed
-            if img.width > MAX_IMAGE_RESOLUTION[0] or img.height > MAX_IMAGE_RESOLUTION[1]:
-                img.thumbnail(MAX_IMAGE_RESOLUTION, Image.LANCZOS)
-            
-            # Save to BytesIO
-            img_byte_arr = BytesIO()
-            img_format = img.format if img.format else 'PNG'
-            img.save(img_byte_arr, format=img_format)
-            img_byte_arr.seek(0)
-            
-            return img_byte_arr
-    
-    def _apply_rate_limit(self):
-        """Apply rate limiting to avoid hitting API limits."""
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < REQUEST_INTERVAL:
-            sleep_time = REQUEST_INTERVAL - time_since_last_request
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
-    
-    def analyze_screenshot(self, screenshot_path, prompt=None):
-        """Analyze a screenshot using OpenRouter's vision capabilities.
-        
+        import requests
+
+        body, headers = self._request_body(payload)
+        url = f"{OPENROUTER_BASE_URL}/chat/completions"
+        with self._timed('upstream'):
+            if isinstance(self.session, requests.Session):
+                response = self.session.post(url, headers=headers, data=body)
+            else:
+                # httpx client
+                response = self.session.post(url, headers=headers, content=body)
+        self.metrics.observe(self.provider, 'encode_seconds', body.encode_seconds)
+        return response
+
+    async def _post_async(self, session, payload):
+        """Send a chat completions request from a coroutine and wait for the response.
+
         Args:
-            screenshot_path (str): Path to the screenshot file
-            prompt (str, optional): Custom prompt to guide the analysis
-            
+            session (httpx.AsyncClient): The HTTP session
+            payload (dict): Request payload, possibly holding Base64Image values
+
         Returns:
-            dict: The analysis results from OpenRouter
+            httpx.Response: The response
         """
-        if not os.path.exists(screenshot_path):
-            raise FileNotFoundError(f"Screenshot not found at {screenshot_path}")
-        
-        # Default prompt if none provided
-        if not prompt:
-            prompt = "Analyze this UI screenshot. Focus on critical layout issues "\
-                    "and text rendering problems. Keep response concise and actionable."
-        
-        # Prepare the API request
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # Apply rate limiting
-        self._apply_rate_limit()
-        
-        # Resize image if needed
-        img_data = self._resize_image(screenshot_path)
-        
-        # Encode the image as base64
-        import base64
-        image_data = base64.b64encode(img_data.getvalue()).decode('utf-8')
-        
+        body, headers = self._request_body(payload)
+        with self._timed('upstream'):
+            response = await session.post(
+                f"{OPENROUTER_BASE_URL}/chat/completions", headers=headers, content=body.aiter()
+            )
+        self.metrics.observe(self.provider, 'encode_seconds', body.encode_seconds)
+        return response
+
+    def _build_payload(self, image, prompt):
+        """Build the chat completions request body for a prepared image."""
         # Use a vision-capable model and format the request properly
-        payload = {
-            "model": "anthropic/claude-3-opus",  # Vision-capable model
+        return {
+            "model": self.model,
             "messages": [
                 {
-                    "role": "user", 
+                    "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image", "image": {"data": f"data:image/png;base64,{image_data}"}}
+                        self._image_part(image)
                     ]
                 }
             ]
         }
-        
+
+    def _send_request(self, image, prompt):
+        """Send a prepared image to OpenRouter's chat completions endpoint.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Returns:
+            dict: The analysis results from OpenRouter
+        """
         try:
-            response = requests.post(
-                f"{OPENROUTER_BASE_URL}/chat/completions",
-                headers=headers,
-                json=payload
-            )
+            response = self._post(self._build_payload(image, prompt))
+            response.raise_for_status()
+            with self._timed('parse'):
+                return response.json()
+        except Exception as e:
+            return error_result(e)
+
+    async def _send_request_async(self, image, prompt):
+        """Send a prepared image to OpenRouter from a coroutine.
+
+        The request waits on the event loop rather than in a thread, so one
+        worker can keep many requests in flight.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Returns:
+            dict: The analysis results from OpenRouter
+        """
+        session = self.async_session or get_async_session()
+        if session is None:
+            # Without httpx the blocking request runs in a worker thread
+            return await super()._send_request_async(image, prompt)
+
+        try:
+            response = await self._post_async(session, self._build_payload(image, prompt))
             response.raise_for_status()
-            return response.json()
+            with self._timed('parse'):
+                return response.json()
         except Exception as e:
-            return {"error": str(e)}
-    
-    def batch_analyze_screenshots(self, screenshot_dir, language=None, theme=None):
-        """Analyze multiple screenshots in a directory.
-        
+            return error_result(e)
+
+    def _send_group_request(self, images, labels, prompt):
+        """Send several prepared images to OpenRouter in one multi-image request.
+
         Args:
-            screenshot_dir (str): Directory containing screenshots
-            language (str, optional): Filter screenshots by language
-            theme (str, optional): Filter screenshots by theme (light/dark)
-            
+            images (list): The prepared images
+            labels (list): Label of each image, in the same order
+            prompt (str): The analysis prompt
+
         Returns:
-            dict: Analysis results for each screenshot
+            list: One result per image, or None if the answer could not be split per image
+        """
+        content = [{"type": "text", "text": f"{prompt}\n\n{packed_instructions(labels)}"}]
+        for i, (image, label) in enumerate(zip(images, labels), 1):
+            content.append({"type": "text", "text": f"Image {i}: {label}"})
+            content.append(self._image_part(image))
+
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": content}]
+        }
+
+        try:
+            response = self._post(payload)
+            response.raise_for_status()
+            with self._timed('parse'):
+                answer = response.json()
+        except Exception as e:
+            return [error_result(e) for _ in images]
+
+        # Per-image results carry no usage, so the packed request's usage is recorded here
+        self._record_usage(answer.get('usage'))
+
+        if not answer.get('choices'):
+            return None
+        analyses = split_packed_answer(answer['choices'][0]['message']['content'], len(images))
+        if analyses is None:
+            return None
+        return [
+            {"choices": [{"message": {"content": analysis, "role": "assistant"}}]}
+            for analysis in analyses
+        ]
+
+    def _stream_request(self, image, prompt):
+        """Stream the answer to a prepared image from OpenRouter.
+
+        Args:
+            image (PreparedImage): The prepared image
+            prompt (str): The analysis prompt
+
+        Yields:
+            str: Chunks of the answer text as they are generated
         """
-        results = {}
-        
-        if not os.path.isdir(screenshot_dir):
-            raise NotADirectoryError(f"{screenshot_dir} is not a valid directory")
-        
-        # Get all PNG files in the directory
-        screenshots = [f for f in os.listdir(screenshot_dir) if f.endswith('.png')]
-        
-        # Apply filters if specified
-        if language:
-            screenshots = [s for s in screenshots if f"_{language}_" in s]
-        if theme:
-            screenshots = [s for s in screenshots if f"_{theme}_" in s]
-        
-        for screenshot in screenshots:
-            screenshot_path = os.path.join(screenshot_dir, screenshot)
-            results[screenshot] = self.analyze_screenshot(screenshot_path)
-        
-        return results
+        payload = self._build_payload(image, prompt)
+        payload["stream"] = True
+        body, headers = self._request_body(payload)
+        url = f"{OPENROUTER_BASE_URL}/chat/completions"
+
+        import requests
+
+        if isinstance(self.session, requests.Session):
+            response = self.session.post(url, headers=headers, data=body, stream=True)
+            try:
+                response.raise_for_status()
+                yield from parse_sse_deltas(response.iter_lines(decode_unicode=True))
+            finally:
+                response.close()
+        else:
+            # httpx client
+            with self.session.stream("POST", url, headers=headers, content=body) as response:
+                response.raise_for_status()
+                yield from parse_sse_deltas(response.iter_lines())
+
+
+def parse_sse_deltas(lines):
+    """Extract the answer text from an OpenAI-style Server-Sent Events stream.
+
+    Args:
+        lines (iterable): Lines of the event stream
+
+    Yields:
+        str: The content of each completion delta
+
+    Raises:
+        RuntimeError: If the stream reports an error
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        # Blank lines separate events; lines starting with ':' are keep-alive comments
+        if not line or not line.startswith('data:'):
+            continue
+        data = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return
+        chunk = json.loads(data)
+        if 'error' in chunk:
+            error = chunk['error']
+            raise RuntimeError(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+        for choice in chunk.get('choices', []):
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                yield content
 
 
 def get_client():
-    """Get an initialized OpenRouter client.
-    
+    """Get the process-wide OpenRouter client.
+
+    The client is created once per process and reused by the views and
+    management commands. It sends requests over the pooled keep-alive session,
+    shares the process-wide result cache, so screenshots that were already
+    analyzed with the same prompt and model are not sent again, and the
+    host-wide OpenRouter rate limit shared with every other process.
+
     Returns:
         OpenRouterClient: An initialized client instance
     """
-    return OpenRouterClient()
\ No newline at end of file
+    global _client
+    client = _client
+    if client is None:
+        client = OpenRouterClient(
+            cache=get_default_cache(),
+            rate_limiter=get_shared_rate_limiter('openrouter', MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST),
+            circuit_breaker=get_circuit_breaker('openrouter'),
+            single_flight=get_single_flight(),
+        )
+        with _lock:
+            if _client is None:
+                _client = client
+            client = _client
+    return client
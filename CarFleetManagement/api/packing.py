@@ -0,0 +1,134 @@
+"""Packing of related screenshots into multi-image requests.
+
+The capture matrix holds every page in several languages and themes. Related
+screenshots (light and dark of one page and language, or all languages of
+one page and theme) can be analyzed in a single multi-image request that
+asks for a structured answer per image; the answer is then split back into
+one result per screenshot.
+"""
+
+import json
+import os
+
+from .catalog import parse_screenshot_name
+
+# Screenshot name parts (page, language, theme) that vary within a group
+PACK_BY = {
+    'theme': 2,
+    'language': 1,
+}
+
+GROUP_PROMPT = """Analyze these UI screenshots of the {page} page. Each image is labelled with its language and theme.
+Identify any issues with:
+1. Text rendering and translations
+2. Layout and alignment
+3. Theme consistency (colors, contrast)
+4. Responsive design issues
+5. UI element spacing and positioning
+
+Provide a concise summary of findings and recommendations for improvement for each image."""
+
+
+def screenshot_label(key):
+    """Return a human-readable label for a screenshot key.
+
+    Args:
+        key (str): Screenshot file name in the ``page_lang_theme_timestamp.png`` format
+
+    Returns:
+        str: ``page, language, theme``, or the file name if it does not follow the format
+    """
+    page, language, theme, _ = parse_screenshot_name(os.path.basename(key))
+    if not page:
+        return key
+    return f"{page} page, {language} language, {theme} theme"
+
+
+def group_jobs(jobs, by='theme', max_images=None):
+    """Group batch jobs into multi-image requests.
+
+    Screenshots are grouped when their names only differ in the part named by
+    ``by`` (and the timestamp). Screenshots whose names do not follow the
+    ``page_lang_theme_timestamp.png`` format are analyzed on their own with
+    their original prompt.
+
+    Args:
+        jobs (list): ``(key, screenshot_path, prompt)`` tuples
+        by (str): 'theme' to pack light and dark, 'language' to pack all languages
+        max_images (int, optional): Maximum number of screenshots per group
+
+    Returns:
+        list: ``(screenshots, prompt)`` tuples where ``screenshots`` is a list of
+            ``(key, screenshot_path, label)`` tuples
+    """
+    if by not in PACK_BY:
+        raise ValueError(f"Cannot pack screenshots by {by!r}; use one of {', '.join(PACK_BY)}")
+    varying = PACK_BY[by]
+
+    groups = {}
+    singles = []
+    for key, path, prompt in jobs:
+        parts = parse_screenshot_name(os.path.basename(key))[:3]
+        if not parts[0]:
+            singles.append(([(key, path, screenshot_label(key))], prompt))
+            continue
+        group_key = tuple(part for i, part in enumerate(parts) if i != varying)
+        groups.setdefault(group_key, []).append((key, path, screenshot_label(key)))
+
+    packed = []
+    for group_key, screenshots in groups.items():
+        prompt = GROUP_PROMPT.format(page=group_key[0])
+        size = max_images or len(screenshots)
+        for start in range(0, len(screenshots), size):
+            packed.append((screenshots[start:start + size], prompt))
+    return packed + singles
+
+
+def packed_instructions(labels):
+    """Return the instructions asking for one structured answer per image.
+
+    Args:
+        labels (list): Label of each image, in the order the images are sent
+
+    Returns:
+        str: Text appended to the prompt of a multi-image request
+    """
+    listing = '\n'.join(f"Image {i}: {label}" for i, label in enumerate(labels, 1))
+    return (
+        f"You are given {len(labels)} screenshots, in this order:\n{listing}\n\n"
+        "Analyze each image separately. Respond only with a JSON object of the form "
+        '{"images": [{"image": 1, "analysis": "..."}, ...]} containing one entry per image.'
+    )
+
+
+def split_packed_answer(content, count):
+    """Split the answer to a multi-image request into one analysis per image.
+
+    Args:
+        content (str): The model's answer
+        count (int): Number of images in the request
+
+    Returns:
+        list: The analysis text of each image, or None if the answer is not in the expected format
+    """
+    start, end = content.find('{'), content.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        entries = json.loads(content[start:end + 1]).get('images')
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(entries, list):
+        return None
+
+    analyses = [None] * count
+    for position, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get('analysis'), str):
+            return None
+        index = entry.get('image', position + 1)
+        if not isinstance(index, int) or not 1 <= index <= count:
+            return None
+        analyses[index - 1] = entry['analysis']
+    if any(analysis is None for analysis in analyses):
+        return None
+    return analyses
@@ -0,0 +1,122 @@
+"""Streaming JSON request bodies with base64-encoded images.
+
+Building a request with ``json=payload`` holds the image several times at
+once: the base64 bytes, the decoded str, and the serialized JSON body. For a
+multi-megabyte screenshot that is tens of megabytes of transient allocations
+per request. JsonBody serializes everything except the images up front and
+base64-encodes each image in small chunks read from a memoryview while the
+body is sent, so only one chunk of encoded data exists at a time.
+"""
+
+import base64
+import json
+import time
+import uuid
+
+# Multiple of 3, so chunks encode without padding until the last one
+CHUNK_SIZE = 3 * 64 * 1024
+
+
+def base64_length(size):
+    """Return the length of the base64 encoding of ``size`` bytes."""
+    return 4 * -(-size // 3)
+
+
+def iter_base64(data, chunk_size=CHUNK_SIZE):
+    """Base64-encode bytes chunk by chunk without copying the input.
+
+    Args:
+        data (bytes): The data to encode
+        chunk_size (int): Input bytes encoded at a time; must be a multiple of 3
+
+    Yields:
+        bytes: Consecutive parts of the encoding
+    """
+    if chunk_size % 3:
+        raise ValueError("chunk_size must be a multiple of 3")
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield base64.b64encode(view[start:start + chunk_size])
+
+
+class Base64Image:
+    """Placeholder for a base64-encoded image inside a JsonBody payload."""
+
+    def __init__(self, data, prefix=''):
+        """Initialize the placeholder.
+
+        Args:
+            data (bytes): The encoded image file
+            prefix (str): ASCII text put before the base64 data, such as a ``data:`` URL header
+        """
+        self.data = data
+        self.prefix = prefix.encode('ascii')
+
+    def __len__(self):
+        return len(self.prefix) + base64_length(len(self.data))
+
+    def __iter__(self):
+        yield self.prefix
+        yield from iter_base64(self.data)
+
+
+class JsonBody:
+    """JSON request body whose Base64Image values are encoded while it is sent.
+
+    The body has a known length, so HTTP clients send it with a Content-Length
+    header, and it can be iterated more than once (for example by a retry).
+    """
+
+    def __init__(self, payload):
+        """Serialize the payload around its images.
+
+        Args:
+            payload (dict): JSON-serializable data; Base64Image values become JSON strings
+        """
+        self.payload = payload
+        self.encode_seconds = 0.0
+        marker = uuid.uuid4().hex
+        images = []
+
+        def placeholder(value):
+            if not isinstance(value, Base64Image):
+                raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+            images.append(value)
+            return f"{marker}{len(images) - 1}{marker}"
+
+        text = json.dumps(payload, default=placeholder)
+        # Segments alternate between serialized JSON and image indexes
+        segments = text.split(marker)
+        self._parts = []
+        for i, segment in enumerate(segments):
+            self._parts.append(images[int(segment)] if i % 2 else segment.encode('utf-8'))
+
+    def __len__(self):
+        return sum(len(part) for part in self._parts)
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, Base64Image):
+                started = time.perf_counter()
+                for chunk in part:
+                    self.encode_seconds += time.perf_counter() - started
+                    yield chunk
+                    started = time.perf_counter()
+            else:
+                yield part
+
+    async def aiter(self):
+        """Iterate over the body from a coroutine, as async HTTP clients require.
+
+        Chunks are encoded one at a time between writes, so a large image never
+        blocks the event loop for long.
+
+        Yields:
+            bytes: The same chunks as iterating the body
+        """
+        for chunk in self:
+            yield chunk
+
+    def getvalue(self):
+        """Return the whole body as bytes, mainly for tests and debugging."""
+        return b''.join(self)
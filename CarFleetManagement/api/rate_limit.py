@@ -0,0 +1,329 @@
+"""Rate limiting for the AI provider clients.
+
+A token bucket allows short bursts while still enforcing the provider's
+requests-per-minute quota. TokenBucket is shared by the threads of one
+process; SharedTokenBucket keeps its state in SQLite so that every worker
+process and management command on the host draws from the same budget.
+"""
+
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter.
+
+    Callers reserve a token up front and then sleep until it becomes
+    available, so waiters are served in arrival order and the lock is never
+    held while sleeping.
+    """
+
+    def __init__(self, requests_per_minute, burst=1):
+        """Initialize the bucket.
+
+        Args:
+            requests_per_minute (float): Sustained request rate
+            burst (int): Number of requests that may be made back to back
+        """
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def reserve(self):
+        """Reserve a token and return how long to wait before using it.
+
+        Returns:
+            float: Seconds until the reserved token is available
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a token is available.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+# Priority classes for SharedTokenBucket. Interactive requests (API calls for a
+# single screenshot) are served before queued batch requests.
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar('rate_limit_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def rate_limit_priority(priority):
+    """Set the rate limit priority for requests made in this context.
+
+    Args:
+        priority (int): INTERACTIVE or BATCH
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    """Return the rate limit priority of requests made in this context.
+
+    Returns:
+        int: INTERACTIVE or BATCH
+    """
+    return _priority.get()
+
+
+class SharedTokenBucket:
+    """Token bucket whose state is shared by every process on the host.
+
+    Bucket state and the queue of waiting callers live in a SQLite database,
+    so several gunicorn workers and management commands draw from the same
+    per-provider quota. Waiters are served in (priority, arrival) order, so a
+    long batch run cannot starve interactive API requests.
+    """
+
+    poll_interval = 0.25
+    # Waiters behind the head refresh their heartbeat this often, well within stale_after
+    heartbeat_interval = 2.0
+    stale_after = 5.0
+
+    def __init__(self, db_path, name, requests_per_minute, burst=1):
+        """Initialize the bucket.
+
+        Args:
+            db_path (str): Path to the SQLite database holding the shared state
+            name (str): Bucket name, usually the provider name
+            requests_per_minute (float): Sustained request rate
+            burst (int): Number of requests that may be made back to back
+        """
+        self.db_path = str(db_path)
+        self.name = name
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS waiters ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, priority INTEGER, heartbeat REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS waiters_queue ON waiters (name, priority, id)")
+
+    def _connect(self, check_same_thread=True):
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=check_same_thread)
+
+    def acquire(self):
+        """Block until this caller is at the head of the queue and a token is available.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        started = time.time()
+        with closing(self._connect()) as conn:
+            waiter_id = self._enqueue(conn, _priority.get(), started)
+            heartbeat = started
+            try:
+                while True:
+                    wait, heartbeat = self._try_take(conn, waiter_id, heartbeat)
+                    if wait == 0:
+                        return time.time() - started
+                    time.sleep(min(wait, self.poll_interval))
+            except BaseException:
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                raise
+
+    async def acquire_async(self):
+        """Wait like acquire() without blocking the event loop.
+
+        The short SQLite transactions run in worker threads; the waits between
+        them are asyncio sleeps, so a waiting coroutine does not hold a thread.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        started = time.time()
+        priority = _priority.get()
+        # The connection is used from one worker thread at a time. Each step is shielded:
+        # cancelling the wait does not stop its thread, so conn must outlive the step.
+        conn = self._connect(check_same_thread=False)
+        step = asyncio.ensure_future(asyncio.to_thread(self._enqueue, conn, priority, started))
+        waiter_id = None
+        try:
+            waiter_id = await asyncio.shield(step)
+            heartbeat = started
+            while True:
+                step = asyncio.ensure_future(asyncio.to_thread(self._try_take, conn, waiter_id, heartbeat))
+                wait, heartbeat = await asyncio.shield(step)
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait, self.poll_interval))
+        except BaseException:
+            # Also on cancellation; shielded so that the waiter is removed even if cancelled again
+            await asyncio.shield(self._leave_async(conn, step, waiter_id))
+            raise
+        await asyncio.to_thread(conn.close)
+        return time.time() - started
+
+    async def _leave_async(self, conn, step, waiter_id):
+        """Leave the queue once the step in flight is over, then close the connection.
+
+        Args:
+            conn (sqlite3.Connection): The waiter's connection
+            step (asyncio.Future): The last step run in a worker thread, possibly still running
+            waiter_id (int): The waiter's row, or None if step was inserting it
+        """
+        try:
+            result = await step
+        except BaseException:
+            result = None
+        if waiter_id is None:
+            waiter_id = result
+
+        def leave():
+            try:
+                if waiter_id is not None:
+                    conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            finally:
+                conn.close()
+
+        await asyncio.to_thread(leave)
+
+    def _enqueue(self, conn, priority, started):
+        """Add a waiter to the queue.
+
+        Returns:
+            int: The waiter's id
+        """
+        return conn.execute(
+            "INSERT INTO waiters (name, priority, heartbeat) VALUES (?, ?, ?)",
+            (self.name, priority, started),
+        ).lastrowid
+
+    def _try_take(self, conn, waiter_id, heartbeat):
+        """Take a token for waiter_id if it is first in line.
+
+        Waiters behind the head only read their place in the queue, and write
+        their heartbeat every heartbeat_interval; the write lock is taken by the
+        head, and by whoever finds the head stale.
+
+        Args:
+            conn (sqlite3.Connection): The waiter's connection
+            waiter_id (int): The waiter's row
+            heartbeat (float): Time of the waiter's last heartbeat
+
+        Returns:
+            tuple: 0 if a token was taken, otherwise the suggested wait in seconds,
+                and the time of the waiter's last heartbeat
+        """
+        now = time.time()
+        head = conn.execute(
+            "SELECT id, heartbeat FROM waiters WHERE name = ? ORDER BY priority, id LIMIT 1", (self.name,)
+        ).fetchone()
+        if head is not None and head[0] != waiter_id and head[1] >= now - self.stale_after:
+            if now - heartbeat >= self.heartbeat_interval:
+                conn.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, waiter_id))
+                heartbeat = now
+            return self.poll_interval, heartbeat
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, waiter_id))
+            # Waiters of crashed processes stop sending heartbeats and are dropped
+            conn.execute(
+                "DELETE FROM waiters WHERE name = ? AND heartbeat < ?",
+                (self.name, now - self.stale_after),
+            )
+            head = conn.execute(
+                "SELECT id FROM waiters WHERE name = ? ORDER BY priority, id LIMIT 1", (self.name,)
+            ).fetchone()
+
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            if row is None:
+                tokens = float(self.capacity)
+            else:
+                tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+
+            is_head = head is not None and head[0] == waiter_id
+            if is_head and tokens >= 1:
+                tokens -= 1
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+                wait = 0
+            elif is_head:
+                wait = (1 - tokens) / self.rate
+            else:
+                wait = self.poll_interval
+
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+            return wait, now
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+_shared_buckets = {}
+_shared_buckets_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(name, requests_per_minute, burst=1):
+    """Get the host-wide rate limiter for a provider.
+
+    Args:
+        name (str): Provider name
+        requests_per_minute (float): Sustained request rate
+        burst (int): Number of requests that may be made back to back
+
+    Returns:
+        SharedTokenBucket: The bucket stored in the AI_RATE_LIMIT_DB database
+    """
+    with _shared_buckets_lock:
+        if name not in _shared_buckets:
+            db_path = getattr(settings, 'AI_RATE_LIMIT_DB', Path(settings.BASE_DIR) / '.ai_cache' / 'rate_limits.sqlite3')
+            _shared_buckets[name] = SharedTokenBucket(db_path, name, requests_per_minute, burst)
+        return _shared_buckets[name]
@@ -0,0 +1,56 @@
+"""Renderers for the API app."""
+
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+def format_sse(event, data):
+    """Format a Server-Sent Event with a JSON payload.
+
+    Args:
+        event (str): Event name
+        data: JSON-serializable payload
+
+    Returns:
+        str: The event, terminated by a blank line
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renders non-streamed responses to ``Accept: text/event-stream`` clients as one ``result`` event."""
+
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return format_sse('result', data).encode(self.charset)
+
+
+def format_ndjson(data):
+    """Format a JSON payload as one line of newline-delimited JSON.
+
+    Args:
+        data: JSON-serializable payload
+
+    Returns:
+        str: The payload, terminated by a newline
+    """
+    return json.dumps(data) + "\n"
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Renders non-streamed responses to ``Accept: application/x-ndjson`` clients as one line."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return format_ndjson(data).encode(self.charset)
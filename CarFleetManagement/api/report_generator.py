@@ -12,17 +12,27 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils.safestring import mark_safe
 
+from .catalog import parse_screenshot_name
+
+
 class ScreenshotAnalysisReport:
     """Generator for screenshot analysis reports."""
     
-    def __init__(self, analysis_file):
+    def __init__(self, analysis_file=None, analysis_data=None):
         """Initialize the report generator.
         
         Args:
-            analysis_file (str): Path to the JSON file containing analysis results
+            analysis_file (str, optional): Path to the JSON file containing analysis results
+            analysis_data (dict, optional): Analysis results already in memory, keyed by
+                screenshot file name. Used instead of reading ``analysis_file``.
         """
+        if analysis_data is None and analysis_file is None:
+            raise ValueError("Either analysis_file or analysis_data is required")
+        if analysis_data is not None and not isinstance(analysis_data, dict):
+            raise ValueError("Analysis data must be an object keyed by screenshot file name")
+        
         self.analysis_file = analysis_file
-        self.analysis_data = self._load_analysis_data()
+        self.analysis_data = analysis_data if analysis_data is not None else self._load_analysis_data()
         
     def _load_analysis_data(self):
         """Load analysis data from the JSON file.
@@ -50,15 +60,36 @@ class ScreenshotAnalysisReport:
             timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
             output_file = os.path.join(settings.BASE_DIR, f'screenshot_analysis_report_{timestamp}.html')
         
-        # Organize data by page, language, and theme
+        # Write the report section by section instead of building it in memory first
+        with open(output_file, 'w') as f:
+            for chunk in self.iter_html():
+                f.write(chunk)
+        
+        return output_file
+    
+    def iter_html(self):
+        """Render the HTML report incrementally.
+        
+        The analysis data is organized before this returns, so malformed data
+        raises here rather than halfway through a streamed response.
+        
+        Returns:
+            iterator: HTML chunks of the report, the document head first and then
+                one chunk per page
+        """
+        return self._iter_html_template(self._build_context())
+    
+    def _build_context(self):
+        """Organize the analysis data by page, language and theme.
+        
+        Returns:
+            dict: Context data for the template
+        """
         organized_data = {}
         for screenshot, analysis in self.analysis_data.items():
             # Extract metadata from filename (format: page_lang_theme_timestamp.png)
-            parts = screenshot.replace('.png', '').split('_')
-            if len(parts) >= 3:
-                page_name = parts[0]
-                lang = parts[1]
-                theme = parts[2]
+            page_name, lang, theme, _ = parse_screenshot_name(screenshot)
+            if page_name:
                 
                 # Initialize nested dictionaries if they don't exist
                 if page_name not in organized_data:
@@ -79,24 +110,12 @@ class ScreenshotAnalysisReport:
                     'analysis': content
                 }
         
-        # Prepare context for the template
-        context = {
+        return {
             'title': 'Screenshot Analysis Report',
             'generated_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'data': organized_data,
             'screenshot_dir': os.path.join(settings.BASE_DIR, 'debug_screenshots')
         }
-        
-        # Generate HTML content
-        # In a real implementation, you would use Django's template system
-        # Here we're creating a simple HTML structure
-        html_content = self._generate_html_template(context)
-        
-        # Write to file
-        with open(output_file, 'w') as f:
-            f.write(html_content)
-        
-        return output_file
     
     def _generate_html_template(self, context):
         """Generate HTML content for the report.
@@ -107,9 +126,20 @@ class ScreenshotAnalysisReport:
         Returns:
             str: HTML content
         """
+        return ''.join(self._iter_html_template(context))
+    
+    def _iter_html_template(self, context):
+        """Generate the HTML content of the report in chunks.
+        
+        Args:
+            context (dict): Context data for the template
+            
+        Yields:
+            str: The document head, then the section of each page, then the closing tags
+        """
         # In a real implementation, you would use Django's template system
         # For simplicity, we're generating HTML directly here
-        html = f"""
+        yield f"""
         <!DOCTYPE html>
         <html>
         <head>
@@ -133,7 +163,7 @@ class ScreenshotAnalysisReport:
         
         # Add content for each page
         for page_name, languages in context['data'].items():
-            html += f"""
+            html = f"""
             <div class="page-section">
                 <h2>Page: {page_name}</h2>
             """
@@ -160,9 +190,9 @@ class ScreenshotAnalysisReport:
                 html += "</div></div>"
             
             html += "</div>"
+            yield html
         
-        html += "</body></html>"
-        return html
+        yield "</body></html>"
 
 
 def generate_report(analysis_file, output_file=None):
@@ -0,0 +1,195 @@
+"""Retries and circuit breaking for the AI provider clients.
+
+Transient failures (rate limiting, server errors, network errors) are
+retried with exponential backoff and full jitter, waiting at least as long
+as the provider's Retry-After header asks. A per-provider circuit breaker
+stops sending requests to a provider that keeps failing, so a dead upstream
+fails fast instead of costing every remaining screenshot a timeout.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+
+def is_retryable_error(result):
+    """Return whether a failed result is worth retrying.
+
+    Args:
+        result (dict): A result returned by a client
+
+    Returns:
+        bool: True for rate limiting (429), server errors (5xx) and network errors
+    """
+    if 'error' not in result:
+        return False
+    status = result.get('status')
+    if status is not None:
+        return status == 429 or status >= 500
+    return bool(result.get('retryable'))
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header.
+
+    Args:
+        value (str): Delay in seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter."""
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None):
+        """Initialize the policy.
+
+        Args:
+            max_attempts (int, optional): Attempts per request, including the first.
+                Defaults to the AI_RETRY_MAX_ATTEMPTS setting.
+            base_delay (float, optional): Backoff before the first retry.
+                Defaults to the AI_RETRY_BASE_DELAY setting.
+            max_delay (float, optional): Longest wait between attempts; a longer Retry-After
+                ends the retries. Defaults to the AI_RETRY_MAX_DELAY setting.
+        """
+        self.max_attempts = max_attempts or getattr(settings, 'AI_RETRY_MAX_ATTEMPTS', 3)
+        self.base_delay = base_delay if base_delay is not None else getattr(settings, 'AI_RETRY_BASE_DELAY', 1.0)
+        self.max_delay = max_delay if max_delay is not None else getattr(settings, 'AI_RETRY_MAX_DELAY', 30.0)
+
+    def delay(self, attempt, retry_after=None):
+        """Return how long to wait before the next attempt.
+
+        Args:
+            attempt (int): Number of attempts made so far
+            retry_after (float, optional): Delay requested by the provider
+
+        Returns:
+            float: Seconds to wait, or None if the request should not be retried
+        """
+        if attempt >= self.max_attempts:
+            return None
+        if retry_after is not None and retry_after > self.max_delay:
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(backoff, retry_after or 0.0)
+
+
+class CircuitBreaker:
+    """Thread-safe circuit breaker for one provider.
+
+    After ``failure_threshold`` consecutive transient failures the circuit
+    opens and requests fail fast. After ``reset_timeout`` seconds one trial
+    request is let through; its success closes the circuit again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        """Initialize the breaker.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures that open the circuit.
+                Defaults to the AI_CIRCUIT_FAILURE_THRESHOLD setting.
+            reset_timeout (float, optional): Seconds the circuit stays open.
+                Defaults to the AI_CIRCUIT_RESET_TIMEOUT setting.
+        """
+        self.failure_threshold = failure_threshold or getattr(settings, 'AI_CIRCUIT_FAILURE_THRESHOLD', 5)
+        self.reset_timeout = (
+            reset_timeout if reset_timeout is not None else getattr(settings, 'AI_CIRCUIT_RESET_TIMEOUT', 30.0)
+        )
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return whether a request may be sent now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        """Record a request that reached the provider."""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """Record a transient failure."""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class ResilienceStats:
+    """Thread-safe counters of retries and short-circuited requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.short_circuits = 0
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_short_circuit(self):
+        with self._lock:
+            self.short_circuits += 1
+
+    def as_dict(self):
+        """Return the counters.
+
+        Returns:
+            dict: Number of retries and short-circuited requests
+        """
+        with self._lock:
+            return {'retries': self.retries, 'short_circuits': self.short_circuits}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider):
+    """Get the process-wide circuit breaker of a provider.
+
+    Args:
+        provider (str): Provider name
+
+    Returns:
+        CircuitBreaker: The breaker shared by every client of the provider
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker()
+        return _breakers[provider]
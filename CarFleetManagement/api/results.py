@@ -0,0 +1,183 @@
+"""Persisted store of analysis results.
+
+Results used to live only in the JSON files written by the batch commands,
+which had to be loaded whole to answer any question about past runs. Each
+analysis is now an AnalysisResult row, indexed on page, language, theme and
+time: batch jobs record their results as they finish, and existing JSON files
+are loaded with ``manage.py ingest_results``.
+
+The read endpoint pages with a keyset cursor on ``(created_at, id)`` rather
+than an offset, so fetching a page costs the same however far back it is.
+"""
+
+import base64
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .catalog import parse_screenshot_name
+from .models import AnalysisResult
+
+INGEST_BATCH_SIZE = 1000
+UPDATE_FIELDS = [
+    'page', 'language', 'theme', 'provider', 'model', 'prompt_hash', 'latency',
+    'prompt_tokens', 'completion_tokens', 'content', 'error', 'created_at',
+]
+
+
+def prompt_hash(prompt):
+    """Hash a prompt for grouping results analyzed with the same one."""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest() if prompt else ''
+
+
+def build_result(source, screenshot, result, provider='', model='', prompt=None, created_at=None):
+    """Build the row of one analysis result.
+
+    Args:
+        source (str): Job or file the result comes from
+        screenshot (str): Screenshot file name
+        result (dict): Analysis result in the OpenRouter response format, or ``{"error": ...}``
+        provider (str, optional): Provider, if the result does not name it
+        model (str, optional): Model, if the result does not name it
+        prompt (str, optional): Prompt of the analysis
+        created_at (datetime, optional): When the analysis was made. Defaults to now.
+
+    Returns:
+        AnalysisResult: The unsaved row
+    """
+    page, language, theme, _ = parse_screenshot_name(screenshot)
+    usage = result.get('usage') if isinstance(result.get('usage'), dict) else {}
+    content = ''
+    if result.get('choices'):
+        content = result['choices'][0].get('message', {}).get('content') or ''
+    return AnalysisResult(
+        source=source,
+        screenshot=screenshot,
+        page=page,
+        language=language,
+        theme=theme,
+        provider=result.get('provider') or provider,
+        model=result.get('model') or model,
+        prompt_hash=prompt_hash(prompt),
+        latency=result.get('latency'),
+        prompt_tokens=usage.get('prompt_tokens'),
+        completion_tokens=usage.get('completion_tokens'),
+        content=content,
+        error=str(result['error']) if 'error' in result else '',
+        created_at=created_at or timezone.now(),
+    )
+
+
+def ingest_results(source, results, provider='', model='', prompts=None, created_at=None):
+    """Store analysis results, replacing those previously stored from the same source.
+
+    Args:
+        source (str): Job or file the results come from
+        results (dict): Analysis results keyed by screenshot file name
+        provider (str, optional): Provider of results that do not name it
+        model (str, optional): Model of results that do not name it
+        prompts (dict, optional): Prompt of each screenshot
+        created_at (datetime, optional): When the analyses were made. Defaults to now.
+
+    Returns:
+        int: Number of results stored
+    """
+    prompts = prompts or {}
+    created_at = created_at or timezone.now()
+    rows = [
+        build_result(source, screenshot, result, provider, model, prompts.get(screenshot), created_at)
+        for screenshot, result in results.items()
+        if isinstance(result, dict)
+    ]
+    # Re-ingesting a source updates its rows in place
+    AnalysisResult.objects.bulk_create(
+        rows,
+        batch_size=INGEST_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['source', 'screenshot'],
+        update_fields=UPDATE_FIELDS,
+    )
+    return len(rows)
+
+
+def ingest_file(path, provider='', model=''):
+    """Store the results of an analysis JSON file written by the batch commands.
+
+    The results are dated by the file's modification time.
+
+    Args:
+        path (str): Path to the JSON file
+        provider (str, optional): Provider of results that do not name it
+        model (str, optional): Model of results that do not name it
+
+    Returns:
+        int: Number of results stored
+    """
+    path = os.path.abspath(path)
+    with open(path, 'r') as f:
+        results = json.load(f)
+    if not isinstance(results, dict):
+        raise ValueError(f"{path} does not hold analysis results keyed by screenshot")
+    created_at = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.get_current_timezone())
+    return ingest_results(f"file:{path}", results, provider=provider, model=model, created_at=created_at)
+
+
+def encode_cursor(row):
+    """Encode the position after a row as an opaque cursor."""
+    position = f"{row.created_at.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor made by encode_cursor.
+
+    Returns:
+        tuple: ``(created_at, id)`` of the last row of the previous page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(pk)
+    except (UnicodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def query_results(filters=None, cursor=None, limit=50):
+    """Fetch one page of results, newest first.
+
+    Args:
+        filters (dict, optional): Exact values of ``screenshot``, ``page``, ``language``,
+            ``theme``, ``provider`` and ``model``, plus ``since`` and ``until`` datetimes
+        cursor (str, optional): Cursor returned with the previous page
+        limit (int): Page size
+
+    Returns:
+        tuple: The rows of the page and the cursor of the next page (None on the last page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    filters = dict(filters or {})
+    results = AnalysisResult.objects.order_by('-created_at', '-id')
+    since = filters.pop('since', None)
+    until = filters.pop('until', None)
+    if since:
+        results = results.filter(created_at__gte=since)
+    if until:
+        results = results.filter(created_at__lt=until)
+    results = results.filter(**{name: value for name, value in filters.items() if value})
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        results = results.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    # One extra row tells whether there is a next page
+    rows = list(results[:limit + 1])
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
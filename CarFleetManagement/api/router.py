@@ -0,0 +1,513 @@
+"""Latency-aware routing across the AI providers.
+
+OpenRouterClient and GeminiClient return results in the same format, so
+either can serve any request. RouterClient tracks the rolling latency and
+error rate of each provider, sends each request to the fastest healthy one
+and fails over to the next on rate limiting (429), server errors (5xx) and
+network failures. Interactive requests can optionally be hedged: if the
+first provider has not answered within its p95 latency, the request is also
+sent to the second one and the first successful answer wins.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from . import gemini_client, image_prep, openrouter_client
+from .base_client import analyze_many
+from .rate_limit import INTERACTIVE, current_priority
+
+
+def is_failover_error(result):
+    """Return whether a failed result should be retried with another provider.
+
+    Args:
+        result (dict): A result returned by a client
+
+    Returns:
+        bool: True for rate limiting, server errors and errors without an HTTP status
+    """
+    if 'error' not in result:
+        return False
+    status = result.get('status')
+    return status is None or status == 429 or status >= 500
+
+
+def _failed(result):
+    # Multi-image requests return one result per screenshot
+    if isinstance(result, list):
+        return bool(result) and all(is_failover_error(r) for r in result)
+    return is_failover_error(result)
+
+
+class ProviderStats:
+    """Rolling latency and error rate of one provider."""
+
+    def __init__(self, window=50):
+        """Initialize the statistics.
+
+        Args:
+            window (int): Number of recent requests taken into account
+        """
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.unavailable_until = 0.0
+
+    def record(self, latency, ok):
+        """Record the outcome of a request.
+
+        Args:
+            latency (float): Seconds the request took
+            ok (bool): Whether the request succeeded
+        """
+        with self._lock:
+            self._samples.append((latency, ok))
+
+    def error_rate(self):
+        """Return the fraction of recent requests that failed."""
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def latency(self, percentile=50, min_samples=1):
+        """Return a percentile of the latency of recent successful requests.
+
+        Args:
+            percentile (float): Percentile between 0 and 100
+            min_samples (int): Minimum number of successful requests needed for an estimate
+
+        Returns:
+            float: Latency in seconds, or None if there are too few successful requests
+        """
+        with self._lock:
+            latencies = sorted(latency for latency, ok in self._samples if ok)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def as_dict(self):
+        """Return the statistics.
+
+        Returns:
+            dict: Request count, error rate, p50/p95 latency and availability
+        """
+        with self._lock:
+            requests = len(self._samples)
+        return {
+            'requests': requests,
+            'error_rate': self.error_rate(),
+            'latency_p50': self.latency(50),
+            'latency_p95': self.latency(95),
+            'available': time.monotonic() >= self.unavailable_until,
+        }
+
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+# Hedged requests that lost the race keep running, so their result is still cached and recorded
+_background_tasks = set()
+
+
+def _shareable(screenshot):
+    """Return a screenshot source that several providers can read, possibly at the same time.
+
+    Paths are checked and passed on; file-like objects are read once, since failover
+    and hedged requests would otherwise share their read position.
+    """
+    if image_prep.is_path(screenshot):
+        if not os.path.exists(screenshot):
+            raise FileNotFoundError(f"Screenshot not found at {screenshot}")
+        return screenshot
+    return image_prep.read_image(screenshot)
+
+
+def _get_hedge_pool():
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'AI_ROUTER_HEDGE_POOL_SIZE', 32), thread_name_prefix='hedge'
+            )
+        return _hedge_pool
+
+
+class RouterClient:
+    """Client that routes each request to the fastest healthy provider.
+
+    Implements the interface of the provider clients, so it can be used
+    wherever an OpenRouterClient or GeminiClient is expected.
+    """
+
+    provider = 'router'
+    min_hedge_samples = 5
+
+    def __init__(self, clients, hedge=None, hedge_delay=None, max_error_rate=None, cooldown=None, window=50):
+        """Initialize the router.
+
+        Args:
+            clients (list): Provider clients, in order of preference when no latency is known yet
+            hedge (bool, optional): Hedge interactive requests. Defaults to the AI_ROUTER_HEDGE setting.
+            hedge_delay (float, optional): Delay before hedging while a provider has too few
+                latency samples for a p95. Defaults to the AI_ROUTER_HEDGE_DELAY setting.
+            max_error_rate (float, optional): Providers with a higher recent error rate are only
+                used when no other is healthy. Defaults to the AI_ROUTER_MAX_ERROR_RATE setting.
+            cooldown (float, optional): Seconds a provider is avoided after a 429/5xx.
+                Defaults to the AI_ROUTER_COOLDOWN setting.
+            window (int): Number of recent requests the statistics are based on
+        """
+        if not clients:
+            raise ValueError("RouterClient needs at least one provider client")
+        self.clients = list(clients)
+        self.hedge = getattr(settings, 'AI_ROUTER_HEDGE', False) if hedge is None else hedge
+        self.hedge_delay = hedge_delay if hedge_delay is not None else getattr(settings, 'AI_ROUTER_HEDGE_DELAY', 8.0)
+        self.max_error_rate = (
+            max_error_rate if max_error_rate is not None else getattr(settings, 'AI_ROUTER_MAX_ERROR_RATE', 0.5)
+        )
+        self.cooldown = cooldown if cooldown is not None else getattr(settings, 'AI_ROUTER_COOLDOWN', 30)
+        self.stats = {client.provider: ProviderStats(window) for client in self.clients}
+
+        for client in self.clients:
+            client.request_listeners.append(self._record)
+        # Images prepared ahead of time, by path: (preparation options, PreparedImage)
+        self._prefetched = {}
+        self._prefetched_lock = threading.Lock()
+
+    @property
+    def default_prompt(self):
+        """Default prompt of the most preferred provider."""
+        return self.clients[0].default_prompt
+
+    def image_options(self):
+        """Return the image preparation options of the most preferred provider.
+
+        Returns:
+            dict: Keyword arguments for image_prep.prepare_image
+        """
+        return self.ranked_clients()[0].image_options()
+
+    def prefetch_image(self, image_path, prepared, options=None):
+        """Hand over an image that was prepared ahead of time.
+
+        The image is passed on to whichever provider analyzes ``image_path`` next,
+        provided it prepares images with the same options.
+
+        Args:
+            image_path (str): Path to the image file
+            prepared (PreparedImage): The prepared image
+            options (dict, optional): Options it was prepared with. Defaults to image_options().
+        """
+        options = options if options is not None else self.image_options()
+        with self._prefetched_lock:
+            self._prefetched[image_path] = (options, prepared)
+
+    def clear_prefetched(self):
+        """Drop prepared images that were never used."""
+        with self._prefetched_lock:
+            self._prefetched.clear()
+        for client in self.clients:
+            client.clear_prefetched()
+
+    def _take_prefetched(self, screenshot):
+        """Return the prefetched image of a path and its options, or (None, None)."""
+        if not isinstance(screenshot, str):
+            return None, None
+        with self._prefetched_lock:
+            return self._prefetched.pop(screenshot, (None, None))
+
+    def _record(self, client, latency, error):
+        stats = self.stats[client.provider]
+        stats.record(latency, error is None)
+        if error is not None and is_failover_error(error):
+            stats.unavailable_until = time.monotonic() + self.cooldown
+
+    def ranked_clients(self):
+        """Return the clients ordered from most to least preferred.
+
+        Healthy providers come first, fastest (median latency) first; providers
+        without latency samples yet are tried before slower known ones.
+
+        Returns:
+            list: The provider clients
+        """
+        now = time.monotonic()
+
+        def key(item):
+            index, client = item
+            stats = self.stats[client.provider]
+            healthy = now >= stats.unavailable_until and stats.error_rate() <= self.max_error_rate
+            latency = stats.latency(50)
+            return (not healthy, latency if latency is not None else 0.0, index)
+
+        return [client for _, client in sorted(enumerate(self.clients), key=key)]
+
+    def _call(self, call):
+        """Run ``call(client)`` on the preferred provider, failing over and hedging as configured."""
+        ranked = self.ranked_clients()
+        if self.hedge and len(ranked) > 1 and current_priority() == INTERACTIVE:
+            return self._hedged(ranked, call)
+        return self._with_failover(ranked, call)
+
+    def _with_failover(self, ranked, call):
+        result = None
+        for client in ranked:
+            result = call(client)
+            if not _failed(result):
+                return result
+        return result
+
+    def _hedge_after(self, client):
+        latency = self.stats[client.provider].latency(95, min_samples=self.min_hedge_samples)
+        return self.hedge_delay if latency is None else latency
+
+    def _hedged(self, ranked, call):
+        """Send the request to the preferred provider and, if it is slow, to the next one too."""
+        primary, backup = ranked[0], ranked[1]
+        pool = _get_hedge_pool()
+        started = threading.Event()
+
+        def call_primary():
+            started.set()
+            return call(primary)
+
+        pending = {pool.submit(call_primary)}
+        # The hedge delay counts from when the request runs, not from when it was queued in a busy pool
+        started.wait()
+        done, _ = wait(pending, timeout=self._hedge_after(primary))
+        if not done:
+            pending.add(pool.submit(call, backup))
+        elif _failed(next(iter(done)).result()):
+            # The primary failed before the hedge was due: fail over as usual
+            return self._with_failover(ranked[1:], call)
+
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if not _failed(result):
+                    # The slower request keeps running; its result is still cached and recorded
+                    return result
+        return result
+
+    def analyze_screenshot(self, screenshot, prompt=None):
+        """Analyze a screenshot with the preferred provider.
+
+        Args:
+            screenshot (str | bytes | file): Path to the screenshot file, its bytes, or a
+                file-like object such as an uploaded file
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            dict: The analysis results in the OpenRouter response format
+        """
+        screenshot = _shareable(screenshot)
+        options, prepared = self._take_prefetched(screenshot)
+
+        def call(client):
+            if prepared is not None and client.image_options() == options:
+                client.prefetch_image(screenshot, prepared)
+            return client.analyze_screenshot(screenshot, prompt=prompt)
+
+        return self._call(call)
+
+    async def _call_async(self, call):
+        """Await ``call(client)`` on the preferred provider, failing over and hedging as configured."""
+        ranked = self.ranked_clients()
+        if self.hedge and len(ranked) > 1 and current_priority() == INTERACTIVE:
+            return await self._hedged_async(ranked, call)
+        return await self._with_failover_async(ranked, call)
+
+    async def _with_failover_async(self, ranked, call):
+        result = None
+        for client in ranked:
+            result = await call(client)
+            if not _failed(result):
+                return result
+        return result
+
+    async def _hedged_async(self, ranked, call):
+        """Like _hedged, with tasks on the running event loop instead of the hedge thread pool."""
+        primary, backup = ranked[0], ranked[1]
+        pending = {asyncio.ensure_future(call(primary))}
+        done, _ = await asyncio.wait(pending, timeout=self._hedge_after(primary))
+        if not done:
+            pending.add(asyncio.ensure_future(call(backup)))
+        elif _failed(next(iter(done)).result()):
+            return await self._with_failover_async(ranked[1:], call)
+
+        result = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if not _failed(result):
+                    for slower in pending:
+                        _background_tasks.add(slower)
+                        slower.add_done_callback(_background_tasks.discard)
+                    return result
+        return result
+
+    async def analyze_screenshot_async(self, screenshot, prompt=None):
+        """Analyze a screenshot with the preferred provider from a coroutine.
+
+        Args:
+            screenshot (str | bytes | file): Path to the screenshot file, its bytes, or a
+                file-like object such as an uploaded file
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            dict: The analysis results in the OpenRouter response format
+        """
+        screenshot = _shareable(screenshot)
+        return await self._call_async(lambda client: client.analyze_screenshot_async(screenshot, prompt=prompt))
+
+    def analyze_screenshot_group(self, screenshots, prompt=None):
+        """Analyze several related screenshots with the preferred provider.
+
+        Args:
+            screenshots (list): ``(label, screenshot)`` tuples, where screenshot is a path,
+                bytes or a file-like object
+            prompt (str, optional): Custom prompt to guide the analysis
+
+        Returns:
+            list: The analysis result of each screenshot, in order
+        """
+        screenshots = [(label, _shareable(screenshot)) for label, screenshot in screenshots]
+        return self._with_failover(
+            self.ranked_clients(), lambda client: client.analyze_screenshot_group(screenshots, prompt=prompt)
+        )
+
+    def analyze_screenshot_stream(self, screenshot, prompt=None):
+        """Stream the analysis of a screenshot from the preferred provider.
+
+        The request fails over to the next provider only if it fails before
+        the first chunk of the answer has been sent.
+
+        Yields:
+            tuple: Events as yielded by BaseScreenshotClient.analyze_screenshot_stream
+        """
+        screenshot = _shareable(screenshot)
+        ranked = self.ranked_clients()
+        for i, client in enumerate(ranked):
+            events = client.analyze_screenshot_stream(screenshot, prompt=prompt)
+            kind, data = next(events)
+            if kind == 'result' and _failed(data) and i < len(ranked) - 1:
+                continue
+            yield kind, data
+            yield from events
+            return
+
+    def batch_analyze_screenshots(self, screenshot_dir, language=None, theme=None, max_workers=None):
+        """Analyze multiple screenshots in a directory, routing each request.
+
+        Args:
+            screenshot_dir (str): Directory containing screenshots
+            language (str, optional): Filter screenshots by language
+            theme (str, optional): Filter screenshots by theme (light/dark)
+            max_workers (int, optional): Number of requests in flight at once.
+                Defaults to the AI_BATCH_CONCURRENCY setting.
+
+        Returns:
+            dict: Analysis results for each screenshot
+        """
+        if not os.path.isdir(screenshot_dir):
+            raise NotADirectoryError(f"{screenshot_dir} is not a valid directory")
+
+        # Imported here because the catalog models need the Django app registry
+        from .catalog import find_screenshots
+
+        screenshots = find_screenshots(screenshot_dir, language=language, theme=theme)
+
+        jobs = [(screenshot, os.path.join(screenshot_dir, screenshot), None) for screenshot in screenshots]
+        return analyze_many(self, jobs, max_workers=max_workers)
+
+    def provider_stats(self):
+        """Return the rolling statistics of each provider.
+
+        Returns:
+            dict: ProviderStats.as_dict() keyed by provider name
+        """
+        return {provider: stats.as_dict() for provider, stats in self.stats.items()}
+
+    def cache_stats(self):
+        """Return the result cache counters, summed over the distinct caches of the providers.
+
+        Returns:
+            dict: Hit/miss counters, or None if caching is disabled
+        """
+        caches = {id(client.cache): client.cache for client in self.clients if client.cache is not None}
+        if not caches:
+            return None
+        totals = {}
+        for cache in caches.values():
+            for name, value in cache.stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def resilience_stats(self):
+        """Return the retry and circuit breaker counters summed over the providers.
+
+        Returns:
+            dict: Number of retries and short-circuited requests
+        """
+        totals = {}
+        for client in self.clients:
+            for name, value in client.resilience_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def payload_stats(self):
+        """Return the image payload counters summed over the providers.
+
+        Returns:
+            dict: Image count and original, sent and saved bytes
+        """
+        totals = {}
+        for client in self.clients:
+            for name, value in client.payload_stats().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_client():
+    """Get the process-wide router over every configured provider.
+
+    Providers are taken from the AI_PROVIDERS setting, in order of preference;
+    providers without an API key are skipped.
+
+    Returns:
+        RouterClient: The router
+
+    Raises:
+        ValueError: If no provider has an API key
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            factories = {
+                'openrouter': openrouter_client.get_client,
+                'gemini': gemini_client.get_client,
+            }
+            clients = []
+            for name in getattr(settings, 'AI_PROVIDERS', ['openrouter', 'gemini']):
+                try:
+                    clients.append(factories[name]())
+                except ValueError:
+                    # API key not configured
+                    continue
+            if not clients:
+                raise ValueError("No AI provider API key is set. Please add one to your .env file.")
+            _router = RouterClient(clients)
+        return _router
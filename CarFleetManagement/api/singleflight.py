@@ -0,0 +1,384 @@
+"""Coalescing of identical in-flight analysis requests.
+
+When the same screenshot is analyzed with the same prompt and model by
+several callers at once (a CI run and a developer, or two batch jobs), only
+the first caller sends the upstream request; the others wait for it and get
+its result. SingleFlight coalesces the threads and coroutines of one process;
+SharedSingleFlight also records in-flight requests in a SQLite lock table, so
+every worker process and management command on the host takes part.
+
+Coalescing complements the result cache: the cache only helps once a result
+is stored, single-flight covers the requests made while it is being fetched.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing, suppress
+from pathlib import Path
+
+from django.conf import settings
+
+
+class _Flight:
+    """A call in progress and, once done, its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # (loop, future) of the coroutines waiting for the call
+        self._waiters = []
+        self._lock = threading.Lock()
+
+    def finish(self, result=None, error=None):
+        """Record the outcome of the call and wake up every thread and coroutine waiting for it."""
+        self.result = result
+        self.error = error
+        with self._lock:
+            self.done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            # The loop of a waiter that gave up may already be closed
+            with suppress(RuntimeError):
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def wait(self):
+        """Wait for the call in a thread.
+
+        Returns:
+            The return value of the call
+
+        Raises:
+            Exception: The exception raised by the call
+        """
+        self.done.wait()
+        return self._outcome()
+
+    async def wait_async(self):
+        """Wait for the call in a coroutine, without holding a thread.
+
+        Returns:
+            The return value of the call
+
+        Raises:
+            Exception: The exception raised by the call
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if not self.done.is_set():
+                self._waiters.append((loop, future))
+            else:
+                future.set_result(None)
+        await future
+        return self._outcome()
+
+    def _outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """Runs one call per key at a time, sharing its outcome with concurrent callers in the process.
+
+    Threads and coroutines take part in the same flights: a coroutine may wait
+    for a call made by a thread and the other way around.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def begin(self, key, wait=True):
+        """Join the call for key in flight, or claim key for the caller.
+
+        A caller that gets None makes the call itself and must report its
+        outcome with end(), also when it fails.
+
+        Args:
+            key (str): Identifies equivalent calls
+            wait (bool): Whether the caller may block to join a call made elsewhere;
+                only used by SharedSingleFlight
+
+        Returns:
+            _Flight: The call made by another caller, or None if the caller makes it
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight
+            self._flights[key] = _Flight()
+            return None
+
+    def end(self, key, result=None, error=None):
+        """Report the outcome of a call claimed with begin().
+
+        Args:
+            key (str): Key passed to begin()
+            result: The return value of the call
+            error (BaseException, optional): The exception raised by the call
+
+        Returns:
+            _Flight: The finished call
+        """
+        with self._lock:
+            flight = self._flights.pop(key)
+        flight.finish(result, error)
+        return flight
+
+    def do(self, key, func):
+        """Call ``func()``, unless a call for key is already in flight.
+
+        Args:
+            key (str): Identifies equivalent calls
+            func (callable): Makes the call
+
+        Returns:
+            The return value of the call, possibly made by another thread
+
+        Raises:
+            Exception: The exception raised by the call, in every thread waiting on it
+        """
+        flight = self.begin(key)
+        if flight is not None:
+            return flight.wait()
+
+        try:
+            result = func()
+        except BaseException as e:
+            self.end(key, error=e)
+            raise
+        self.end(key, result=result)
+        return result
+
+    async def do_async(self, key, func):
+        """Await ``func()``, unless a call for key is already in flight.
+
+        The asyncio counterpart of do(); waiting for another caller does not hold a thread.
+
+        Args:
+            key (str): Identifies equivalent calls
+            func (callable): Returns the coroutine making the call
+
+        Returns:
+            The return value of the call, possibly made by another coroutine or thread
+
+        Raises:
+            Exception: The exception raised by the call, in every caller waiting on it
+        """
+        flight = await self._begin_async(key)
+        if flight is not None:
+            return await flight.wait_async()
+
+        try:
+            result = await func()
+        except BaseException as e:
+            await self._end_async(key, error=e)
+            raise
+        await self._end_async(key, result=result)
+        return result
+
+    async def _begin_async(self, key):
+        return self.begin(key)
+
+    async def _end_async(self, key, result=None, error=None):
+        self.end(key, result=result, error=error)
+
+
+class SharedSingleFlight(SingleFlight):
+    """Single-flight shared by every process on the host.
+
+    Threads and coroutines of a process first coalesce in memory; the one call
+    left per process then claims the key in a SQLite table. The process holding
+    the claim makes the call and stores its JSON result in the row, where the
+    other processes poll for it. A claim expires after ``lease`` seconds, so
+    a crashed process does not block the key.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, db_path, lease=300, keep_results=30):
+        """Initialize the lock table.
+
+        Args:
+            db_path (str): Path to the SQLite database holding the in-flight calls
+            lease (float): Seconds after which an unfinished claim is considered abandoned
+            keep_results (float): Seconds a finished result stays available to the waiting processes
+        """
+        super().__init__()
+        self.db_path = str(db_path)
+        self.lease = lease
+        self.keep_results = keep_results
+        # Token of the claim held for each key this process makes the call for
+        self._tokens = {}
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS flights ("
+                "key TEXT PRIMARY KEY, token TEXT, expires_at REAL, finished_at REAL, result TEXT)"
+            )
+
+    def _connect(self):
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def begin(self, key, wait=True):
+        """Join the call for key in flight in any process, or claim key for the caller.
+
+        Args:
+            key (str): Identifies equivalent calls
+            wait (bool): Whether to wait for a call claimed by another process. If not,
+                the caller makes the call itself, only shared with this process.
+
+        Returns:
+            _Flight: The call made by another caller, or None if the caller makes it
+        """
+        flight = super().begin(key)
+        if flight is not None:
+            return flight
+
+        try:
+            with closing(self._connect()) as conn:
+                while True:
+                    token = uuid.uuid4().hex
+                    leader = self._claim(conn, key, token)
+                    if leader is None:
+                        with self._lock:
+                            self._tokens[key] = token
+                        return None
+                    if not wait:
+                        return None
+
+                    result = self._wait(conn, key, leader)
+                    if result is not None:
+                        break
+                    # The other process gave up or crashed; claim the key again
+        except BaseException as e:
+            super().end(key, error=e)
+            raise
+        # Share the other process's result with the callers waiting in this one
+        return super().end(key, result=result)
+
+    def end(self, key, result=None, error=None):
+        """Report the outcome of a call claimed with begin(), to this process and the others.
+
+        Args:
+            key (str): Key passed to begin()
+            result: The return value of the call; must be JSON-serializable
+            error (BaseException, optional): The exception raised by the call
+
+        Returns:
+            _Flight: The finished call
+        """
+        with self._lock:
+            token = self._tokens.pop(key, None)
+        try:
+            if token is not None:
+                with closing(self._connect()) as conn:
+                    if error is not None:
+                        conn.execute("DELETE FROM flights WHERE key = ? AND token = ?", (key, token))
+                    else:
+                        conn.execute(
+                            "UPDATE flights SET finished_at = ?, result = ? WHERE key = ? AND token = ?",
+                            (time.time(), json.dumps(result), key, token),
+                        )
+        finally:
+            flight = super().end(key, result=result, error=error)
+        return flight
+
+    async def _begin_async(self, key):
+        # Waiting for another process blocks, so it runs in a worker thread. Shielded so
+        # that a claim taken for a caller cancelled in the meantime is still released.
+        step = asyncio.ensure_future(asyncio.to_thread(self.begin, key))
+        try:
+            return await asyncio.shield(step)
+        except asyncio.CancelledError:
+            step.add_done_callback(lambda step: self._abandon(key, step))
+            raise
+
+    def _abandon(self, key, step):
+        """Release the claim that begin() took for a caller that was cancelled."""
+        if not step.cancelled() and step.exception() is None and step.result() is None:
+            self.end(key, error=asyncio.CancelledError())
+
+    async def _end_async(self, key, result=None, error=None):
+        await asyncio.shield(asyncio.to_thread(self.end, key, result=result, error=error))
+
+    def _claim(self, conn, key, token):
+        """Claim key for this caller unless another process holds it.
+
+        Returns:
+            str: The token of the process holding the claim, or None if this caller got it
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            conn.execute(
+                "DELETE FROM flights WHERE finished_at < ? OR (finished_at IS NULL AND expires_at < ?)",
+                (now - self.keep_results, now),
+            )
+            row = conn.execute(
+                "SELECT token, expires_at FROM flights WHERE key = ? AND finished_at IS NULL", (key,)
+            ).fetchone()
+            if row is not None and row[1] >= now:
+                conn.execute("COMMIT")
+                return row[0]
+
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, token, expires_at, finished_at, result) "
+                "VALUES (?, ?, ?, NULL, NULL)",
+                (key, token, now + self.lease),
+            )
+            conn.execute("COMMIT")
+            return None
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _wait(self, conn, key, leader):
+        """Wait for the call claimed by another process.
+
+        Returns:
+            The result of the call, or None if the claim was abandoned
+        """
+        while True:
+            row = conn.execute(
+                "SELECT token, expires_at, finished_at, result FROM flights WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] != leader or (row[2] is None and row[1] < time.time()):
+                return None
+            if row[2] is not None:
+                return json.loads(row[3])
+            time.sleep(self.poll_interval)
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """Get the host-wide single-flight of the provider clients.
+
+    Returns:
+        SharedSingleFlight: The single-flight stored in the AI_SINGLEFLIGHT_DB database
+    """
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SharedSingleFlight(
+                getattr(settings, 'AI_SINGLEFLIGHT_DB', Path(settings.BASE_DIR) / '.ai_cache' / 'inflight.sqlite3'),
+                lease=getattr(settings, 'AI_SINGLEFLIGHT_LEASE', 300),
+            )
+        return _single_flight
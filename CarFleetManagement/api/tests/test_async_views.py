@@ -0,0 +1,159 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, SimpleTestCase, TestCase
+from django.urls import reverse
+from PIL import Image
+
+from api.base_client import BaseScreenshotClient
+from api.metrics import MetricsRegistry
+from api.rate_limit import TokenBucket
+from api.resilience import RetryPolicy
+from api.router import RouterClient
+
+
+class SlowUpstreamClient(BaseScreenshotClient):
+    """Provider client whose upstream answers after a fixed latency, counting requests in flight.
+
+    With ``hold_until``, requests are held until that many are in flight at once,
+    ``latency`` being the longest they wait.
+    """
+
+    default_prompt = 'Default prompt'
+
+    def __init__(self, latency, results=None, provider='slow', hold_until=None):
+        self.provider = provider
+        # Failover is tested without the client's own retries
+        super().__init__(
+            f"{provider}-model", rate_limiter=TokenBucket(600000, burst=10000), retry_policy=RetryPolicy(max_attempts=1)
+        )
+        self.metrics = MetricsRegistry()
+        self.latency = latency
+        self.hold_until = hold_until
+        self.released = None
+        self.results = list(results or [])
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def _send_request_async(self, image, prompt):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.hold_until is None:
+                await asyncio.sleep(self.latency)
+            else:
+                self.released = self.released or asyncio.Event()
+                if self.in_flight >= self.hold_until:
+                    self.released.set()
+                try:
+                    await asyncio.wait_for(self.released.wait(), self.latency)
+                except asyncio.TimeoutError:
+                    # Not concurrent enough; let the remaining requests through
+                    self.released.set()
+        finally:
+            self.in_flight -= 1
+        if self.results:
+            return self.results.pop(0)
+        return {'choices': [{'message': {'content': f"{self.provider}: {prompt}"}}]}
+
+
+def png_bytes():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 32), 'white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class AnalyzeScreenshotAsyncViewTestCase(SimpleTestCase):
+    """Test cases for the async single screenshot endpoint."""
+
+    async def test_post(self):
+        """Test that the upload is analyzed through the router's async path."""
+        unavailable = SlowUpstreamClient(0, [{'error': '503 Service Unavailable', 'status': 503}])
+        router = RouterClient([unavailable, SlowUpstreamClient(0, provider='backup')], hedge=False)
+        upload = SimpleUploadedFile('screenshot.png', png_bytes(), content_type='image/png')
+
+        with mock.patch('api.views.get_client', return_value=router):
+            response = await AsyncClient().post(
+                reverse('analyze_screenshot_async'), {'screenshot': upload, 'prompt': 'Custom prompt'}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        # The first provider failed, so the request failed over to the backup
+        self.assertEqual(response.json()['choices'][0]['message']['content'], 'backup: Custom prompt')
+
+    async def test_post_without_screenshot(self):
+        """Test POST request without screenshot file."""
+        response = await AsyncClient().post(reverse('analyze_screenshot_async'), {})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class BatchAnalyzeScreenshotsAsyncViewTestCase(TestCase):
+    """Test cases for the async batch endpoint."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.base_dir = tempfile.mkdtemp()
+        override = self.settings(BASE_DIR=self.base_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        screenshots_dir = os.path.join(self.base_dir, 'debug_screenshots')
+        os.makedirs(screenshots_dir)
+        for i, name in enumerate(['home_en_dark', 'home_en_light', 'about_fr_dark']):
+            Image.new('RGB', (64, 32), (i * 100, 0, 0)).save(os.path.join(screenshots_dir, f"{name}_20250331-201208.png"))
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    async def test_post_with_language_filter(self):
+        """Test that the matching screenshots are analyzed concurrently and returned."""
+        client = SlowUpstreamClient(0.2)
+
+        with mock.patch('api.views.get_client', return_value=client), \
+                mock.patch('api.dedup.deduplicate', side_effect=lambda jobs: (jobs, {})):
+            response = await AsyncClient().post(reverse('batch_analyze_screenshots_async'), {'language': 'en'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(response.json()), ['home_en_dark_20250331-201208.png', 'home_en_light_20250331-201208.png']
+        )
+        self.assertEqual(client.peak_in_flight, 2)
+
+    async def test_post_with_no_matching_screenshots(self):
+        """Test POST request with filters that match no screenshots."""
+        response = await AsyncClient().post(reverse('batch_analyze_screenshots_async'), {'language': 'de'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncLoadTestCase(SimpleTestCase):
+    """Load test: concurrent analyses held by a single event loop, as in one uvicorn worker."""
+
+    requests = 200
+    # Longest a request is held waiting for the others to arrive
+    max_latency = 30.0
+
+    async def test_concurrency_per_worker(self):
+        """Test that one worker keeps every request waiting upstream at the same time."""
+        client = SlowUpstreamClient(self.max_latency, hold_until=self.requests)
+        image = png_bytes()
+        http = AsyncClient()
+
+        async def post(i):
+            upload = SimpleUploadedFile(f"screenshot_{i}.png", image, content_type='image/png')
+            return await http.post(reverse('analyze_screenshot_async'), {'screenshot': upload})
+
+        with mock.patch('api.views.get_client', return_value=client):
+            responses = await asyncio.gather(*(post(i) for i in range(self.requests)))
+
+        self.assertEqual({response.status_code for response in responses}, {200})
+        # Upstream calls are only released once all of them are in flight, however slow the machine
+        self.assertEqual(
+            client.peak_in_flight, self.requests,
+            f"{client.peak_in_flight} of {self.requests} requests in flight at once"
+        )
@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+
+from api.cache import AnalysisCache, DiskCache, MemoryCache, make_cache_key
+from api.openrouter_client import OpenRouterClient
+from api.rate_limit import TokenBucket
+
+
+class CacheKeyTestCase(TestCase):
+    """Test cases for make_cache_key."""
+
+    def test_key_depends_on_all_parts(self):
+        """Test that image, prompt and model all change the key."""
+        key = make_cache_key(b'image', 'prompt', 'model')
+        self.assertEqual(key, make_cache_key(b'image', 'prompt', 'model'))
+        self.assertNotEqual(key, make_cache_key(b'other', 'prompt', 'model'))
+        self.assertNotEqual(key, make_cache_key(b'image', 'other', 'model'))
+        self.assertNotEqual(key, make_cache_key(b'image', 'prompt', 'other'))
+
+
+class MemoryCacheTestCase(TestCase):
+    """Test cases for the in-memory LRU tier."""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is evicted first."""
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_expired_entries_are_dropped(self):
+        """Test that entries older than the TTL are not returned."""
+        cache = MemoryCache(max_entries=2, ttl=10)
+        cache.set('a', 1)
+        with mock.patch('api.cache.time.time', return_value=time.time() + 11):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class DiskCacheTestCase(TestCase):
+    """Test cases for the on-disk tier."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_survives_new_instance(self):
+        """Test that entries written by one instance are read by another."""
+        DiskCache(self.cache_dir).set('abcdef', {'choices': []})
+        self.assertEqual(DiskCache(self.cache_dir).get('abcdef'), {'choices': []})
+
+    def test_expired_entries_are_removed(self):
+        """Test that expired entries are treated as misses and deleted."""
+        cache = DiskCache(self.cache_dir, ttl=10)
+        cache.set('abcdef', {'choices': []})
+        with mock.patch('api.cache.time.time', return_value=time.time() + 11):
+            self.assertIsNone(cache.get('abcdef'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, 'ab', 'abcdef.json')))
+
+    def test_size_budget_evicts_oldest(self):
+        """Test that the directory is pruned when it exceeds max_bytes."""
+        cache = DiskCache(self.cache_dir, max_bytes=300)
+        for i in range(10):
+            cache.set(f"{i:02d}key", {'content': 'x' * 50})
+
+        total = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(self.cache_dir)
+            for name in names
+        )
+        self.assertLessEqual(total, 300)
+        self.assertIsNotNone(cache.get('09key'))
+
+
+class AnalysisCacheTestCase(TestCase):
+    """Test cases for the two-tier AnalysisCache."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = AnalysisCache(memory=MemoryCache(), disk=DiskCache(self.cache_dir))
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_counters(self):
+        """Test hit/miss counting across tiers."""
+        self.assertIsNone(self.cache.get('abcdef'))
+        self.cache.set('abcdef', {'choices': []})
+        self.cache.get('abcdef')
+        self.cache.memory.clear()
+        self.cache.get('abcdef')
+
+        self.assertEqual(self.cache.stats(), {'hits': 2, 'misses': 1, 'memory_hits': 1, 'disk_hits': 1})
+
+    def test_client_reuses_cached_result(self):
+        """Test that analyze_screenshot only calls the provider once per image and prompt."""
+        screenshot = os.path.join(self.cache_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(screenshot)
+
+        client = OpenRouterClient(api_key='test_api_key', cache=self.cache, rate_limiter=TokenBucket(600, burst=10))
+        result = {'choices': [{'message': {'content': 'Analysis result'}}]}
+
+        with mock.patch.object(client, '_send_request', return_value=result) as mock_send:
+            self.assertEqual(client.analyze_screenshot(screenshot), result)
+            self.assertEqual(client.analyze_screenshot(screenshot), result)
+            client.analyze_screenshot(screenshot, prompt='Another prompt')
+
+        self.assertEqual(mock_send.call_count, 2)
+        self.assertEqual(client.cache_stats()['hits'], 1)
+
+    def test_client_does_not_cache_errors(self):
+        """Test that failed analyses are retried on the next call."""
+        screenshot = os.path.join(self.cache_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(screenshot)
+
+        client = OpenRouterClient(api_key='test_api_key', cache=self.cache, rate_limiter=TokenBucket(600, burst=10))
+
+        with mock.patch.object(client, '_send_request', return_value={'error': 'API error'}) as mock_send:
+            client.analyze_screenshot(screenshot)
+            client.analyze_screenshot(screenshot)
+
+        self.assertEqual(mock_send.call_count, 2)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+from django.test import TestCase
+
+from api import catalog
+from api.catalog import find_screenshots, parse_screenshot_name, refresh
+from api.models import Screenshot
+
+
+class ParseScreenshotNameTestCase(TestCase):
+    """Test cases for the screenshot file name parser."""
+
+    def test_parse_timestamped_name(self):
+        """Test that page names may contain underscores ahead of the language and theme."""
+        captured_at = datetime(2025, 3, 31, 20, 12, 8, tzinfo=dt_timezone.utc)
+        self.assertEqual(parse_screenshot_name('home_en_dark_20250331-201208.png'), ('home', 'en', 'dark', captured_at))
+        self.assertEqual(
+            parse_screenshot_name('fleet_en_map_fr_light_20250331-201208.png'), ('fleet_en_map', 'fr', 'light', captured_at)
+        )
+
+    def test_parse_other_names(self):
+        """Test names without timestamp or not following the format."""
+        self.assertEqual(parse_screenshot_name('home_en_dark.png'), ('home', 'en', 'dark', None))
+        self.assertEqual(parse_screenshot_name('logo.png'), ('', '', '', None))
+
+
+class ScreenshotCatalogTestCase(TestCase):
+    """Test cases for the screenshot catalog."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshots = [
+            'about_fr_dark_20250331-201239.png',
+            'home_en_dark_20250331-201208.png',
+            'home_en_light_20250331-201203.png',
+            'x_en_y_de_dark_20250331-201208.png',
+        ]
+        for screenshot in self.screenshots + ['notes.txt']:
+            self._write(screenshot, 'test image content')
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _write(self, file_name, content):
+        with open(os.path.join(self.tmp_dir, file_name), 'w') as f:
+            f.write(content)
+
+    def test_find_screenshots(self):
+        """Test listing the PNG screenshots matching the filters."""
+        self.assertEqual(find_screenshots(self.tmp_dir), self.screenshots)
+        self.assertEqual(find_screenshots(self.tmp_dir, language='en', theme='dark'), self.screenshots[1:2])
+        self.assertEqual(find_screenshots(self.tmp_dir, page='home'), self.screenshots[1:3])
+        self.assertEqual(find_screenshots(self.tmp_dir, page='features'), [])
+        # A page whose name contains "_en_" is not taken for an English screenshot
+        self.assertEqual(find_screenshots(self.tmp_dir, language='de'), self.screenshots[3:])
+
+    def test_catalog_records_metadata(self):
+        """Test the metadata stored for each screenshot."""
+        find_screenshots(self.tmp_dir)
+        screenshot = Screenshot.objects.get(file_name='x_en_y_de_dark_20250331-201208.png')
+        self.assertEqual((screenshot.page, screenshot.language, screenshot.theme), ('x_en_y', 'de', 'dark'))
+        self.assertEqual(screenshot.size, len('test image content'))
+        self.assertEqual(len(screenshot.content_hash), 64)
+
+    def test_unchanged_directory_is_not_listed_again(self):
+        """Test that the catalog is only rescanned when the directory changed."""
+        find_screenshots(self.tmp_dir)
+
+        with mock.patch('api.catalog.scan', wraps=catalog.scan) as scan:
+            find_screenshots(self.tmp_dir, language='en')
+            scan.assert_not_called()
+
+            os.remove(os.path.join(self.tmp_dir, self.screenshots[0]))
+            self._write('home_fr_dark_20250331-201238.png', 'new screenshot')
+            # Make the change visible even on filesystems with coarse timestamps
+            os.utime(self.tmp_dir, (0, 0))
+            self.assertEqual(find_screenshots(self.tmp_dir, theme='dark'), [
+                'home_en_dark_20250331-201208.png',
+                'home_fr_dark_20250331-201238.png',
+                'x_en_y_de_dark_20250331-201208.png',
+            ])
+            scan.assert_called_once()
+
+    def test_rescan_only_hashes_changed_files(self):
+        """Test that a rescan hashes new and modified files only."""
+        find_screenshots(self.tmp_dir)
+        path = os.path.join(self.tmp_dir, self.screenshots[0])
+        self._write(self.screenshots[0], 'rewritten in place, longer')
+
+        with mock.patch('api.catalog.file_hash', wraps=catalog.file_hash) as file_hash:
+            refresh(self.tmp_dir, max_age=0)
+
+        file_hash.assert_called_once_with(path)
+        self.assertEqual(Screenshot.objects.get(file_name=self.screenshots[0]).size, len('rewritten in place, longer'))
+        self.assertEqual(Screenshot.objects.count(), len(self.screenshots))
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import TestCase
+from PIL import Image, ImageDraw
+
+from api.dedup import HashIndex, deduplicate, dhash, expand_results, hamming_distances, phash
+
+
+def make_screenshot(path, offset=0, noise=False):
+    """Draw a simple page layout, optionally shifted or with a few changed pixels."""
+    img = Image.new('RGB', (640, 360), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 640, 60), fill=(30, 30, 120))
+    draw.rectangle((40 + offset, 100, 300 + offset, 300), fill=(200, 60, 60))
+    draw.ellipse((400, 120, 560, 280), fill=(60, 160, 60))
+    if noise:
+        draw.point([(10, 200), (11, 200), (600, 340)], fill='black')
+    img.save(path)
+
+
+class PerceptualHashTestCase(TestCase):
+    """Test cases for the perceptual hash functions."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_near_identical_images_have_close_hashes(self):
+        """Test that a few changed pixels barely change the hash while a different layout does."""
+        base = os.path.join(self.tmp_dir, 'base.png')
+        noisy = os.path.join(self.tmp_dir, 'noisy.png')
+        moved = os.path.join(self.tmp_dir, 'moved.png')
+        make_screenshot(base)
+        make_screenshot(noisy, noise=True)
+        make_screenshot(moved, offset=250)
+
+        for hash_function in (dhash, phash):
+            with Image.open(base) as a, Image.open(noisy) as b, Image.open(moved) as c:
+                hashes = np.array([hash_function(b), hash_function(c)], dtype=np.uint64)
+                near, far = hamming_distances(hash_function(a), hashes)
+            self.assertLessEqual(near, 2)
+            self.assertGreater(far, 8)
+
+    def test_hamming_distances(self):
+        """Test the vectorized bit count."""
+        values = np.array([0b1011, 2 ** 64 - 1], dtype=np.uint64)
+        self.assertEqual(list(hamming_distances(0, values)), [3, 64])
+
+
+class DeduplicateTestCase(TestCase):
+    """Test cases for grouping near-identical screenshots."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = {}
+        for name, kwargs in (
+            ('home_en_dark_20250331-201208.png', {}),
+            ('home_en_dark_20250331-211208.png', {'noise': True}),
+            ('home_en_dark_20250331-221208.png', {'offset': 250}),
+        ):
+            self.paths[name] = os.path.join(self.tmp_dir, name)
+            make_screenshot(self.paths[name], **kwargs)
+        self.index = HashIndex()
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_near_identical_screenshots_share_analysis(self):
+        """Test that only visually different screenshots are analyzed, keeping the newest capture."""
+        jobs = [(name, path, 'Prompt') for name, path in self.paths.items()]
+
+        unique, duplicates = deduplicate(jobs, threshold=4, index=self.index)
+
+        self.assertEqual([key for key, _, _ in unique],
+                         ['home_en_dark_20250331-211208.png', 'home_en_dark_20250331-221208.png'])
+        self.assertEqual(duplicates, {'home_en_dark_20250331-201208.png': 'home_en_dark_20250331-211208.png'})
+
+        results = expand_results({key: {'content': key} for key, _, _ in unique}, duplicates)
+        self.assertEqual(results['home_en_dark_20250331-201208.png'], {'content': 'home_en_dark_20250331-211208.png'})
+
+    def test_newest_capture_is_kept_whatever_the_order(self):
+        """Test that the most recent capture of a group is analyzed, by name timestamp or modification time."""
+        older, newer = 'home_en_dark_20250331-201208.png', 'home_en_dark_20250331-211208.png'
+        jobs = [(newer, self.paths[newer], 'Prompt'), (older, self.paths[older], 'Prompt')]
+        unique, duplicates = deduplicate(jobs, threshold=4, index=self.index)
+        self.assertEqual(([key for key, _, _ in unique], duplicates), ([newer], {older: newer}))
+
+        # Names without a timestamp fall back to the file modification time
+        os.utime(self.paths[older], (1000, 1000))
+        os.utime(self.paths[newer], (2000, 2000))
+        jobs = [('a', self.paths[older], 'Prompt'), ('b', self.paths[newer], 'Prompt')]
+        unique, duplicates = deduplicate(jobs, threshold=4, index=self.index)
+        self.assertEqual(([key for key, _, _ in unique], duplicates), (['b'], {'a': 'b'}))
+
+    def test_different_prompts_are_not_merged(self):
+        """Test that identical images analyzed with different prompts are both analyzed."""
+        path = self.paths['home_en_dark_20250331-201208.png']
+        unique, duplicates = deduplicate([('a', path, 'Prompt A'), ('b', path, 'Prompt B')], index=self.index)
+        self.assertEqual(len(unique), 2)
+        self.assertEqual(duplicates, {})
+
+    def test_negative_threshold_disables(self):
+        """Test that a negative threshold analyzes every screenshot."""
+        jobs = [(name, path, None) for name, path in self.paths.items()]
+        unique, duplicates = deduplicate(jobs, threshold=-1, index=self.index)
+        self.assertEqual(unique, jobs)
+        self.assertEqual(duplicates, {})
+
+    def test_unreadable_files_are_analyzed(self):
+        """Test that files that cannot be hashed are never skipped."""
+        bogus = os.path.join(self.tmp_dir, 'bogus.png')
+        with open(bogus, 'w') as f:
+            f.write('test image content')
+        jobs = [('a', bogus, None), ('b', bogus, None), ('c', '/nonexistent.png', None)]
+
+        unique, duplicates = deduplicate(jobs, threshold=4, index=self.index)
+        self.assertEqual(unique, jobs)
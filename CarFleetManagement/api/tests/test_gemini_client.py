@@ -0,0 +1,128 @@
+import asyncio
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from api.base_client import analyze_many_async
+from api.cache import AnalysisCache, MemoryCache
+from api.gemini_client import GeminiClient, get_client
+from api.rate_limit import TokenBucket
+
+
+def gemini_response(text, prompt_tokens=1000, completion_tokens=50):
+    """Build a mock Gemini response."""
+    return mock.Mock(
+        text=text,
+        usage_metadata=mock.Mock(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            total_token_count=prompt_tokens + completion_tokens,
+        ),
+    )
+
+
+class GeminiClientTestCase(TestCase):
+    """Test cases for the GeminiClient class."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.genai = mock.Mock()
+        self.model = self.genai.GenerativeModel.return_value
+        self.model.generate_content.return_value = gemini_response('Looks fine')
+        self.model.generate_content_async = mock.AsyncMock(return_value=gemini_response('Looks fine async'))
+        patchers = [
+            mock.patch('api.gemini_client._genai', return_value=self.genai),
+            mock.patch('api.gemini_client._configured_key', None),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshot = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(self.screenshot)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_client(self, **kwargs):
+        return GeminiClient(api_key='test_api_key', rate_limiter=TokenBucket(6000, burst=100), **kwargs)
+
+    def test_model_is_built_once(self):
+        """Test that one configured model serves every request of the client."""
+        client = self.make_client(generation_config={'max_output_tokens': 256, 'temperature': 0.2})
+        client.analyze_screenshot(self.screenshot)
+        client.analyze_screenshot(self.screenshot, prompt='Another prompt')
+
+        self.genai.GenerativeModel.assert_called_once_with(
+            client.model, generation_config={'max_output_tokens': 256, 'temperature': 0.2}
+        )
+        self.assertEqual(self.model.generate_content.call_count, 2)
+
+    def test_sdk_is_configured_once_per_key(self):
+        """Test that the process-wide SDK configuration only changes with the API key."""
+        self.make_client()
+        self.make_client()
+        GeminiClient(api_key='other_key')
+
+        self.assertEqual(
+            self.genai.configure.call_args_list, [mock.call(api_key='test_api_key'), mock.call(api_key='other_key')]
+        )
+
+    @override_settings(GEMINI_MODEL='gemini-test', GEMINI_MAX_OUTPUT_TOKENS=512, GEMINI_TEMPERATURE=None)
+    def test_settings(self):
+        """Test that the model and generation config default to the settings."""
+        client = self.make_client()
+        self.assertEqual(client.model, 'gemini-test')
+        self.assertEqual(client.generation_config, {'max_output_tokens': 512})
+
+    def test_result_format_and_usage(self):
+        """Test that answers are returned in the OpenRouter format with token usage."""
+        result = self.make_client().analyze_screenshot(self.screenshot)
+
+        self.assertEqual(result['choices'][0]['message']['content'], 'Looks fine')
+        self.assertEqual(result['usage'], {'prompt_tokens': 1000, 'completion_tokens': 50, 'total_tokens': 1050})
+
+    def test_generation_config_in_cache_key(self):
+        """Test that results cached with other generation parameters are not reused."""
+        cache = AnalysisCache(memory=MemoryCache())
+        self.make_client(cache=cache, generation_config={'temperature': 0.0}).analyze_screenshot(self.screenshot)
+        self.make_client(cache=cache, generation_config={'temperature': 1.0}).analyze_screenshot(self.screenshot)
+        self.make_client(cache=cache, generation_config={'temperature': 0.0}).analyze_screenshot(self.screenshot)
+
+        self.assertEqual(self.model.generate_content.call_count, 2)
+
+    def test_analyze_screenshot_async(self):
+        """Test that the async path uses the SDK's asyncio API."""
+        result = asyncio.run(self.make_client().analyze_screenshot_async(self.screenshot))
+
+        self.assertEqual(result['choices'][0]['message']['content'], 'Looks fine async')
+        self.model.generate_content_async.assert_awaited_once()
+        self.model.generate_content.assert_not_called()
+
+    def test_analyze_many_async(self):
+        """Test analyzing a batch concurrently on the event loop."""
+        other = os.path.join(self.tmp_dir, 'home_en_light_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'black').save(other)
+        completed = []
+
+        results = asyncio.run(analyze_many_async(
+            self.make_client(), [('dark', self.screenshot, None), ('light', other, 'Prompt')],
+            max_workers=2, on_result=lambda key, result: completed.append(key),
+        ))
+
+        self.assertEqual(list(results), ['dark', 'light'])
+        self.assertEqual(sorted(completed), ['dark', 'light'])
+        self.assertEqual(self.model.generate_content_async.await_count, 2)
+
+    @mock.patch('api.gemini_client._client', None)
+    def test_get_client_is_reused(self):
+        """Test that the process-wide client is created once."""
+        with mock.patch('api.gemini_client.GeminiClient') as mock_client:
+            self.assertIs(get_client(), get_client())
+            mock_client.assert_called_once()
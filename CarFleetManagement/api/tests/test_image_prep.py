@@ -0,0 +1,160 @@
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from io import BytesIO
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+from PIL.JpegImagePlugin import JpegImageFile
+
+from api.image_prep import ImageStats, InvalidImageError, prepare_image, sniff_mime_type, validate_image
+
+
+def _noisy_image(size):
+    """Create an image that does not compress well."""
+    return Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+
+
+class SniffMimeTypeTestCase(TestCase):
+    """Test cases for sniff_mime_type."""
+
+    def test_known_formats(self):
+        """Test detection of the supported formats from their magic numbers."""
+        self.assertEqual(sniff_mime_type(b'\x89PNG\r\n\x1a\n\x00\x00\x00\r'), 'image/png')
+        self.assertEqual(sniff_mime_type(b'\xff\xd8\xff\xe0\x00\x10JFIF\x00'), 'image/jpeg')
+        self.assertEqual(sniff_mime_type(b'RIFF\x00\x00\x00\x00WEBP'), 'image/webp')
+        self.assertIsNone(sniff_mime_type(b'test image c'))
+
+
+def _png_chunk(chunk_type, data):
+    """Encode a PNG chunk."""
+    chunk = chunk_type + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk))
+
+
+def _png_header(width, height):
+    """Create a PNG declaring the given size, without any pixel data."""
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', ihdr) + _png_chunk(b'IDAT', b'')
+
+
+class ValidateImageTestCase(TestCase):
+    """Test cases for validate_image."""
+
+    def test_valid_image(self):
+        """Test that the format and dimensions are read and the file is rewound."""
+        buffer = BytesIO()
+        Image.new('RGB', (200, 100), 'white').save(buffer, format='PNG')
+        buffer.seek(30)
+
+        self.assertEqual(validate_image(buffer), ('image/png', 200, 100))
+        self.assertEqual(buffer.tell(), 0)
+        self.assertEqual(validate_image(buffer.getvalue()), ('image/png', 200, 100))
+
+    def test_unsupported_format(self):
+        """Test that files that are not an accepted image are rejected."""
+        with self.assertRaisesMessage(InvalidImageError, 'Unsupported image format'):
+            validate_image(b'test image content')
+
+        buffer = BytesIO()
+        Image.new('RGB', (200, 100), 'white').save(buffer, format='JPEG')
+        with self.assertRaisesMessage(InvalidImageError, 'expected PNG'):
+            validate_image(buffer.getvalue(), formats=['image/png'])
+
+    def test_truncated_header(self):
+        """Test that a file with a valid signature but a broken header is rejected."""
+        with self.assertRaisesMessage(InvalidImageError, 'could not be read'):
+            validate_image(b'\x89PNG\r\n\x1a\n\x00\x00\x00\r')
+
+    def test_oversized_dimensions(self):
+        """Test that oversized images are rejected from their header alone."""
+        with self.assertRaisesMessage(InvalidImageError, 'largest side'):
+            validate_image(_png_header(20000, 10), max_dimension=16384)
+        with self.assertRaisesMessage(InvalidImageError, 'at most 40000000 pixels'):
+            validate_image(_png_header(8000, 8000), max_dimension=16384, max_pixels=40_000_000)
+        with self.assertRaisesMessage(InvalidImageError, 'too many pixels'):
+            validate_image(_png_header(60000, 60000), max_dimension=100000, max_pixels=10 ** 10)
+
+
+class PrepareImageTestCase(TestCase):
+    """Test cases for prepare_image."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_small_image_passes_through_without_decoding(self):
+        """Test that a small image is sent as-is and never decoded."""
+        Image.new('RGB', (200, 100), 'white').save(self.path)
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+
+        with mock.patch('PIL.ImageFile.ImageFile.load') as mock_load:
+            prepared = prepare_image(self.path, byte_budget=1024 * 1024)
+
+        mock_load.assert_not_called()
+        self.assertEqual(prepared.data, raw)
+        self.assertEqual(prepared.mime_type, 'image/png')
+        self.assertEqual(prepared.bytes_saved, 0)
+
+    def test_large_image_is_reencoded_within_budget(self):
+        """Test that an image over budget is re-encoded to JPEG under the budget."""
+        _noisy_image((800, 600)).save(self.path)
+
+        prepared = prepare_image(self.path, byte_budget=100 * 1024)
+
+        self.assertEqual(prepared.mime_type, 'image/jpeg')
+        self.assertLessEqual(prepared.size, 100 * 1024)
+        self.assertGreater(prepared.bytes_saved, 0)
+        self.assertEqual(Image.open(BytesIO(prepared.data)).format, 'JPEG')
+
+    def test_oversized_image_is_downscaled(self):
+        """Test that images above the resolution limit are thumbnailed."""
+        Image.new('RGBA', (3840, 2160), (255, 0, 0, 128)).save(self.path)
+
+        prepared = prepare_image(self.path, max_resolution=(1920, 1080), image_format='WEBP')
+
+        self.assertEqual(prepared.mime_type, 'image/webp')
+        self.assertEqual((prepared.width, prepared.height), (1920, 1080))
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        """Test that JPEGs above the resolution limit are decoded straight to about the target size."""
+        Image.new('RGB', (4000, 3000), 'white').save(self.path, format='JPEG')
+
+        draft = JpegImageFile.draft
+        with mock.patch.object(JpegImageFile, 'draft', autospec=True, side_effect=draft) as mock_draft:
+            prepared = prepare_image(self.path, max_resolution=(1920, 1080))
+
+        self.assertEqual(mock_draft.call_args_list[0].args[1:], ('RGB', (1440, 1080)))
+        self.assertEqual((prepared.width, prepared.height), (1440, 1080))
+
+    def test_bytes_and_file_objects(self):
+        """Test that images can be prepared from bytes and file-like objects without a path."""
+        Image.new('RGB', (200, 100), 'white').save(self.path)
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+
+        upload = BytesIO(raw)
+        upload.read(10)  # Already read, e.g. by a validator
+        for source in (raw, upload):
+            prepared = prepare_image(source, byte_budget=1024 * 1024)
+            self.assertEqual(prepared.data, raw)
+            self.assertEqual(prepared.mime_type, 'image/png')
+
+    def test_stats(self):
+        """Test that ImageStats accumulates sizes and savings."""
+        _noisy_image((400, 300)).save(self.path)
+        stats = ImageStats()
+        prepared = prepare_image(self.path, byte_budget=50 * 1024)
+        stats.record(prepared)
+
+        self.assertEqual(stats.as_dict()['images'], 1)
+        self.assertEqual(stats.as_dict()['bytes_saved'], prepared.bytes_saved)
@@ -0,0 +1,176 @@
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+from PIL import Image, ImageDraw
+
+from api.incremental import UNCHANGED_HEADING, BaselineStore, IncrementalBatch, baseline_key, changed_regions
+
+
+def make_page(path=None, navbar=(30, 30, 120), footer_text=False):
+    """Draw a 1920x1080 page with a navbar and optional footer text."""
+    img = Image.new('RGB', (1920, 1080), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 1920, 64), fill=navbar)
+    draw.rectangle((200, 200, 1700, 900), fill=(230, 230, 230))
+    if footer_text:
+        draw.rectangle((1500, 1030, 1700, 1050), fill='black')
+    if path:
+        img.save(path)
+    return img
+
+
+class ChangedRegionsTestCase(TestCase):
+    """Test cases for changed region detection."""
+
+    def test_identical_images_have_no_regions(self):
+        """Test that identical screenshots produce no boxes."""
+        self.assertEqual(changed_regions(make_page(), make_page()), [])
+
+    def test_regions_cover_changes_with_context(self):
+        """Test that each separate change gets its own box grown by the context margin."""
+        boxes = changed_regions(make_page(), make_page(navbar=(120, 30, 30), footer_text=True), context=16)
+
+        self.assertEqual(len(boxes), 2)
+        navbar, footer = boxes
+        self.assertEqual(navbar, (0, 0, 1920, 80 + 16))
+        self.assertLessEqual(footer[0], 1500 - 16)
+        self.assertLessEqual(footer[1], 1030 - 16)
+        self.assertGreaterEqual(footer[2], 1700)
+        self.assertGreaterEqual(footer[3], 1050 + 16)
+
+    def test_size_mismatch(self):
+        """Test that screenshots of different sizes cannot be compared."""
+        self.assertIsNone(changed_regions(make_page(), Image.new('RGB', (800, 600))))
+
+    def test_baseline_key(self):
+        """Test the page/language/theme key of a screenshot name."""
+        self.assertEqual(baseline_key('home_en_dark_20250331-201208.png'), 'home_en_dark')
+        self.assertEqual(baseline_key('/tmp/vehicle_list_en_dark_20250331-201208.png'), 'vehicle_list_en_dark')
+        self.assertIsNone(baseline_key('screenshot.png'))
+
+
+class IncrementalBatchTestCase(TestCase):
+    """Test cases for incremental batch planning."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = BaselineStore(os.path.join(self.tmp_dir, 'baselines'))
+        self.first = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        self.second = os.path.join(self.tmp_dir, 'home_en_dark_20250401-201208.png')
+        make_page(self.first)
+        make_page(self.second, footer_text=True)
+        self.baseline_analysis = {'choices': [{'message': {'content': 'Analysis of the baseline'}}]}
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run_batch(self, path, update_baseline=False, failed=()):
+        key = os.path.basename(path)
+        with IncrementalBatch(self.store, default_prompt='Default', update_baseline=update_baseline) as batch:
+            planned, unchanged = batch.build_jobs([(key, path, None)])
+            sizes = []
+            for _, job_path, _ in planned:
+                with Image.open(job_path) as img:
+                    sizes.append(img.size)
+            results = {
+                job_key: {'error': 'Upstream error'} if job_key in failed
+                else {'choices': [{'message': {'content': f"Analysis of {job_key}"}}]}
+                for job_key, _, _ in planned
+            }
+            return planned, unchanged, sizes, batch.assemble(results)
+
+    def test_first_run_analyzes_whole_screenshot_and_stores_baseline(self):
+        """Test that a screenshot without a baseline is analyzed as a whole and becomes the baseline."""
+        planned, unchanged, sizes, results = self.run_batch(self.first)
+
+        self.assertEqual(planned, [('home_en_dark_20250331-201208.png', self.first, None)])
+        self.assertEqual(sizes, [(1920, 1080)])
+        self.assertIsNotNone(self.store.get('home_en_dark'))
+        self.assertEqual(self.store.get_analysis('home_en_dark'), results['home_en_dark_20250331-201208.png'])
+
+    def test_baseline_without_analysis_is_analyzed_whole(self):
+        """Test that a baseline stored without its analysis does not yield region jobs."""
+        self.store.save('home_en_dark', self.first)
+
+        planned, unchanged, sizes, results = self.run_batch(self.second)
+
+        self.assertEqual([key for key, _, _ in planned], ['home_en_dark_20250401-201208.png'])
+        self.assertEqual(unchanged, [])
+
+    def test_rerun_sends_only_changed_regions(self):
+        """Test that a rerun only analyzes a crop of the changed footer."""
+        self.store.save('home_en_dark', self.first, self.baseline_analysis)
+
+        planned, unchanged, sizes, results = self.run_batch(self.second)
+
+        self.assertEqual(len(planned), 1)
+        self.assertEqual(planned[0][0], 'home_en_dark_20250401-201208.png#region1')
+        self.assertIn('Default', planned[0][2])
+        self.assertIn('cropped region', planned[0][2])
+        width, height = sizes[0]
+        self.assertLess(width * height, 1920 * 1080 / 20)
+
+        result = results['home_en_dark_20250401-201208.png']
+        content = result['choices'][0]['message']['content']
+        self.assertIn('Analysis of home_en_dark_20250401-201208.png#region1', content)
+        self.assertIn('Analysis of the baseline', content)
+        self.assertEqual(len(result['regions']), 1)
+
+        # The baseline is kept unless asked to update it
+        with open(self.store.get('home_en_dark'), 'rb') as f, open(self.first, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_unchanged_screenshot_is_not_analyzed(self):
+        """Test that a screenshot identical to its baseline produces no jobs."""
+        self.store.save('home_en_dark', self.first, self.baseline_analysis)
+
+        planned, unchanged, sizes, results = self.run_batch(self.first)
+
+        self.assertEqual(planned, [])
+        self.assertEqual(unchanged, ['home_en_dark_20250331-201208.png'])
+        self.assertEqual(results['home_en_dark_20250331-201208.png'], {**self.baseline_analysis, 'regions': []})
+
+    def test_update_baseline(self):
+        """Test that update_baseline replaces the stored baseline."""
+        self.store.save('home_en_dark', self.first, self.baseline_analysis)
+        self.run_batch(self.second, update_baseline=True)
+
+        with open(self.store.get('home_en_dark'), 'rb') as f, open(self.second, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertIn('Analysis of home_en_dark_20250401-201208.png#region1',
+                      self.store.get_analysis('home_en_dark')['choices'][0]['message']['content'])
+
+    def test_updated_baseline_analysis_does_not_grow(self):
+        """Test that consecutive baseline updates from region runs do not nest the baseline's analysis."""
+        third = os.path.join(self.tmp_dir, 'home_en_dark_20250402-201208.png')
+        make_page(third, navbar=(120, 30, 30), footer_text=True)
+        self.store.save('home_en_dark', self.first, self.baseline_analysis)
+
+        self.run_batch(self.second, update_baseline=True)
+        self.run_batch(third, update_baseline=True)
+
+        content = self.store.get_analysis('home_en_dark')['choices'][0]['message']['content']
+        self.assertEqual(content.count(UNCHANGED_HEADING), 1)
+        self.assertTrue(content.endswith(UNCHANGED_HEADING + 'Analysis of the baseline'))
+        self.assertNotIn('home_en_dark_20250401-201208.png#region1', content)
+        self.assertIn('home_en_dark_20250402-201208.png#region1', content)
+
+    def test_failed_region_keeps_baseline(self):
+        """Test that the baseline is not replaced when one of the region requests failed."""
+        third = os.path.join(self.tmp_dir, 'home_en_dark_20250402-201208.png')
+        make_page(third, navbar=(120, 30, 30), footer_text=True)
+        self.store.save('home_en_dark', self.first, self.baseline_analysis)
+
+        planned, _, _, results = self.run_batch(
+            third, update_baseline=True, failed={'home_en_dark_20250402-201208.png#region1'}
+        )
+
+        self.assertEqual(len(planned), 2)
+        self.assertNotIn('error', results['home_en_dark_20250402-201208.png'])
+        with open(self.store.get('home_en_dark'), 'rb') as f, open(self.first, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(self.store.get_analysis('home_en_dark'), self.baseline_analysis)
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from PIL import Image
+
+from api.jobs import build_jobs, claim_job, enqueue_batch, run_job, save_job
+from api.models import AnalysisJob, AnalysisResult
+from api.openrouter_client import OpenRouterClient
+from api.rate_limit import TokenBucket
+from api.router import RouterClient
+
+
+class JobQueueTestCase(TestCase):
+    """Test cases for the batch analysis job queue."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshots = ['about_fr_dark_20250331-201239.png', 'home_en_dark_20250331-201208.png']
+        for screenshot in self.screenshots:
+            with open(os.path.join(self.tmp_dir, screenshot), 'w') as f:
+                f.write('test image content')
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_build_jobs(self):
+        """Test that prompts name the page, language and theme parsed from the file name."""
+        jobs = build_jobs(self.tmp_dir, ['vehicle_list_en_dark_20250331-201208.png', 'screenshot.png'])
+
+        self.assertEqual(jobs[0][1], os.path.join(self.tmp_dir, 'vehicle_list_en_dark_20250331-201208.png'))
+        self.assertIn('of the vehicle_list page in en language with dark theme', jobs[0][2])
+        self.assertIsNone(jobs[1][2])
+
+    def test_claim_order(self):
+        """Test that jobs are claimed oldest first, each by one worker."""
+        first = enqueue_batch(self.tmp_dir, self.screenshots[:1])
+        second = enqueue_batch(self.tmp_dir, self.screenshots[1:], {'language': 'en', 'theme': None})
+
+        claimed = claim_job('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.worker), (first.pk, 'running', 'worker-1'))
+        self.assertEqual(claim_job('worker-2').pk, second.pk)
+        self.assertIsNone(claim_job('worker-3'))
+        self.assertEqual(AnalysisJob.objects.get(pk=second.pk).filters, {'language': 'en'})
+
+    def test_claim_stale_job(self):
+        """Test that a running job without recent progress is claimed again."""
+        job = enqueue_batch(self.tmp_dir, self.screenshots)
+        claim_job('crashed-worker')
+        self.assertIsNone(claim_job('worker-2', stale_after=60))
+
+        AnalysisJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(minutes=5))
+        claimed = claim_job('worker-2', stale_after=60)
+        self.assertEqual((claimed.pk, claimed.worker, claimed.attempts), (job.pk, 'worker-2', 2))
+
+    def test_run_job_records_progress(self):
+        """Test that each result is saved as soon as it completes."""
+        enqueue_batch(self.tmp_dir, self.screenshots)
+        job = claim_job('worker')
+        progress = []
+
+        def analyze(path, prompt=None):
+            # Results of earlier screenshots are already visible to the status endpoint
+            progress.append(AnalysisJob.objects.get(pk=job.pk).completed)
+            return {'choices': [{'message': {'content': os.path.basename(path)}}]}
+
+        client = mock.Mock()
+        client.analyze_screenshot.side_effect = analyze
+        run_job(job, client, max_workers=1, prep_workers=0, save_interval=0)
+
+        job.refresh_from_db()
+        self.assertEqual(progress, [0, 1])
+        self.assertEqual(job.status, AnalysisJob.SUCCEEDED)
+        self.assertEqual(list(job.results), self.screenshots)
+        self.assertIsNotNone(job.finished_at)
+        # The results are added to the results store
+        self.assertEqual(
+            list(AnalysisResult.objects.filter(source=f"job:{job.id}").order_by('screenshot').values_list('content', flat=True)),
+            self.screenshots
+        )
+
+    def test_run_job_saves_progress_at_intervals(self):
+        """Test that progress is not saved again before the save interval has passed."""
+        enqueue_batch(self.tmp_dir, self.screenshots)
+        job = claim_job('worker')
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': [{'message': {'content': 'Analysis'}}]}
+
+        with mock.patch('api.jobs.save_job', wraps=save_job) as mock_save:
+            run_job(job, client, max_workers=1, prep_workers=0, save_interval=60)
+
+        # Only the final save
+        mock_save.assert_called_once()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.completed), (AnalysisJob.SUCCEEDED, 2))
+
+    def test_reclaimed_job_is_not_overwritten(self):
+        """Test that a worker whose job was claimed by another stops without saving over it."""
+        job = enqueue_batch(self.tmp_dir, self.screenshots)
+        stale = claim_job('stale-worker')
+        AnalysisJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(minutes=20))
+        claim_job('new-worker', stale_after=60)
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': [{'message': {'content': 'Stale'}}]}
+
+        run_job(stale, client, max_workers=1, prep_workers=0, save_interval=0)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.results), (AnalysisJob.RUNNING, 'new-worker', {}))
+        self.assertEqual(client.analyze_screenshot.call_count, 1)
+        self.assertFalse(AnalysisResult.objects.exists())
+
+    def test_run_job_stores_provider_model_and_latency(self):
+        """Test that the provider, model and latency tagged by the client reach the results store."""
+        enqueue_batch(self.tmp_dir, self.screenshots[:1])
+        job = claim_job('worker')
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {
+            'choices': [{'message': {'content': 'Analysis'}}], 'provider': 'gemini', 'model': 'gemini-pro', 'latency': 1.5
+        }
+        run_job(job, client, max_workers=1, prep_workers=0)
+
+        row = AnalysisResult.objects.get(source=f"job:{job.id}")
+        self.assertEqual((row.provider, row.model, row.latency), ('gemini', 'gemini-pro', 1.5))
+
+    def test_run_job_succeeds_when_storing_results_fails(self):
+        """Test that a job whose analyses succeeded is not failed by the results store."""
+        enqueue_batch(self.tmp_dir, self.screenshots)
+        job = claim_job('worker')
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': [{'message': {'content': 'Analysis'}}]}
+
+        with mock.patch('api.jobs.ingest_results', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('api.jobs', level='ERROR'):
+            run_job(job, client, max_workers=1, prep_workers=0)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.completed, job.error), (AnalysisJob.SUCCEEDED, 2, ''))
+
+    def test_worker_prepares_images_in_pool(self):
+        """Test that the worker's --prep-workers prepares images in a process pool through the router."""
+        for i, screenshot in enumerate(self.screenshots):
+            Image.new('RGB', (2400, 1200), (i * 80, 0, 0)).save(os.path.join(self.tmp_dir, screenshot))
+        job = enqueue_batch(self.tmp_dir, self.screenshots)
+        provider = OpenRouterClient(api_key='test_api_key', rate_limiter=TokenBucket(600, burst=10))
+        router = RouterClient([provider], hedge=False)
+        prefetched = []
+
+        def prefetch(image_path, prepared):
+            prefetched.append(id(prepared))
+            return OpenRouterClient.prefetch_image(provider, image_path, prepared)
+
+        def send(image, prompt):
+            self.assertIn(id(image), prefetched)
+            return {'choices': [{'message': {'content': 'Analysis'}}]}
+
+        with mock.patch('car_fleet_manager.management.commands.analysis_worker.get_client', return_value=router), \
+                mock.patch.object(provider, 'prefetch_image', side_effect=prefetch), \
+                mock.patch.object(provider, '_send_request', side_effect=send) as mock_send, \
+                mock.patch('api.dedup.deduplicate', side_effect=lambda jobs: (jobs, {})):
+            call_command('analysis_worker', '--once', '--prep-workers', '2', '--concurrency', '2', stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.SUCCEEDED)
+        self.assertEqual((mock_send.call_count, len(prefetched)), (2, 2))
+
+    def test_run_job_shares_duplicate_results(self):
+        """Test that near-identical screenshots count towards the progress with the shared result."""
+        enqueue_batch(self.tmp_dir, self.screenshots)
+        job = claim_job('worker')
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': [{'message': {'content': 'Shared'}}]}
+
+        with mock.patch('api.dedup.deduplicate', return_value=(
+            [(self.screenshots[0], os.path.join(self.tmp_dir, self.screenshots[0]), None)],
+            {self.screenshots[1]: self.screenshots[0]},
+        )):
+            run_job(job, client, max_workers=1, prep_workers=0)
+
+        job.refresh_from_db()
+        self.assertEqual((job.completed, job.duplicates_skipped), (2, 1))
+        self.assertEqual(job.results[self.screenshots[1]], job.results[self.screenshots[0]])
+        client.analyze_screenshot.assert_called_once()
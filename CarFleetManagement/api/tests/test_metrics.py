@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.base_client import BaseScreenshotClient
+from api.metrics import Histogram, MetricsRegistry, format_client_stats, format_summary
+from api.rate_limit import TokenBucket
+
+
+class InstrumentedClient(BaseScreenshotClient):
+    """Provider client that goes through every instrumented phase without a network call."""
+
+    provider = 'instrumented'
+    default_prompt = 'Default prompt'
+
+    def __init__(self):
+        super().__init__('instrumented-model', rate_limiter=TokenBucket(6000, burst=100))
+        self.metrics = MetricsRegistry()
+
+    def _send_request(self, image, prompt):
+        with self._timed('encode'):
+            self.metrics.observe(self.provider, 'payload_bytes', image.size)
+        with self._timed('upstream'):
+            pass
+        with self._timed('parse'):
+            return {
+                'choices': [{'message': {'content': f"{image.size} bytes"}}],
+                'usage': {'prompt_tokens': 1200, 'completion_tokens': 80, 'total_tokens': 1280},
+            }
+
+
+class HistogramTestCase(TestCase):
+    """Test cases for fixed-bucket histograms."""
+
+    def test_percentiles(self):
+        """Test that percentiles are estimated from bucket bounds and capped at the maximum."""
+        histogram = Histogram((1, 2, 5, 10))
+        for value in (0.5, 1.5, 1.5, 4, 7):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.percentile(50), 2)
+        self.assertEqual(histogram.percentile(95), 7)
+        self.assertIsNone(Histogram((1,)).percentile(50))
+
+    def test_as_dict(self):
+        """Test the count, mean and cumulative buckets."""
+        histogram = Histogram((1, 2))
+        for value in (0.5, 1.0, 3.0):
+            histogram.observe(value)
+
+        data = histogram.as_dict()
+        self.assertEqual(data['count'], 3)
+        self.assertAlmostEqual(data['mean'], 1.5)
+        self.assertEqual(data['max'], 3.0)
+        self.assertEqual(data['buckets'], [[1, 2], [2, 2], ['+Inf', 3]])
+
+
+class ClientMetricsTestCase(TestCase):
+    """Test cases for the instrumentation of the clients."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshot = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(self.screenshot)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_records_every_phase(self):
+        """Test that timings, payload size and token usage are recorded per request."""
+        client = InstrumentedClient()
+        client.analyze_screenshot(self.screenshot)
+        client.analyze_screenshot(self.screenshot, prompt='Another prompt')
+
+        metrics = client.metrics.snapshot()['instrumented']
+        for name in ('prep_seconds', 'encode_seconds', 'rate_limit_wait_seconds', 'upstream_seconds',
+                     'parse_seconds', 'payload_bytes', 'prompt_tokens', 'completion_tokens'):
+            self.assertEqual(metrics[name]['count'], 2, name)
+        self.assertEqual(metrics['prompt_tokens']['sum'], 2400)
+        self.assertEqual(metrics['payload_bytes']['max'], metrics['payload_bytes']['sum'] / 2)
+
+    def test_summary(self):
+        """Test the human-readable summary printed by the batch commands."""
+        client = InstrumentedClient()
+        client.analyze_screenshot(self.screenshot)
+
+        summary = format_summary(client.metrics.snapshot())
+        self.assertTrue(summary[0].startswith('instrumented prep: n=1, mean '))
+        self.assertIn('instrumented prompt_tokens: n=1, mean 1200, p50 1200, p95 1200, max 1200', summary)
+
+    def test_client_stats(self):
+        """Test the client counters and metrics printed after a batch."""
+        client = InstrumentedClient()
+        client.analyze_screenshot(self.screenshot)
+
+        with mock.patch('api.metrics.get_metrics', return_value=client.metrics):
+            lines = format_client_stats(client)
+        self.assertTrue(lines[0].startswith('Image payload: '))
+        self.assertEqual(lines[1], 'Request metrics:')
+        self.assertTrue(lines[2].startswith('  instrumented prep: n=1, mean '))
+
+
+class AIMetricsViewTestCase(TestCase):
+    """Test cases for the metrics endpoint."""
+
+    def test_get(self):
+        """Test that the process-wide histograms are returned."""
+        registry = MetricsRegistry()
+        registry.observe('openrouter', 'upstream_seconds', 1.2)
+
+        with mock.patch('api.views.get_metrics', return_value=registry):
+            response = APIClient().get(reverse('ai_metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['openrouter']['upstream_seconds']['count'], 1)
+        self.assertEqual(response.data['openrouter']['upstream_seconds']['p95'], 1.2)
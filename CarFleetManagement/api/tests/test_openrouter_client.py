@@ -1,11 +1,15 @@
+import asyncio
 import os
 import json
 from unittest import mock
 from django.test import TestCase
 from django.conf import settings
 from pathlib import Path
+from PIL import Image
 
-from api.openrouter_client import OpenRouterClient, get_client
+from api.openrouter_client import (
+    OpenRouterClient, TimeoutSession, build_session, get_async_session, get_client, parse_sse_deltas
+)
 
 
 class OpenRouterClientTestCase(TestCase):
@@ -22,8 +26,7 @@ class OpenRouterClientTestCase(TestCase):
         
         # Create a test screenshot file
         self.test_screenshot = os.path.join(self.test_dir, 'home_en_dark_20250331-201208.png')
-        with open(self.test_screenshot, 'w') as f:
-            f.write('test image content')
+        Image.new('RGB', (100, 100), 'white').save(self.test_screenshot)
     
     def tearDown(self):
         """Clean up test environment."""
@@ -56,7 +59,7 @@ class OpenRouterClientTestCase(TestCase):
         with self.assertRaises(FileNotFoundError):
             self.client.analyze_screenshot('nonexistent_file.png')
     
-    @mock.patch('requests.post')
+    @mock.patch('api.openrouter_client.requests.Session.post')
     def test_analyze_screenshot_success(self, mock_post):
         """Test analyze_screenshot with successful API response."""
         # Mock the API response
@@ -76,8 +79,10 @@ class OpenRouterClientTestCase(TestCase):
         # Call the method
         result = self.client.analyze_screenshot(self.test_screenshot)
         
-        # Verify the result
+        # Verify the result, tagged with the provider, model and latency of the request
         self.assertEqual(result, mock_response.json.return_value)
+        self.assertEqual((result['provider'], result['model']), ('openrouter', self.client.model))
+        self.assertGreaterEqual(result['latency'], 0)
         
         # Verify the API call
         mock_post.assert_called_once()
@@ -85,7 +90,7 @@ class OpenRouterClientTestCase(TestCase):
         self.assertIn('openrouter.ai/api/v1/chat/completions', args[0])
         self.assertEqual(kwargs['headers']['Authorization'], f'Bearer {self.api_key}')
     
-    @mock.patch('requests.post')
+    @mock.patch('api.openrouter_client.requests.Session.post')
     def test_analyze_screenshot_with_custom_prompt(self, mock_post):
         """Test analyze_screenshot with custom prompt."""
         # Mock the API response
@@ -101,9 +106,10 @@ class OpenRouterClientTestCase(TestCase):
         # Verify the prompt was used
         args, kwargs = mock_post.call_args
         # Check that the custom prompt is in the text field of the first content item
-        self.assertEqual(custom_prompt, kwargs['json']['messages'][0]['content'][0]['text'])
+        payload = json.loads(kwargs['data'].getvalue())
+        self.assertEqual(custom_prompt, payload['messages'][0]['content'][0]['text'])
     
-    @mock.patch('requests.post')
+    @mock.patch('api.openrouter_client.requests.Session.post')
     def test_analyze_screenshot_api_error(self, mock_post):
         """Test analyze_screenshot with API error."""
         # Mock the API error
@@ -172,9 +178,136 @@ class OpenRouterClientTestCase(TestCase):
         os.remove(test_screenshot2)
         os.remove(test_screenshot3)
     
+    @mock.patch('api.openrouter_client._client', None)
     def test_get_client(self):
         """Test get_client function."""
         with mock.patch('api.openrouter_client.OpenRouterClient') as mock_client:
             client = get_client()
             mock_client.assert_called_once()
-            self.assertEqual(client, mock_client.return_value)
\ No newline at end of file
+            self.assertEqual(client, mock_client.return_value)
+    
+    @mock.patch('api.openrouter_client._client', None)
+    def test_get_client_is_reused(self):
+        """Test that get_client returns the same process-wide client."""
+        with mock.patch('api.openrouter_client.OpenRouterClient') as mock_client:
+            self.assertIs(get_client(), get_client())
+            mock_client.assert_called_once()
+    
+    def test_session_is_shared(self):
+        """Test that clients share the pooled session by default."""
+        other = OpenRouterClient(api_key=self.api_key)
+        self.assertIs(self.client.session, other.session)
+    
+    @mock.patch('api.openrouter_client.requests.Session.post')
+    def test_analyze_screenshot_uses_session(self, mock_post):
+        """Test that requests go through the client's session."""
+        session = mock.Mock()
+        session.post.return_value.json.return_value = {'choices': []}
+        client = OpenRouterClient(api_key=self.api_key, session=session)
+        
+        client.analyze_screenshot(self.test_screenshot)
+        
+        session.post.assert_called_once()
+        mock_post.assert_not_called()
+    
+    def test_build_session_sets_timeouts_and_pool(self):
+        """Test that the session has a connection pool and default timeouts."""
+        with self.settings(OPENROUTER_POOL_SIZE=7, OPENROUTER_CONNECT_TIMEOUT=3,
+                           OPENROUTER_READ_TIMEOUT=30, OPENROUTER_HTTP2=False):
+            session = build_session()
+        
+        self.assertIsInstance(session, TimeoutSession)
+        self.assertEqual(session.timeout, (3, 30))
+        self.assertEqual(session.get_adapter('https://openrouter.ai')._pool_maxsize, 7)
+        
+        with mock.patch('requests.Session.request') as mock_request:
+            session.post('https://openrouter.ai/api/v1/chat/completions')
+            self.assertEqual(mock_request.call_args.kwargs['timeout'], (3, 30))
+    
+    @mock.patch('api.openrouter_client.requests.Session.post')
+    def test_analyze_screenshot_stream(self, mock_post):
+        """Test that the answer is relayed chunk by chunk and assembled into the usual result."""
+        mock_response = mock.Mock()
+        mock_response.iter_lines.return_value = [
+            ': OPENROUTER PROCESSING',
+            '',
+            'data: {"choices": [{"delta": {"role": "assistant", "content": "Layout "}}]}',
+            '',
+            'data: {"choices": [{"delta": {"content": "looks fine"}}]}',
+            '',
+            'data: [DONE]',
+        ]
+        mock_post.return_value = mock_response
+        
+        events = list(self.client.analyze_screenshot_stream(self.test_screenshot))
+        
+        self.assertEqual(events[:2], [('delta', 'Layout '), ('delta', 'looks fine')])
+        self.assertEqual(events[2][0], 'result')
+        self.assertEqual(events[2][1]['choices'][0]['message']['content'], 'Layout looks fine')
+        self.assertTrue(json.loads(mock_post.call_args.kwargs['data'].getvalue())['stream'])
+        self.assertTrue(mock_post.call_args.kwargs['stream'])
+        mock_response.close.assert_called_once()
+    
+    @mock.patch('api.openrouter_client.requests.Session.post')
+    def test_analyze_screenshot_stream_error(self, mock_post):
+        """Test that an upstream error ends the stream with an error result."""
+        mock_post.return_value.raise_for_status.side_effect = Exception('API error')
+        
+        events = list(self.client.analyze_screenshot_stream(self.test_screenshot))
+        
+        self.assertEqual(events, [('result', {'error': 'API error'})])
+    
+    def test_analyze_screenshot_async(self):
+        """Test that coroutines send the streamed body over the async session."""
+        import httpx
+        
+        requests = []
+        
+        async def handler(request):
+            requests.append((request.headers, await request.aread()))
+            return httpx.Response(200, json={'choices': [{'message': {'content': 'Async result'}}]})
+        
+        async def analyze():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as session:
+                client = OpenRouterClient(api_key=self.api_key, async_session=session)
+                return await client.analyze_screenshot_async(self.test_screenshot, prompt='Async prompt')
+        
+        result = asyncio.run(analyze())
+        
+        self.assertEqual(result['choices'][0]['message']['content'], 'Async result')
+        headers, body = requests[0]
+        self.assertEqual(int(headers['Content-Length']), len(body))
+        self.assertNotIn('Transfer-Encoding', headers)
+        self.assertEqual(json.loads(body)['messages'][0]['content'][0]['text'], 'Async prompt')
+    
+    def test_analyze_screenshot_async_error(self):
+        """Test that HTTP errors of async requests are returned with their status."""
+        import httpx
+        
+        async def analyze():
+            transport = httpx.MockTransport(lambda request: httpx.Response(400, json={'error': 'Bad request'}))
+            async with httpx.AsyncClient(transport=transport) as session:
+                client = OpenRouterClient(api_key=self.api_key, async_session=session)
+                return await client.analyze_screenshot_async(self.test_screenshot)
+        
+        self.assertEqual(asyncio.run(analyze())['status'], 400)
+    
+    def test_async_session_is_closed_with_its_loop(self):
+        """Test that each event loop gets one async session, closed when the loop shuts down."""
+        async def get_sessions():
+            session = get_async_session()
+            self.assertIs(get_async_session(), session)
+            self.assertFalse(session.is_closed)
+            return session
+        
+        first = asyncio.run(get_sessions())
+        second = asyncio.run(get_sessions())
+        
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self.assertTrue(second.is_closed)
+    
+    def test_parse_sse_deltas_error_event(self):
+        """Test that an error reported mid-stream is raised."""
+        with self.assertRaises(RuntimeError):
+            list(parse_sse_deltas([b'data: {"error": {"message": "Overloaded"}}']))
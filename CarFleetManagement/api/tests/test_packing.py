@@ -0,0 +1,135 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+
+from api.base_client import analyze_groups
+from api.openrouter_client import OpenRouterClient
+from api.packing import group_jobs, split_packed_answer
+from api.rate_limit import TokenBucket
+
+
+def packed_response(analyses):
+    """Build a chat completion whose content is a packed per-image answer."""
+    content = json.dumps({'images': [{'image': i, 'analysis': a} for i, a in enumerate(analyses, 1)]})
+    response = mock.Mock()
+    response.json.return_value = {'choices': [{'message': {'content': f"```json\n{content}\n```"}}]}
+    return response
+
+
+class GroupJobsTestCase(TestCase):
+    """Test cases for grouping screenshots into multi-image requests."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.jobs = [
+            (f"home_{lang}_{theme}_20250331-201208.png", f"/tmp/home_{lang}_{theme}.png", 'Prompt')
+            for lang in ('en', 'de') for theme in ('light', 'dark')
+        ] + [('screenshot.png', '/tmp/screenshot.png', 'Own prompt')]
+
+    def test_pack_by_theme(self):
+        """Test that light and dark of each page and language are packed together."""
+        groups = group_jobs(self.jobs, by='theme')
+
+        self.assertEqual(
+            [[key for key, _, _ in screenshots] for screenshots, _ in groups],
+            [
+                ['home_en_light_20250331-201208.png', 'home_en_dark_20250331-201208.png'],
+                ['home_de_light_20250331-201208.png', 'home_de_dark_20250331-201208.png'],
+                ['screenshot.png'],
+            ]
+        )
+        self.assertIn('home page', groups[0][1])
+        self.assertEqual(groups[0][0][0][2], 'home page, en language, light theme')
+        self.assertEqual(groups[2][1], 'Own prompt')
+
+    def test_pack_by_language_with_limit(self):
+        """Test that all languages of a page and theme are packed, up to max_images."""
+        groups = group_jobs(self.jobs, by='language', max_images=1)
+        self.assertEqual(len(groups), 5)
+        groups = group_jobs(self.jobs, by='language')
+        self.assertEqual(len(groups[0][0]), 2)
+
+    def test_page_names_with_underscores(self):
+        """Test that page names containing underscores are grouped and labelled whole."""
+        jobs = [
+            (f"vehicle_list_en_{theme}_20250331-201208.png", f"/tmp/vehicle_list_en_{theme}.png", 'Prompt')
+            for theme in ('light', 'dark')
+        ]
+        groups = group_jobs(jobs, by='theme')
+
+        self.assertEqual(len(groups), 1)
+        self.assertIn('vehicle_list page', groups[0][1])
+        self.assertEqual(groups[0][0][1][2], 'vehicle_list page, en language, dark theme')
+
+
+class SplitPackedAnswerTestCase(TestCase):
+    """Test cases for splitting a packed answer."""
+
+    def test_split(self):
+        """Test that entries are matched to images by number."""
+        content = '{"images": [{"image": 2, "analysis": "B"}, {"image": 1, "analysis": "A"}]}'
+        self.assertEqual(split_packed_answer(content, 2), ['A', 'B'])
+
+    def test_incomplete_answer(self):
+        """Test that an answer missing an image or not in JSON cannot be split."""
+        self.assertIsNone(split_packed_answer('{"images": [{"image": 1, "analysis": "A"}]}', 2))
+        self.assertIsNone(split_packed_answer('Both screenshots look fine.', 2))
+
+
+class AnalyzeGroupsTestCase(TestCase):
+    """Test cases for analyzing packed groups with a client."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jobs = []
+        for theme, color in (('light', 'white'), ('dark', 'black')):
+            name = f"home_en_{theme}_20250331-201208.png"
+            path = os.path.join(self.tmp_dir, name)
+            Image.new('RGB', (64, 32), color).save(path)
+            self.jobs.append((name, path, None))
+
+        self.session = mock.Mock()
+        self.client = OpenRouterClient(
+            api_key='test_api_key', session=self.session, rate_limiter=TokenBucket(600, burst=10)
+        )
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_group_is_sent_in_one_request(self):
+        """Test that a group costs one request and is split into per-screenshot results."""
+        self.session.post.return_value = packed_response(['Light is fine', 'Dark has low contrast'])
+        seen = []
+
+        results = analyze_groups(
+            self.client, group_jobs(self.jobs, by='theme'), on_result=lambda key, result: seen.append(key)
+        )
+
+        self.session.post.assert_called_once()
+        content = json.loads(self.session.post.call_args.kwargs['content'].getvalue())['messages'][0]['content']
+        self.assertEqual([part['type'] for part in content], ['text', 'text', 'image', 'text', 'image'])
+        self.assertEqual(
+            results['home_en_dark_20250331-201208.png']['choices'][0]['message']['content'],
+            'Dark has low contrast'
+        )
+        self.assertCountEqual(seen, [key for key, _, _ in self.jobs])
+
+    def test_unsplittable_answer_falls_back_to_single_requests(self):
+        """Test that screenshots are analyzed one by one if the answer cannot be split."""
+        unsplittable = mock.Mock()
+        unsplittable.json.return_value = {'choices': [{'message': {'content': 'Looks fine'}}]}
+        single = mock.Mock()
+        single.json.return_value = {'choices': [{'message': {'content': 'Single'}}]}
+        self.session.post.side_effect = [unsplittable, single, single]
+
+        results = self.client.analyze_screenshot_group([('light', self.jobs[0][1]), ('dark', self.jobs[1][1])])
+
+        self.assertEqual(self.session.post.call_count, 3)
+        self.assertEqual([r['choices'][0]['message']['content'] for r in results], ['Single', 'Single'])
@@ -0,0 +1,96 @@
+import base64
+import json
+import os
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase
+
+from api.payload import Base64Image, JsonBody, base64_length, iter_base64
+
+IMAGE_SIZE = 5 * 1024 * 1024
+
+
+def openrouter_payload(image):
+    """Build a request payload around one image, as the OpenRouter client does."""
+    return {'model': 'm', 'messages': [{'role': 'user', 'content': [
+        {'type': 'text', 'text': 'Analyze'},
+        {'type': 'image_url', 'image_url': {'url': image}},
+    ]}]}
+
+
+def send_eager(data):
+    """Serialize the body up front, as ``json=payload`` did before bodies were streamed."""
+    image = base64.b64encode(data).decode('utf-8')
+    return len(json.dumps(openrouter_payload(f"data:image/png;base64,{image}")).encode('utf-8'))
+
+
+def send_streamed(data):
+    """Send a streamed body chunk by chunk."""
+    return sum(len(chunk) for chunk in JsonBody(openrouter_payload(Base64Image(data, 'data:image/png;base64,'))))
+
+
+class PayloadTestCase(SimpleTestCase):
+    """Test cases for streamed request bodies."""
+
+    def test_iter_base64(self):
+        """Test that chunked encoding matches encoding the whole input."""
+        data = bytes(range(256)) * 40 + b'x'
+        self.assertEqual(b''.join(iter_base64(data, chunk_size=300)), base64.b64encode(data))
+        self.assertEqual(base64_length(len(data)), len(base64.b64encode(data)))
+        with self.assertRaises(ValueError):
+            list(iter_base64(data, chunk_size=100))
+
+    def test_json_body(self):
+        """Test that the streamed body equals the eagerly serialized payload."""
+        image = b'\x89PNG' + bytes(range(256)) * 2000
+        body = JsonBody({
+            'prompt': 'Check the "navbar" – ünïcode',
+            'images': [Base64Image(image, 'data:image/png;base64,'), Base64Image(b'gif', 'data:image/gif;base64,')],
+        })
+
+        expected = json.dumps({
+            'prompt': 'Check the "navbar" – ünïcode',
+            'images': [
+                'data:image/png;base64,' + base64.b64encode(image).decode('ascii'),
+                'data:image/gif;base64,' + base64.b64encode(b'gif').decode('ascii'),
+            ],
+        }).encode('utf-8')
+        self.assertEqual(body.getvalue(), expected)
+        self.assertEqual(len(body), len(expected))
+        # Bodies can be sent again, e.g. by a retry
+        self.assertEqual(body.getvalue(), expected)
+
+    def test_unserializable_values(self):
+        """Test that values other than Base64Image are still rejected."""
+        with self.assertRaises(TypeError):
+            JsonBody({'value': object()})
+
+
+class PayloadMemoryBenchmarkTestCase(SimpleTestCase):
+    """Peak memory of sending a batch of 5 MB screenshots, before and after streaming the body."""
+
+    def peak_allocated(self, send, images):
+        """Send the images from 4 threads and return the bytes sent and the peak traced allocation."""
+        tracemalloc.start()
+        try:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                sent = sum(pool.map(send, images))
+            return sent, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_streamed_body_lowers_peak_memory(self):
+        """Test that streaming the body cuts the peak memory of a concurrent batch."""
+        images = [os.urandom(IMAGE_SIZE) for _ in range(8)]
+
+        eager_sent, eager_peak = self.peak_allocated(send_eager, images)
+        streamed_sent, streamed_peak = self.peak_allocated(send_streamed, images)
+
+        self.assertEqual(streamed_sent, eager_sent)
+        # Eagerly, each request holds ~4x the image (base64 bytes, str, JSON str, body bytes)
+        self.assertGreater(eager_peak, 2 * IMAGE_SIZE)
+        self.assertLess(
+            streamed_peak, eager_peak / 10,
+            f"Peak allocation: {eager_peak // 1024} KB with json=payload, {streamed_peak // 1024} KB streamed"
+        )
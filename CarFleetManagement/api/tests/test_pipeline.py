@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+
+from api import base_client
+from api.base_client import analyze_many, iter_analyses
+from api.openrouter_client import OpenRouterClient
+from api.rate_limit import TokenBucket
+from api.router import RouterClient
+
+
+class PipelinedBatchTestCase(TestCase):
+    """Test cases for preparing images in a process pool during batch analysis."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jobs = []
+        for i, lang in enumerate(['en', 'de', 'fr', 'pl']):
+            name = f"home_{lang}_dark_20250331-20120{i}.png"
+            path = os.path.join(self.tmp_dir, name)
+            Image.new('RGB', (2400, 1200), (i * 40, 0, 0)).save(path)
+            self.jobs.append((name, path, None))
+
+        self.client = OpenRouterClient(api_key='test_api_key', rate_limiter=TokenBucket(600, burst=10))
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_images_are_prepared_in_pool(self):
+        """Test that every image is prepared ahead of time and handed to the network stage."""
+        sent = []
+
+        def send(image, prompt):
+            sent.append((image.width, image.height))
+            return {'choices': [{'message': {'content': 'Analysis result'}}]}
+
+        with mock.patch.object(self.client, '_send_request', side_effect=send), \
+                mock.patch.object(self.client, 'prefetch_image', wraps=self.client.prefetch_image) as prefetch:
+            results = analyze_many(self.client, self.jobs, max_workers=2, prep_workers=2)
+
+        self.assertEqual(list(results), [key for key, _, _ in self.jobs])
+        self.assertEqual(prefetch.call_count, len(self.jobs))
+        self.assertEqual(sent, [(1920, 960)] * len(self.jobs))
+        self.assertEqual(self.client.payload_stats()['images'], len(self.jobs))
+        self.assertEqual(self.client._prefetched, {})
+
+    def test_router_images_are_prepared_in_pool(self):
+        """Test that batches run through the router are pipelined and reach the provider prepared."""
+        router = RouterClient([self.client], hedge=False)
+        prefetched = []
+        sent = []
+
+        def prefetch(image_path, prepared):
+            prefetched.append(id(prepared))
+            return OpenRouterClient.prefetch_image(self.client, image_path, prepared)
+
+        def send(image, prompt):
+            sent.append(id(image))
+            return {'choices': [{'message': {'content': 'Analysis result'}}]}
+
+        with mock.patch.object(self.client, '_send_request', side_effect=send), \
+                mock.patch.object(self.client, 'prefetch_image', side_effect=prefetch), \
+                mock.patch('api.base_client._analyze_pipelined', wraps=base_client._analyze_pipelined) as pipelined:
+            results = analyze_many(router, self.jobs, max_workers=2, prep_workers=2)
+
+        self.assertEqual(list(results), [key for key, _, _ in self.jobs])
+        pipelined.assert_called_once()
+        # Every request sent the image prepared in the pool
+        self.assertEqual(sorted(sent), sorted(prefetched))
+        self.assertEqual(len(sent), len(self.jobs))
+        self.assertEqual(router._prefetched, {})
+
+    def test_preparation_errors_surface_from_analyze(self):
+        """Test that an image that fails to prepare in the pool raises like the sequential path."""
+        with open(self.jobs[0][1], 'w') as f:
+            f.write('test image content')
+
+        with mock.patch.object(self.client, '_send_request', return_value={'choices': []}):
+            with self.assertRaises(Exception):
+                analyze_many(self.client, self.jobs, max_workers=2, prep_workers=2)
+        self.assertEqual(self.client._prefetched, {})
+
+
+class IterAnalysesTestCase(TestCase):
+    """Test cases for yielding batch results as they complete."""
+
+    def test_results_in_completion_order(self):
+        """Test that each result is yielded as soon as its request returns."""
+        fast_yielded = threading.Event()
+
+        def analyze(path, prompt=None):
+            if path == 'slow.png':
+                # Only returns once the fast result has reached the caller
+                fast_yielded.wait(5)
+            return {'choices': [{'message': {'content': path}}]}
+
+        client = mock.Mock()
+        client.analyze_screenshot.side_effect = analyze
+        jobs = [('slow', 'slow.png', None), ('fast', 'fast.png', None)]
+
+        results = iter_analyses(client, jobs, max_workers=2)
+        first = next(results)[0]
+        fast_yielded.set()
+        self.assertEqual([first] + [key for key, _ in results], ['fast', 'slow'])
+
+    def test_jobs_are_submitted_as_workers_free_up(self):
+        """Test that the batch is not queued up front, so memory stays bounded."""
+        pulled = []
+
+        def jobs():
+            for i in range(10):
+                pulled.append(i)
+                yield (i, f"{i}.png", 'Prompt')
+
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': []}
+        results = iter_analyses(client, jobs(), max_workers=2)
+
+        next(results)
+        self.assertLessEqual(len(pulled), 3)
+        self.assertEqual(len(list(results)), 9)
+        client.analyze_screenshot.assert_called_with('9.png', prompt='Prompt')
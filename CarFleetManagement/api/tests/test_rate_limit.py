@@ -0,0 +1,238 @@
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from unittest import mock
+
+from django.test import TestCase
+
+from api.base_client import analyze_many
+from api.rate_limit import BATCH, INTERACTIVE, SharedTokenBucket, TokenBucket, rate_limit_priority
+
+
+class TokenBucketTestCase(TestCase):
+    """Test cases for the TokenBucket rate limiter."""
+
+    def test_burst_is_not_throttled(self):
+        """Test that up to `burst` requests go through without waiting."""
+        bucket = TokenBucket(requests_per_minute=10, burst=3)
+        self.assertEqual([bucket.reserve() for _ in range(3)], [0.0, 0.0, 0.0])
+
+    def test_sustained_rate_is_enforced(self):
+        """Test that requests beyond the burst are spaced at the configured rate."""
+        bucket = TokenBucket(requests_per_minute=10, burst=1)
+        with mock.patch('api.rate_limit.time.monotonic', return_value=bucket._updated_at):
+            waits = [bucket.reserve() for _ in range(3)]
+        self.assertEqual(waits[0], 0.0)
+        self.assertAlmostEqual(waits[1], 6.0)
+        self.assertAlmostEqual(waits[2], 12.0)
+
+    def test_tokens_refill_over_time(self):
+        """Test that the bucket refills up to its capacity."""
+        bucket = TokenBucket(requests_per_minute=60, burst=2)
+        start = bucket._updated_at
+        with mock.patch('api.rate_limit.time.monotonic', return_value=start):
+            bucket.reserve()
+            bucket.reserve()
+        with mock.patch('api.rate_limit.time.monotonic', return_value=start + 100):
+            self.assertEqual(bucket.reserve(), 0.0)
+            self.assertEqual(bucket.reserve(), 0.0)
+            self.assertAlmostEqual(bucket.reserve(), 1.0)
+
+
+class AnalyzeManyTestCase(TestCase):
+    """Test cases for concurrent batch analysis."""
+
+    def test_requests_overlap(self):
+        """Test that upstream latency is overlapped across workers."""
+        client = mock.Mock()
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def analyze(path, prompt=None):
+            with lock:
+                in_flight.append(path)
+                peak.append(len(in_flight))
+            time.sleep(0.1)
+            with lock:
+                in_flight.remove(path)
+            return {'choices': [{'message': {'content': path}}]}
+
+        client.analyze_screenshot.side_effect = analyze
+        jobs = [(f"shot{i}.png", f"/tmp/shot{i}.png", None) for i in range(8)]
+
+        start = time.monotonic()
+        results = analyze_many(client, jobs, max_workers=4)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(max(peak), 4)
+        self.assertEqual(list(results), [key for key, _, _ in jobs])
+
+    def test_prompt_and_callback(self):
+        """Test that prompts are forwarded and on_result sees every result."""
+        client = mock.Mock()
+        client.analyze_screenshot.return_value = {'choices': []}
+        seen = []
+
+        analyze_many(
+            client,
+            [('a.png', '/tmp/a.png', 'Prompt'), ('b.png', '/tmp/b.png', None)],
+            max_workers=2,
+            on_result=lambda key, result: seen.append(key),
+        )
+
+        client.analyze_screenshot.assert_any_call('/tmp/a.png', prompt='Prompt')
+        client.analyze_screenshot.assert_any_call('/tmp/b.png')
+        self.assertCountEqual(seen, ['a.png', 'b.png'])
+
+    def test_errors_propagate(self):
+        """Test that an exception from the client is raised to the caller."""
+        client = mock.Mock()
+        client.analyze_screenshot.side_effect = Exception('Test error')
+
+        with self.assertRaises(Exception):
+            analyze_many(client, [('a.png', '/tmp/a.png', None), ('b.png', '/tmp/b.png', None)], max_workers=2)
+
+
+class SharedTokenBucketTestCase(TestCase):
+    """Test cases for the cross-process SharedTokenBucket."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'rate_limits.sqlite3')
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_instances_share_budget(self):
+        """Test that separate instances (as in separate processes) draw from one bucket."""
+        first = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=600, burst=2)
+        second = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=600, burst=2)
+
+        self.assertLess(first.acquire(), 0.05)
+        self.assertLess(second.acquire(), 0.05)
+        self.assertGreater(second.acquire(), 0.05)
+
+    def test_acquire_async(self):
+        """Test that coroutines wait for the shared budget concurrently, without a thread each."""
+        bucket = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=600, burst=2)
+
+        async def acquire_all():
+            return await asyncio.gather(*(bucket.acquire_async() for _ in range(4)))
+
+        started = time.monotonic()
+        waits = asyncio.run(acquire_all())
+
+        # Two tokens in the burst, then one every 0.1 s
+        self.assertLess(min(waits), 0.05)
+        self.assertGreater(time.monotonic() - started, 0.15)
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM waiters").fetchone()[0], 0)
+
+    def test_cancelled_acquire_async_leaves_queue(self):
+        """Test that a cancelled coroutine removes its waiter once its worker thread is done."""
+        bucket = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=6, burst=1)
+        bucket.acquire()
+
+        async def cancel_waiting(delay):
+            waiting = asyncio.ensure_future(bucket.acquire_async())
+            await asyncio.sleep(delay)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        # While the waiter is being inserted, then while it waits for a token
+        for delay in (0, 0.3):
+            asyncio.run(cancel_waiting(delay))
+
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM waiters").fetchone()[0], 0)
+
+    def test_buckets_are_per_provider(self):
+        """Test that providers do not share a quota."""
+        openrouter = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=6, burst=1)
+        gemini = SharedTokenBucket(self.db_path, 'gemini', requests_per_minute=6, burst=1)
+
+        self.assertLess(openrouter.acquire(), 0.05)
+        self.assertLess(gemini.acquire(), 0.05)
+
+    def test_interactive_requests_jump_batch_queue(self):
+        """Test that an interactive waiter is served before an earlier batch waiter."""
+        bucket = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=120, burst=1)
+        bucket.poll_interval = 0.02
+        bucket.acquire()
+        order = []
+
+        def batch_request():
+            with rate_limit_priority(BATCH):
+                bucket.acquire()
+            order.append('batch')
+
+        def interactive_request():
+            bucket.acquire()
+            order.append('interactive')
+
+        batch = threading.Thread(target=batch_request)
+        batch.start()
+        time.sleep(0.1)
+        interactive = threading.Thread(target=interactive_request)
+        interactive.start()
+        batch.join()
+        interactive.join()
+
+        self.assertEqual(order, ['interactive', 'batch'])
+
+    def test_only_head_waiter_takes_write_lock(self):
+        """Test that a waiter behind the head polls with reads and only writes its heartbeat now and then."""
+        bucket = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=120, burst=1)
+        bucket.poll_interval = 0.02
+        bucket.heartbeat_interval = 0.2
+        bucket.acquire()
+        statements = {}
+        acquired = {}
+        connect = bucket._connect
+
+        def traced_connect(*args, **kwargs):
+            conn = connect(*args, **kwargs)
+            name = threading.current_thread().name
+            conn.set_trace_callback(lambda sql: statements.setdefault(name, []).append((time.time(), sql)))
+            return conn
+
+        def request(name):
+            bucket.acquire()
+            acquired[name] = time.time()
+
+        with mock.patch.object(bucket, '_connect', side_effect=traced_connect):
+            head = threading.Thread(target=request, args=('head',), name='head')
+            head.start()
+            time.sleep(0.05)
+            behind = threading.Thread(target=request, args=('behind',), name='behind')
+            behind.start()
+            head.join()
+            behind.join()
+
+        # While the other waiter was first in line
+        waiting = [sql for at, sql in statements['behind'] if at < acquired['head']]
+        self.assertGreater(sum(sql.startswith('SELECT id, heartbeat') for sql in waiting), 5)
+        self.assertFalse([sql for sql in waiting if sql.startswith('BEGIN')])
+        self.assertLessEqual(sum(sql.startswith('UPDATE waiters') for sql in waiting), 3)
+
+    def test_stale_waiters_are_dropped(self):
+        """Test that a waiter left behind by a crashed process does not block the queue."""
+        bucket = SharedTokenBucket(self.db_path, 'openrouter', requests_per_minute=600, burst=1)
+        with closing(sqlite3.connect(self.db_path)) as conn:
+            conn.execute(
+                "INSERT INTO waiters (name, priority, heartbeat) VALUES (?, ?, ?)",
+                ('openrouter', INTERACTIVE, time.time() - 60),
+            )
+            conn.commit()
+
+        self.assertLess(bucket.acquire(), 0.05)
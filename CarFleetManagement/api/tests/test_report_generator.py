@@ -135,6 +135,25 @@ class ScreenshotAnalysisReportTestCase(TestCase):
             self.assertIn('Analysis for about page in French with dark theme', content)
             self.assertIn('Error: API error', content)
     
+    def test_iter_html_from_memory(self):
+        """Test rendering in-memory analysis data in chunks."""
+        report = ScreenshotAnalysisReport(analysis_data=self.test_analysis)
+        chunks = list(report.iter_html())
+        
+        # Document head, one chunk per page, closing tags
+        self.assertEqual(len(chunks), 5)
+        self.assertIn('<title>Screenshot Analysis Report</title>', chunks[0])
+        self.assertIn('<h2>Page: home</h2>', chunks[1])
+        self.assertEqual(chunks[-1], '</body></html>')
+        self.assertIn('Error: API error', ''.join(chunks))
+    
+    def test_init_invalid_data(self):
+        """Test initialization without analysis data or with data that is not a dict."""
+        with self.assertRaises(ValueError):
+            ScreenshotAnalysisReport()
+        with self.assertRaises(ValueError):
+            ScreenshotAnalysisReport(analysis_data=['home_en_dark.png'])
+    
     def test_generate_report_function(self):
         """Test the generate_report function."""
         with mock.patch('api.report_generator.ScreenshotAnalysisReport') as mock_report:
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+
+from api.base_client import BaseScreenshotClient, error_result
+from api.rate_limit import TokenBucket
+from api.resilience import CircuitBreaker, RetryPolicy, is_retryable_error, parse_retry_after
+
+
+class ScriptedClient(BaseScreenshotClient):
+    """Provider client whose upstream answers are scripted."""
+
+    provider = 'scripted'
+    default_prompt = 'Default prompt'
+
+    def __init__(self, results, retry_policy=None, circuit_breaker=None):
+        self.results = list(results)
+        self.calls = 0
+        super().__init__(
+            'scripted-model',
+            rate_limiter=TokenBucket(6000, burst=100),
+            retry_policy=retry_policy or RetryPolicy(max_attempts=3, base_delay=0),
+            circuit_breaker=circuit_breaker,
+        )
+
+    def _send_request(self, image, prompt):
+        self.calls += 1
+        if self.results:
+            return self.results.pop(0)
+        return {'choices': [{'message': {'content': 'ok'}}]}
+
+
+class RetryPolicyTestCase(TestCase):
+    """Test cases for the retry backoff."""
+
+    def test_exponential_backoff_with_jitter(self):
+        """Test that delays stay within the growing backoff window."""
+        policy = RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=3.0)
+        for attempt, ceiling in ((1, 1.0), (2, 2.0), (3, 3.0), (4, 3.0)):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, ceiling)
+        self.assertIsNone(policy.delay(5))
+
+    def test_retry_after(self):
+        """Test that Retry-After is honoured, unless it exceeds the maximum delay."""
+        policy = RetryPolicy(max_attempts=3, base_delay=0.0, max_delay=10.0)
+        self.assertEqual(policy.delay(1, retry_after=4.0), 4.0)
+        self.assertIsNone(policy.delay(1, retry_after=60.0))
+
+    def test_parse_retry_after(self):
+        """Test parsing of seconds and HTTP dates."""
+        self.assertEqual(parse_retry_after('7'), 7.0)
+        self.assertEqual(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+    def test_is_retryable_error(self):
+        """Test which failures are retried."""
+        self.assertTrue(is_retryable_error({'error': 'Too Many Requests', 'status': 429}))
+        self.assertTrue(is_retryable_error({'error': 'Bad Gateway', 'status': 502}))
+        self.assertTrue(is_retryable_error({'error': 'Connection reset', 'retryable': True}))
+        self.assertFalse(is_retryable_error({'error': 'Bad Request', 'status': 400}))
+        self.assertFalse(is_retryable_error({'error': 'Screenshot not found'}))
+        self.assertFalse(is_retryable_error({'choices': []}))
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Test cases for the circuit breaker."""
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that the circuit opens after the failure threshold and resets on success."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_half_open_trial(self):
+        """Test that one trial request is let through after the reset timeout."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class ClientResilienceTestCase(TestCase):
+    """Test cases for retries and circuit breaking in the clients."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshot = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(self.screenshot)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_retries_transient_failures(self):
+        """Test that a 429 and a network error are retried until the request succeeds."""
+        client = ScriptedClient([
+            {'error': 'Too Many Requests', 'status': 429},
+            {'error': 'Connection reset', 'retryable': True},
+        ])
+
+        result = client.analyze_screenshot(self.screenshot)
+
+        self.assertEqual(result['choices'][0]['message']['content'], 'ok')
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(client.resilience_stats(), {'retries': 2, 'short_circuits': 0})
+
+    def test_client_errors_are_not_retried(self):
+        """Test that a 4xx other than 429 is returned at once."""
+        client = ScriptedClient([{'error': 'Bad Request', 'status': 400}])
+        self.assertEqual(client.analyze_screenshot(self.screenshot)['status'], 400)
+        self.assertEqual(client.calls, 1)
+
+    @mock.patch('api.base_client.time.sleep')
+    def test_waits_for_retry_after(self, mock_sleep):
+        """Test that the client waits as long as the provider asks."""
+        client = ScriptedClient([{'error': 'Too Many Requests', 'status': 429, 'retry_after': 2.5}])
+        client.analyze_screenshot(self.screenshot)
+        mock_sleep.assert_any_call(2.5)
+
+    def test_open_circuit_fails_fast(self):
+        """Test that requests are short-circuited once the provider keeps failing."""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        failure = {'error': 'Service Unavailable', 'status': 503}
+        client = ScriptedClient([failure] * 2, retry_policy=RetryPolicy(max_attempts=1), circuit_breaker=breaker)
+
+        client.analyze_screenshot(self.screenshot)
+        client.analyze_screenshot(self.screenshot)
+        result = client.analyze_screenshot(self.screenshot)
+
+        self.assertEqual(result['status'], 503)
+        self.assertIn('circuit breaker is open', result['error'])
+        self.assertEqual(client.calls, 2)
+        self.assertEqual(client.resilience_stats()['short_circuits'], 1)
+
+    def test_error_result_retry_hints(self):
+        """Test that Retry-After and network errors are recorded on error results."""
+        error = Exception('429 Too Many Requests')
+        error.response = mock.Mock(status_code=429, headers={'Retry-After': '3'})
+        self.assertEqual(error_result(error), {'error': '429 Too Many Requests', 'status': 429, 'retry_after': 3.0})
+        self.assertEqual(
+            error_result(ConnectionError('Connection reset')), {'error': 'Connection reset', 'retryable': True}
+        )
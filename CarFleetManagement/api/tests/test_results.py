@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.models import AnalysisResult
+from api.results import ingest_file, ingest_results, query_results
+
+
+def analysis(content, **extra):
+    return {'choices': [{'message': {'content': content}}], **extra}
+
+
+class ResultsStoreTestCase(TestCase):
+    """Test cases for ingesting and querying stored analysis results."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.analysis_file = os.path.join(self.tmp_dir, 'screenshot_analysis.json')
+        with open(self.analysis_file, 'w') as f:
+            json.dump({
+                'home_en_dark_20250331-201208.png': analysis(
+                    'Dark home', model='openai/gpt-4o', usage={'prompt_tokens': 900, 'completion_tokens': 120}
+                ),
+                'about_fr_light_20250331-201239.png': {'error': 'API error'},
+            }, f)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_ingest_file(self):
+        """Test that every result of a file is stored with its metadata, once."""
+        self.assertEqual(ingest_file(self.analysis_file, provider='openrouter'), 2)
+        self.assertEqual(ingest_file(self.analysis_file, provider='openrouter'), 2)
+
+        self.assertEqual(AnalysisResult.objects.count(), 2)
+        row = AnalysisResult.objects.get(screenshot='home_en_dark_20250331-201208.png')
+        self.assertEqual((row.page, row.language, row.theme), ('home', 'en', 'dark'))
+        self.assertEqual((row.provider, row.model), ('openrouter', 'openai/gpt-4o'))
+        self.assertEqual((row.prompt_tokens, row.completion_tokens, row.content), (900, 120, 'Dark home'))
+        self.assertEqual(AnalysisResult.objects.get(language='fr').error, 'API error')
+
+    def test_keyset_pagination(self):
+        """Test that pages follow each other without gaps or repeats, including rows created together."""
+        now = timezone.now()
+        for day in range(3):
+            results = {f"home_en_dark_2025033{day}-12000{i}.png": analysis(f"{day}/{i}") for i in range(4)}
+            ingest_results(f"job:{day}", results, created_at=now - timedelta(days=day))
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = query_results({'language': 'en'}, cursor, limit=5)
+            seen += [row.pk for row in rows]
+            if cursor is None:
+                break
+        self.assertEqual(seen, list(AnalysisResult.objects.order_by('-created_at', '-id').values_list('pk', flat=True)))
+
+        rows, _ = query_results({'since': now - timedelta(hours=1)}, limit=50)
+        self.assertEqual(len(rows), 4)
+
+    def test_results_endpoint(self):
+        """Test filtering and following the next page links of the results endpoint."""
+        ingest_file(self.analysis_file)
+        ingest_results('job:1', {'home_en_light_20250331-201203.png': analysis('Light home')})
+        client = APIClient()
+
+        response = client.get(reverse('analysis_results'), {'page': 'home', 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['content'] for r in response.data['results']], ['Light home'])
+
+        response = client.get(response.data['next'])
+        self.assertEqual([r['content'] for r in response.data['results']], ['Dark home'])
+        self.assertIsNone(response.data['next'])
+
+        response = client.get(reverse('analysis_results'), {'cursor': 'not a cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = client.get(reverse('analysis_results'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ingest_command(self):
+        """Test loading analysis files with the ingest_results command."""
+        out = StringIO()
+        call_command('ingest_results', self.analysis_file, '--provider', 'gemini', stdout=out)
+        self.assertIn('Ingested 2 results', out.getvalue())
+        self.assertEqual(AnalysisResult.objects.filter(provider='gemini').count(), 2)
@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import TestCase
+from PIL import Image
+
+from api.base_client import BaseScreenshotClient, error_result
+from api.rate_limit import BATCH, TokenBucket, rate_limit_priority
+from api.resilience import RetryPolicy
+from api.router import ProviderStats, RouterClient
+
+
+class FakeClient(BaseScreenshotClient):
+    """Provider client whose upstream answer and latency are scripted."""
+
+    default_prompt = 'Default prompt'
+
+    def __init__(self, provider, delay=0.0, results=None):
+        self.provider = provider
+        self.delay = delay
+        self.results = list(results or [])
+        self.calls = 0
+        self.images = []
+        # Failover is tested without the client's own retries
+        super().__init__(
+            f"{provider}-model", rate_limiter=TokenBucket(6000, burst=100), retry_policy=RetryPolicy(max_attempts=1)
+        )
+
+    def _send_request(self, image, prompt):
+        self.calls += 1
+        self.images.append(image.data)
+        time.sleep(self.delay)
+        if self.results:
+            return self.results.pop(0)
+        return {'choices': [{'message': {'content': self.provider}}]}
+
+
+class ProviderStatsTestCase(TestCase):
+    """Test cases for rolling provider statistics."""
+
+    def test_latency_and_error_rate(self):
+        """Test percentiles over successful requests and the error rate over all of them."""
+        stats = ProviderStats(window=10)
+        for latency in (1.0, 2.0, 3.0, 4.0):
+            stats.record(latency, True)
+        stats.record(100.0, False)
+
+        self.assertEqual(stats.latency(50), 3.0)
+        self.assertEqual(stats.latency(95), 4.0)
+        self.assertAlmostEqual(stats.error_rate(), 0.2)
+        self.assertIsNone(stats.latency(95, min_samples=5))
+
+    def test_window(self):
+        """Test that only recent requests are taken into account."""
+        stats = ProviderStats(window=2)
+        stats.record(1.0, False)
+        stats.record(1.0, True)
+        stats.record(1.0, True)
+        self.assertEqual(stats.error_rate(), 0.0)
+
+
+class RouterClientTestCase(TestCase):
+    """Test cases for the RouterClient."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshot = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (64, 32), 'white').save(self.screenshot)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def content(self, result):
+        return result['choices'][0]['message']['content']
+
+    def test_routes_to_fastest_provider(self):
+        """Test that once latencies are known, requests go to the fastest provider."""
+        slow = FakeClient('openrouter', delay=0.05)
+        fast = FakeClient('gemini', delay=0.0)
+        router = RouterClient([slow, fast], hedge=False)
+
+        router.analyze_screenshot(self.screenshot)
+        router.analyze_screenshot(self.screenshot)
+        results = [self.content(router.analyze_screenshot(self.screenshot)) for _ in range(3)]
+
+        self.assertEqual(results, ['gemini'] * 3)
+        self.assertEqual(slow.calls, 1)
+
+    def test_fails_over_on_rate_limit(self):
+        """Test that a 429 is retried with the next provider, which is then avoided."""
+        limited = FakeClient('openrouter', results=[{'error': '429 Too Many Requests', 'status': 429}])
+        backup = FakeClient('gemini')
+        router = RouterClient([limited, backup], hedge=False, cooldown=60)
+
+        self.assertEqual(self.content(router.analyze_screenshot(self.screenshot)), 'gemini')
+        self.assertEqual(self.content(router.analyze_screenshot(self.screenshot)), 'gemini')
+        self.assertEqual(limited.calls, 1)
+        self.assertFalse(router.provider_stats()['openrouter']['available'])
+
+    def test_fails_over_with_file_object(self):
+        """Test that every provider gets the whole image of an uploaded file object."""
+        limited = FakeClient('openrouter', results=[{'error': '503 Service Unavailable', 'status': 503}])
+        backup = FakeClient('gemini')
+        router = RouterClient([limited, backup], hedge=False)
+
+        with open(self.screenshot, 'rb') as f:
+            raw = f.read()
+            self.assertEqual(self.content(router.analyze_screenshot(f)), 'gemini')
+
+        self.assertEqual(limited.images, [raw])
+        self.assertEqual(backup.images, [raw])
+
+    def test_client_errors_are_not_failed_over(self):
+        """Test that a 4xx other than 429 is returned without trying another provider."""
+        rejected = FakeClient('openrouter', results=[{'error': '400 Bad Request', 'status': 400}])
+        backup = FakeClient('gemini')
+        router = RouterClient([rejected, backup], hedge=False)
+
+        self.assertEqual(router.analyze_screenshot(self.screenshot)['status'], 400)
+        self.assertEqual(backup.calls, 0)
+
+    def test_hedges_slow_interactive_requests(self):
+        """Test that a slow interactive request is also sent to the next provider."""
+        slow = FakeClient('openrouter', delay=0.5)
+        fast = FakeClient('gemini')
+        router = RouterClient([slow, fast], hedge=True, hedge_delay=0.05)
+
+        start = time.monotonic()
+        result = router.analyze_screenshot(self.screenshot)
+
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(self.content(result), 'gemini')
+        self.assertEqual(slow.calls, 1)
+
+    def test_hedge_delay_starts_when_primary_runs(self):
+        """Test that time spent queued in a busy hedge pool does not trigger a hedge."""
+        slow = FakeClient('openrouter', delay=0.1)
+        backup = FakeClient('gemini')
+        router = RouterClient([slow, backup], hedge=True, hedge_delay=0.3)
+
+        # Every thread of the pool is busy for longer than the hedge delay
+        with ThreadPoolExecutor(max_workers=2) as pool, \
+                mock.patch('api.router._get_hedge_pool', return_value=pool):
+            pool.submit(time.sleep, 0.5)
+            pool.submit(time.sleep, 0.5)
+            result = router.analyze_screenshot(self.screenshot)
+
+        self.assertEqual(self.content(result), 'openrouter')
+        self.assertEqual(backup.calls, 0)
+
+    def test_batch_requests_are_not_hedged(self):
+        """Test that hedging only applies to interactive requests."""
+        slow = FakeClient('openrouter', delay=0.1)
+        fast = FakeClient('gemini')
+        router = RouterClient([slow, fast], hedge=True, hedge_delay=0.01)
+
+        with rate_limit_priority(BATCH):
+            self.assertEqual(self.content(router.analyze_screenshot(self.screenshot)), 'openrouter')
+        self.assertEqual(fast.calls, 0)
+
+    def test_error_result_status(self):
+        """Test that the HTTP status of an error is kept for routing decisions."""
+        error = Exception('503 Service Unavailable')
+        error.response = mock.Mock(status_code=503, headers={})
+        self.assertEqual(error_result(error), {'error': '503 Service Unavailable', 'status': 503})
+        self.assertEqual(error_result(Exception('API error')), {'error': 'API error'})
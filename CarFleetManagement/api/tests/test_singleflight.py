@@ -0,0 +1,325 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import closing
+from unittest import mock
+
+from django.test import SimpleTestCase
+from PIL import Image
+
+from api.openrouter_client import OpenRouterClient
+from api.rate_limit import TokenBucket
+from api.singleflight import SharedSingleFlight, SingleFlight
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    """Test cases for coalescing concurrent calls within a process."""
+
+    def run_concurrently(self, flight, func, callers=4, key='key'):
+        """Call flight.do from several threads once all of them are running."""
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(flight.do(key, func))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_call(self):
+        """Test that callers arriving while a call is in flight get its result."""
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return {'result': 'shared'}
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        outcomes = self.run_concurrently(flight, func)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [{'result': 'shared'}] * 4)
+        # Later calls are not coalesced with the finished one
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+    def test_errors_are_raised_in_every_caller(self):
+        """Test that the exception of a shared call reaches every waiting caller."""
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def func():
+            started.wait(0.2)
+            raise ValueError('Test error')
+
+        outcomes = self.run_concurrently(flight, func, callers=3)
+        self.assertEqual([str(outcome) for outcome in outcomes], ['Test error'] * 3)
+
+    async def test_coroutines_and_threads_share_one_call(self):
+        """Test that coroutines and threads arriving while a coroutine's call is in flight get its result."""
+        flight = SingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return {'result': 'shared'}
+
+        async def thread_caller():
+            # Joins once the coroutine's call is in flight
+            await asyncio.sleep(0.05)
+            return await asyncio.to_thread(flight.do, 'key', mock.Mock(return_value='not shared'))
+
+        outcomes = await asyncio.gather(*[flight.do_async('key', func) for _ in range(3)], thread_caller())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [{'result': 'shared'}] * 4)
+
+    async def test_errors_are_raised_in_every_coroutine(self):
+        """Test that the exception of a shared call reaches every waiting coroutine."""
+        flight = SingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.1)
+            raise ValueError('Test error')
+
+        outcomes = await asyncio.gather(*[flight.do_async('key', func) for _ in range(3)], return_exceptions=True)
+        self.assertEqual([str(outcome) for outcome in outcomes], ['Test error'] * 3)
+        self.assertEqual(await flight.do_async('key', mock.AsyncMock(return_value='again')), 'again')
+
+
+class SharedSingleFlightTestCase(SimpleTestCase):
+    """Test cases for coalescing calls across processes through the lock table."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'inflight.sqlite3')
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_flight(self, **kwargs):
+        flight = SharedSingleFlight(self.db_path, **kwargs)
+        flight.poll_interval = 0.01
+        return flight
+
+    def test_processes_share_one_call(self):
+        """Test that a process waits for the call claimed by another one."""
+        # Each instance stands for a process with its own in-memory flights
+        first, second = self.make_flight(), self.make_flight()
+        claimed = threading.Event()
+        release = threading.Event()
+        results = {}
+
+        def leader():
+            claimed.set()
+            release.wait(5)
+            return {'choices': [{'message': {'content': 'Shared'}}]}
+
+        thread = threading.Thread(target=lambda: results.update(first=first.do('key', leader)))
+        thread.start()
+        claimed.wait(5)
+
+        follower = mock.Mock(return_value={'error': 'Not shared'})
+        threading.Timer(0.1, release.set).start()
+        results['second'] = second.do('key', follower)
+        thread.join(5)
+
+        follower.assert_not_called()
+        self.assertEqual(results['first'], results['second'])
+
+    async def test_coroutines_of_processes_share_one_call(self):
+        """Test that a coroutine waits for the call claimed by a coroutine of another process."""
+        first, second = self.make_flight(), self.make_flight()
+        calls = []
+
+        async def leader():
+            calls.append(1)
+            await asyncio.sleep(0.2)
+            return {'choices': [{'message': {'content': 'Shared'}}]}
+
+        async def follower():
+            await asyncio.sleep(0.05)
+            return await second.do_async('key', mock.AsyncMock(return_value={'error': 'Not shared'}))
+
+        results = await asyncio.gather(first.do_async('key', leader), follower())
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results[0], results[1])
+        # The claim was released; a later call is made again
+        self.assertEqual(await second.do_async('key', mock.AsyncMock(return_value='again')), 'again')
+
+    def test_abandoned_claim_is_taken_over(self):
+        """Test that a claim is released when its call raises, and expires when its process dies."""
+        first, second = self.make_flight(), self.make_flight(lease=0)
+
+        with self.assertRaises(ValueError):
+            first.do('key', mock.Mock(side_effect=ValueError('Test error')))
+        self.assertEqual(first.do('key', lambda: 'retried'), 'retried')
+
+        # A claim past its lease, as left by a crashed process, does not block other processes
+        with closing(second._connect()) as conn:
+            self.assertIsNone(second._claim(conn, 'other', 'crashed'))
+        self.assertEqual(first.do('other', lambda: 'taken over'), 'taken over')
+
+
+class ClientSingleFlightTestCase(SimpleTestCase):
+    """Test cases for coalescing identical analyses in the provider clients."""
+
+    def setUp(self):
+        """Set up test environment."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.screenshot = os.path.join(self.tmp_dir, 'home_en_dark_20250331-201208.png')
+        Image.new('RGB', (100, 100), 'white').save(self.screenshot)
+
+    def tearDown(self):
+        """Clean up test environment."""
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_identical_analyses_share_one_request(self):
+        """Test that concurrent analyses only differing by caller send one upstream request."""
+        client = OpenRouterClient(
+            api_key='test_api_key', rate_limiter=TokenBucket(600, burst=10), single_flight=SingleFlight()
+        )
+        release = threading.Event()
+        sent = []
+
+        def send(image, prompt):
+            sent.append(prompt)
+            release.wait(5)
+            return {'choices': [{'message': {'content': prompt}}]}
+
+        results = []
+        with mock.patch.object(client, '_send_request', side_effect=send):
+            threads = [
+                threading.Thread(target=lambda p=prompt: results.append(client.analyze_screenshot(self.screenshot, p)))
+                for prompt in ['Same prompt', 'Same prompt', 'Same prompt', 'Other prompt']
+            ]
+            for thread in threads:
+                thread.start()
+            threading.Timer(0.2, release.set).start()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(sorted(sent), ['Other prompt', 'Same prompt'])
+        self.assertEqual(len(results), 4)
+
+    def make_client(self):
+        return OpenRouterClient(
+            api_key='test_api_key', rate_limiter=TokenBucket(600, burst=10), single_flight=SingleFlight()
+        )
+
+    async def test_identical_async_analyses_share_one_request(self):
+        """Test that concurrent async analyses, and a sync one arriving meanwhile, send one upstream request."""
+        client = self.make_client()
+        sent = []
+
+        async def send(image, prompt):
+            sent.append(prompt)
+            await asyncio.sleep(0.2)
+            return {'choices': [{'message': {'content': prompt}}]}
+
+        async def sync_caller():
+            await asyncio.sleep(0.05)
+            return await asyncio.to_thread(client.analyze_screenshot, self.screenshot, 'Same prompt')
+
+        with mock.patch.object(client, '_send_request_async', side_effect=send), \
+                mock.patch.object(client, '_send_request') as mock_send:
+            results = await asyncio.gather(
+                *[client.analyze_screenshot_async(self.screenshot, prompt)
+                  for prompt in ['Same prompt', 'Same prompt', 'Same prompt', 'Other prompt']],
+                sync_caller(),
+            )
+
+        mock_send.assert_not_called()
+        self.assertEqual(sorted(sent), ['Other prompt', 'Same prompt'])
+        self.assertEqual([result['choices'][0]['message']['content'] for result in results],
+                         ['Same prompt', 'Same prompt', 'Same prompt', 'Other prompt', 'Same prompt'])
+
+    def test_stream_waits_for_identical_analysis(self):
+        """Test that a stream of an analysis already in flight relays its result instead of streaming."""
+        client = self.make_client()
+        started = threading.Event()
+        release = threading.Event()
+
+        def send(image, prompt):
+            started.set()
+            release.wait(5)
+            return {'choices': [{'message': {'content': 'Shared'}}]}
+
+        with mock.patch.object(client, '_send_request', side_effect=send), \
+                mock.patch.object(client, '_stream_request') as mock_stream:
+            thread = threading.Thread(target=client.analyze_screenshot, args=(self.screenshot,))
+            thread.start()
+            started.wait(5)
+            threading.Timer(0.1, release.set).start()
+            events = list(client.analyze_screenshot_stream(self.screenshot))
+            thread.join(5)
+
+        mock_stream.assert_not_called()
+        self.assertEqual(events[0], ('delta', 'Shared'))
+        self.assertEqual(events[-1][0], 'result')
+
+    def test_stream_shares_its_result(self):
+        """Test that an analysis arriving while a stream is in flight gets the streamed result."""
+        client = self.make_client()
+        results = []
+
+        def stream_request(image, prompt):
+            yield 'Streamed '
+            # Leaves time for the other analysis to join
+            time.sleep(0.2)
+            yield 'answer'
+
+        with mock.patch.object(client, '_stream_request', side_effect=stream_request), \
+                mock.patch.object(client, '_send_request') as mock_send:
+            stream = client.analyze_screenshot_stream(self.screenshot)
+            self.assertEqual(next(stream), ('delta', 'Streamed '))
+            thread = threading.Thread(target=lambda: results.append(client.analyze_screenshot(self.screenshot)))
+            thread.start()
+            events = list(stream)
+            thread.join(5)
+
+        mock_send.assert_not_called()
+        self.assertEqual(results, [events[-1][1]])
+
+    def test_group_waits_for_identical_analysis(self):
+        """Test that a group does not send a screenshot whose analysis is already in flight."""
+        client = self.make_client()
+        other = os.path.join(self.tmp_dir, 'home_en_light_20250331-201208.png')
+        Image.new('RGB', (100, 100), 'black').save(other)
+        started = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def send(image, prompt):
+            sent.append(image.data)
+            content = f"Analysis {len(sent)}"
+            started.set()
+            release.wait(5)
+            return {'choices': [{'message': {'content': content}}]}
+
+        with mock.patch.object(client, '_send_request', side_effect=send):
+            thread = threading.Thread(target=client.analyze_screenshot, args=(self.screenshot,))
+            thread.start()
+            started.wait(5)
+            threading.Timer(0.2, release.set).start()
+            results = client.analyze_screenshot_group([('dark', self.screenshot), ('light', other)])
+            thread.join(5)
+
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(results[0]['choices'][0]['message']['content'], 'Analysis 1')
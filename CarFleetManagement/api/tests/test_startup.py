@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Imported by the AI clients only when they are first used
+DEFERRED_MODULES = ('google.generativeai', 'PIL', 'numpy', 'dotenv')
+
+STARTUP_SCRIPT = """
+import sys
+import django
+django.setup()
+import car_fleet_manager.urls
+print(','.join(name for name in {modules!r} if name in sys.modules))
+"""
+
+
+class StartupImportTestCase(SimpleTestCase):
+    """Import-time benchmark of the API modules loaded by every Django process."""
+
+    # Generous budget for the summed self import time of the api modules
+    budget_ms = 150
+
+    def run_startup(self):
+        """Import the URLconf in a fresh interpreter with ``-X importtime``.
+
+        Returns:
+            tuple: The deferred modules that were imported, and the self import
+                time of each ``api`` module in microseconds
+        """
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='car_fleet_manager.settings')
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT.format(modules=DEFERRED_MODULES)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(completed.returncode, 0, completed.stderr[-2000:])
+
+        self_times = {}
+        for line in completed.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            self_us, _, name = [part.strip() for part in line[len('import time:'):].split('|')]
+            if name.startswith('api.') and self_us.isdigit():
+                self_times[name] = int(self_us)
+        loaded = [name for name in completed.stdout.strip().split(',') if name]
+        return loaded, self_times
+
+    def test_startup_does_not_import_heavy_dependencies(self):
+        """Test that SDKs, Pillow, NumPy and dotenv are deferred until first client use."""
+        loaded, self_times = self.run_startup()
+
+        self.assertIn('api.views', self_times)
+        self.assertEqual(loaded, [], f"Imported at startup: {', '.join(loaded)}")
+        total_ms = sum(self_times.values()) / 1000
+        self.assertLess(total_ms, self.budget_ms, f"api modules took {total_ms:.0f} ms to import: {self_times}")
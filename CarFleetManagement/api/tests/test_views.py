@@ -1,12 +1,19 @@
 import os
 import json
+import shutil
+import tempfile
+from io import BytesIO, StringIO
 from unittest import mock
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
 from rest_framework.test import APIClient
 from rest_framework import status
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile, TemporaryUploadedFile
+from django.core.management import call_command
+from PIL import Image
+
+from api.models import AnalysisJob
 
 
 class AnalyzeScreenshotViewTestCase(TestCase):
@@ -18,23 +25,15 @@ class AnalyzeScreenshotViewTestCase(TestCase):
         self.url = reverse('analyze_screenshot')
         
         # Create a test image file
-        self.image_content = b'test image content'
+        buffer = BytesIO()
+        Image.new('RGB', (64, 32), 'white').save(buffer, format='PNG')
+        self.image_content = buffer.getvalue()
         self.test_image = SimpleUploadedFile(
             name='test_screenshot.png',
             content=self.image_content,
             content_type='image/png'
         )
     
-    def tearDown(self):
-        """Clean up test environment."""
-        # Ensure temp directory is cleaned up
-        temp_dir = os.path.join(settings.BASE_DIR, 'temp_screenshots')
-        if os.path.exists(temp_dir):
-            for file in os.listdir(temp_dir):
-                os.remove(os.path.join(temp_dir, file))
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-    
     def test_post_without_screenshot(self):
         """Test POST request without screenshot file."""
         response = self.client.post(self.url, {})
@@ -72,6 +71,32 @@ class AnalyzeScreenshotViewTestCase(TestCase):
         mock_client.analyze_screenshot.assert_called_once()
         args, kwargs = mock_client.analyze_screenshot.call_args
         self.assertEqual(kwargs['prompt'], None)
+        
+        # The upload is handed over in memory rather than written to disk
+        self.assertIsInstance(args[0], InMemoryUploadedFile)
+        self.assertFalse(os.path.exists(os.path.join(settings.BASE_DIR, 'temp_screenshots')))
+    
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=8)
+    @mock.patch('api.views.get_client')
+    def test_post_with_large_screenshot(self, mock_get_client):
+        """Test that uploads above the memory threshold are spooled to a unique temporary file."""
+        uploads = []
+        
+        def analyze(screenshot, prompt=None):
+            uploads.append(screenshot)
+            return {'choices': [{'message': {'content': str(len(screenshot.read()))}}]}
+        
+        mock_client = mock.Mock()
+        mock_client.analyze_screenshot.side_effect = analyze
+        mock_get_client.return_value = mock_client
+        
+        response = self.client.post(self.url, {'screenshot': self.test_image}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['choices'][0]['message']['content'], str(len(self.image_content)))
+        self.assertIsInstance(uploads[0], TemporaryUploadedFile)
+        # The temporary file is removed with the request
+        self.assertFalse(os.path.exists(uploads[0].temporary_file_path()))
     
     @mock.patch('api.views.get_client')
     def test_post_with_screenshot_and_prompt(self, mock_get_client):
@@ -128,16 +153,77 @@ class AnalyzeScreenshotViewTestCase(TestCase):
         self.assertEqual(response.data['error'], 'Test error')
 
 
+    @mock.patch('api.views.get_client')
+    def test_post_stream(self, mock_get_client):
+        """Test that a streaming request relays deltas and ends with the full result."""
+        result = {'choices': [{'message': {'content': 'Analysis result'}}]}
+        mock_client = mock.Mock()
+        mock_client.analyze_screenshot_stream.return_value = iter([
+            ('delta', 'Analysis '),
+            ('delta', 'result'),
+            ('result', result),
+        ])
+        mock_get_client.return_value = mock_client
+        
+        response = self.client.post(
+            self.url,
+            {'screenshot': self.test_image, 'stream': 'true'},
+            format='multipart'
+        )
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('event: delta\ndata: {"content": "Analysis "}\n\n', body)
+        self.assertTrue(body.endswith(f"event: result\ndata: {json.dumps(result)}\n\n"))
+        mock_client.analyze_screenshot.assert_not_called()
+        
+        # The upload is passed to the client as-is
+        args, kwargs = mock_client.analyze_screenshot_stream.call_args
+        self.assertEqual(args[0].name, 'test_screenshot.png')
+    
+    @mock.patch('api.views.get_client')
+    def test_post_with_invalid_image(self, mock_get_client):
+        """Test that uploads that are not a supported image are rejected before analysis."""
+        bogus = SimpleUploadedFile('test_screenshot.png', b'test image content', content_type='image/png')
+        
+        response = self.client.post(self.url, {'screenshot': bogus}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Unsupported image format', response.data['error'])
+        mock_get_client.assert_not_called()
+    
+    @override_settings(AI_UPLOAD_MAX_PIXELS=1000)
+    @mock.patch('api.views.get_client')
+    def test_post_with_oversized_image(self, mock_get_client):
+        """Test that images over the pixel limit are rejected."""
+        response = self.client.post(self.url, {'screenshot': self.test_image}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('64x32', response.data['error'])
+        mock_get_client.assert_not_called()
+    
+    def test_post_without_screenshot_accepting_event_stream(self):
+        """Test that errors are rendered as an event for event-stream clients."""
+        response = self.client.post(self.url, {}, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(response.content.decode().startswith('event: result\ndata: {"error"'))
+
+
 class BatchAnalyzeScreenshotsViewTestCase(TestCase):
-    """Test cases for the BatchAnalyzeScreenshotsView."""
+    """Test cases for the BatchAnalyzeScreenshotsView and the job endpoints."""
     
     def setUp(self):
         """Set up test environment."""
         self.client = APIClient()
         self.url = reverse('batch_analyze_screenshots')
         
-        # Create a test screenshots directory
-        self.screenshots_dir = os.path.join(settings.BASE_DIR, 'debug_screenshots')
+        # Create a test screenshots directory apart from the real debug screenshots
+        self.base_dir = tempfile.mkdtemp()
+        override = self.settings(BASE_DIR=self.base_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.screenshots_dir = os.path.join(self.base_dir, 'debug_screenshots')
         os.makedirs(self.screenshots_dir, exist_ok=True)
         
         # Create test screenshot files
@@ -154,134 +240,62 @@ class BatchAnalyzeScreenshotsViewTestCase(TestCase):
     
     def tearDown(self):
         """Clean up test environment."""
-        # Remove test screenshot files
-        for screenshot in self.test_screenshots:
-            file_path = os.path.join(self.screenshots_dir, screenshot)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
-        # Remove test directory if it's empty
-        if os.path.exists(self.screenshots_dir) and not os.listdir(self.screenshots_dir):
-            os.rmdir(self.screenshots_dir)
+        shutil.rmtree(self.base_dir, ignore_errors=True)
     
-    @mock.patch('api.views.get_client')
-    def test_post_without_filters(self, mock_get_client):
+    def queued_screenshots(self, response):
+        """Return the screenshots of the job queued by a request."""
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = AnalysisJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual(job.status, AnalysisJob.QUEUED)
+        return job.screenshots
+    
+    def run_worker(self, mock_client):
+        """Drain the job queue with a mock client."""
+        with mock.patch('car_fleet_manager.management.commands.analysis_worker.get_client', return_value=mock_client):
+            call_command('analysis_worker', '--once', '--prep-workers', '0', stdout=StringIO())
+    
+    def test_post_without_filters(self):
         """Test POST request without filters."""
-        # Mock the OpenRouter client
-        mock_client = mock.Mock()
-        mock_client.analyze_screenshot.return_value = {
-            'choices': [
-                {
-                    'message': {
-                        'content': 'Analysis result'
-                    }
-                }
-            ]
-        }
-        mock_get_client.return_value = mock_client
-        
         # Make the request
         response = self.client.post(self.url, {})
         
         # Verify the response
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 4)  # All 4 screenshots
-        
-        # Verify the client was called for each screenshot
-        self.assertEqual(mock_client.analyze_screenshot.call_count, 4)
+        self.assertEqual(sorted(self.queued_screenshots(response)), sorted(self.test_screenshots))
+        self.assertEqual(response.data['total'], 4)  # All 4 screenshots
+        self.assertEqual(response['Location'], response.data['status_url'])
     
-    @mock.patch('api.views.get_client')
-    def test_post_with_language_filter(self, mock_get_client):
+    def test_post_with_language_filter(self):
         """Test POST request with language filter."""
-        # Mock the OpenRouter client
-        mock_client = mock.Mock()
-        mock_client.analyze_screenshot.return_value = {
-            'choices': [
-                {
-                    'message': {
-                        'content': 'Analysis result'
-                    }
-                }
-            ]
-        }
-        mock_get_client.return_value = mock_client
-        
-        # Make the request
         response = self.client.post(self.url, {'language': 'en'})
         
-        # Verify the response
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Only the 2 English screenshots
-        self.assertIn('home_en_dark_20250331-201208.png', response.data)
-        self.assertIn('home_en_light_20250331-201203.png', response.data)
+        # Only the 2 English screenshots
+        self.assertEqual(
+            sorted(self.queued_screenshots(response)),
+            ['home_en_dark_20250331-201208.png', 'home_en_light_20250331-201203.png']
+        )
     
-    @mock.patch('api.views.get_client')
-    def test_post_with_theme_filter(self, mock_get_client):
+    def test_post_with_theme_filter(self):
         """Test POST request with theme filter."""
-        # Mock the OpenRouter client
-        mock_client = mock.Mock()
-        mock_client.analyze_screenshot.return_value = {
-            'choices': [
-                {
-                    'message': {
-                        'content': 'Analysis result'
-                    }
-                }
-            ]
-        }
-        mock_get_client.return_value = mock_client
-        
-        # Make the request
         response = self.client.post(self.url, {'theme': 'dark'})
         
-        # Verify the response
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Only the 2 dark theme screenshots
-        self.assertIn('home_en_dark_20250331-201208.png', response.data)
-        self.assertIn('about_fr_dark_20250331-201239.png', response.data)
+        # Only the 2 dark theme screenshots
+        self.assertEqual(
+            sorted(self.queued_screenshots(response)),
+            ['about_fr_dark_20250331-201239.png', 'home_en_dark_20250331-201208.png']
+        )
     
-    @mock.patch('api.views.get_client')
-    def test_post_with_page_filter(self, mock_get_client):
+    def test_post_with_page_filter(self):
         """Test POST request with page filter."""
-        # Mock the OpenRouter client
-        mock_client = mock.Mock()
-        mock_client.analyze_screenshot.return_value = {
-            'choices': [
-                {
-                    'message': {
-                        'content': 'Analysis result'
-                    }
-                }
-            ]
-        }
-        mock_get_client.return_value = mock_client
-        
-        # Make the request
         response = self.client.post(self.url, {'page': 'home'})
         
-        # Verify the response
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)  # Only the 2 home page screenshots
-        self.assertIn('home_en_dark_20250331-201208.png', response.data)
-        self.assertIn('home_en_light_20250331-201203.png', response.data)
+        # Only the 2 home page screenshots
+        self.assertEqual(
+            sorted(self.queued_screenshots(response)),
+            ['home_en_dark_20250331-201208.png', 'home_en_light_20250331-201203.png']
+        )
     
-    @mock.patch('api.views.get_client')
-    def test_post_with_multiple_filters(self, mock_get_client):
+    def test_post_with_multiple_filters(self):
         """Test POST request with multiple filters."""
-        # Mock the OpenRouter client
-        mock_client = mock.Mock()
-        mock_client.analyze_screenshot.return_value = {
-            'choices': [
-                {
-                    'message': {
-                        'content': 'Analysis result'
-                    }
-                }
-            ]
-        }
-        mock_get_client.return_value = mock_client
-        
-        # Make the request
         response = self.client.post(
             self.url,
             {
@@ -290,10 +304,8 @@ class BatchAnalyzeScreenshotsViewTestCase(TestCase):
             }
         )
         
-        # Verify the response
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)  # Only the English dark theme screenshot
-        self.assertIn('home_en_dark_20250331-201208.png', response.data)
+        # Only the English dark theme screenshot
+        self.assertEqual(self.queued_screenshots(response), ['home_en_dark_20250331-201208.png'])
     
     def test_post_with_no_matching_screenshots(self):
         """Test POST request with filters that match no screenshots."""
@@ -309,21 +321,121 @@ class BatchAnalyzeScreenshotsViewTestCase(TestCase):
         # Verify the response
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
         self.assertIn('warning', response.data)
+        self.assertFalse(AnalysisJob.objects.exists())
     
-    @mock.patch('api.views.get_client')
-    def test_post_with_client_error(self, mock_get_client):
-        """Test POST request with client error."""
-        # Mock the OpenRouter client to raise an exception
+    def test_job_status_and_results(self):
+        """Test polling a job and fetching its results once the worker has run it."""
+        mock_client = mock.Mock()
+        mock_client.analyze_screenshot.return_value = {
+            'choices': [
+                {
+                    'message': {
+                        'content': 'Analysis result'
+                    }
+                }
+            ]
+        }
+        
+        response = self.client.post(self.url, {'language': 'en'})
+        status_url = reverse('analysis_job', args=[response.data['job_id']])
+        results_url = reverse('analysis_job_results', args=[response.data['job_id']])
+        
+        # The results are not available before the job has run
+        response = self.client.get(results_url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['status'], 'queued')
+        
+        self.run_worker(mock_client)
+        
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual((response.data['completed'], response.data['total']), (2, 2))
+        
+        response = self.client.get(results_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)  # Only the 2 English screenshots
+        self.assertIn('home_en_dark_20250331-201208.png', response.data)
+        self.assertIn('home_en_light_20250331-201203.png', response.data)
+        self.assertEqual(mock_client.analyze_screenshot.call_count, 2)
+    
+    def test_post_with_client_error(self):
+        """Test that a job fails with the client error."""
+        # Mock the client to raise an exception
         mock_client = mock.Mock()
         mock_client.analyze_screenshot.side_effect = Exception('Test error')
-        mock_get_client.return_value = mock_client
         
         # Make the request
         response = self.client.post(self.url, {})
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         
-        # Verify the response
+        self.run_worker(mock_client)
+        
+        # Verify the results response
+        response = self.client.get(reverse('analysis_job_results', args=[response.data['job_id']]))
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
-        self.assertIn('error', response.data)
+        self.assertEqual(response.data['error'], 'Test error')
+    
+    @override_settings(AI_BATCH_CONCURRENCY=4)
+    def test_post_streams_ndjson(self):
+        """Test that results are streamed one line per screenshot as they complete, then a summary."""
+        def analyze(path, prompt=None):
+            name = os.path.basename(path)
+            if name.startswith('home_en_dark'):
+                return {'error': 'API error'}
+            return {'choices': [{'message': {'content': f"Analysis of {name}"}}]}
+        
+        mock_client = mock.Mock()
+        mock_client.analyze_screenshot.side_effect = analyze
+        unique_jobs = lambda jobs: (
+            [job for job in jobs if job[0] != 'home_en_light_20250331-201203.png'],
+            {'home_en_light_20250331-201203.png': 'features_es_light_20250331-201220.png'},
+        )
+        
+        with mock.patch('api.views.get_client', return_value=mock_client), \
+                mock.patch('api.dedup.deduplicate', side_effect=unique_jobs):
+            response = self.client.post(self.url, {}, HTTP_ACCEPT='application/x-ndjson')
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['X-Total-Screenshots'], '4')
+        results = {line['screenshot']: line['result'] for line in lines[:-1]}
+        self.assertEqual(sorted(results), sorted(self.test_screenshots))
+        # The duplicate is sent with the result of the screenshot it was matched to
+        self.assertEqual(
+            results['home_en_light_20250331-201203.png']['choices'][0]['message']['content'],
+            'Analysis of features_es_light_20250331-201220.png'
+        )
+        self.assertEqual(lines[-1]['summary'], {
+            'total': 4, 'completed': 4, 'errors': 1, 'duplicates_skipped': 1, 'error': None,
+        })
+        self.assertEqual(mock_client.analyze_screenshot.call_count, 3)
+        self.assertFalse(AnalysisJob.objects.exists())
+    
+    def test_post_stream_with_client_error(self):
+        """Test that a client error ends the stream with the error in the summary."""
+        mock_client = mock.Mock()
+        mock_client.analyze_screenshot.side_effect = Exception('Test error')
+        
+        with mock.patch('api.views.get_client', return_value=mock_client), \
+                mock.patch('api.dedup.deduplicate', side_effect=lambda jobs: (jobs, {})):
+            response = self.client.post(self.url, {'language': 'en', 'stream': 'true'})
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        
+        self.assertEqual(lines[-1]['summary']['error'], 'Test error')
+        self.assertEqual(lines[-1]['summary']['total'], 2)
+    
+    def test_post_stream_with_no_matching_screenshots(self):
+        """Test that a streaming request matching no screenshots gets a 404 line."""
+        response = self.client.post(self.url, {'language': 'de'}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn('warning', json.loads(response.content))
+    
+    def test_unknown_job(self):
+        """Test that unknown job ids are not found."""
+        response = self.client.get(reverse('analysis_job', args=['00000000-0000-0000-0000-000000000000']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class GenerateReportViewTestCase(TestCase):
@@ -356,56 +468,43 @@ class GenerateReportViewTestCase(TestCase):
             }
         }
     
-    def tearDown(self):
-        """Clean up test environment."""
-        # Ensure temp directory is cleaned up
-        temp_dir = os.path.join(settings.BASE_DIR, 'temp_analysis')
-        if os.path.exists(temp_dir):
-            for file in os.listdir(temp_dir):
-                os.remove(os.path.join(temp_dir, file))
-            if os.path.exists(temp_dir):
-                os.rmdir(temp_dir)
-    
     def test_post_without_analysis_data(self):
         """Test POST request without analysis data."""
         response = self.client.post(self.url, {})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('error', response.data)
     
-    @mock.patch('api.views.generate_report')
-    def test_post_with_analysis_data(self, mock_generate_report):
+    def test_post_with_analysis_data(self):
         """Test POST request with analysis data."""
-        # Mock the generate_report function
-        report_content = '<html><body>Test Report</body></html>'
-        
-        # Create a temporary file that will be returned by generate_report
-        temp_file = os.path.join(settings.BASE_DIR, 'temp_report.html')
-        with open(temp_file, 'w') as f:
-            f.write(report_content)
-        
-        mock_generate_report.return_value = temp_file
-        
-        # Make the request
-        response = self.client.post(
-            self.url,
-            {'analysis_data': self.analysis_data},
-            format='json'
-        )
-        
-        # Verify the response
+        with mock.patch('builtins.open') as mock_open:
+            response = self.client.post(
+                self.url,
+                {'analysis_data': self.analysis_data},
+                format='json'
+            )
+            content = b''.join(response.streaming_content).decode()
+        
+        # The report is rendered from the request data without touching the disk
+        mock_open.assert_not_called()
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.content.decode(), report_content)
+        self.assertTrue(response.streaming)
         self.assertEqual(response['Content-Type'], 'text/html')
-        
-        # Clean up the temporary file
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        self.assertIn('<h2>Page: home</h2>', content)
+        self.assertIn('Analysis for home page in English with dark theme', content)
+        self.assertIn('Analysis for home page in English with light theme', content)
+        self.assertTrue(content.endswith('</body></html>'))
+    
+    def test_post_with_invalid_analysis_data(self):
+        """Test POST request with analysis data that is not keyed by screenshot."""
+        response = self.client.post(self.url, {'analysis_data': ['home_en_dark.png']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('error', response.data)
     
-    @mock.patch('api.views.generate_report')
-    def test_post_with_generate_report_error(self, mock_generate_report):
-        """Test POST request with generate_report error."""
-        # Mock the generate_report function to raise an exception
-        mock_generate_report.side_effect = Exception('Test error')
+    @mock.patch('api.views.ScreenshotAnalysisReport')
+    def test_post_with_generate_report_error(self, mock_report):
+        """Test POST request with report generation error."""
+        # Mock the report to raise an exception
+        mock_report.return_value.iter_html.side_effect = Exception('Test error')
         
         # Make the request
         response = self.client.post(
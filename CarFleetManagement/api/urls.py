@@ -10,5 +10,12 @@ from . import views
 urlpatterns = [
     path('screenshots/analyze/', views.AnalyzeScreenshotView.as_view(), name='analyze_screenshot'),
     path('screenshots/batch-analyze/', views.BatchAnalyzeScreenshotsView.as_view(), name='batch_analyze_screenshots'),
+    path('screenshots/jobs/<uuid:job_id>/', views.AnalysisJobView.as_view(), name='analysis_job'),
+    path('screenshots/jobs/<uuid:job_id>/results/', views.AnalysisJobResultsView.as_view(), name='analysis_job_results'),
+    path('results/', views.AnalysisResultsView.as_view(), name='analysis_results'),
+    path('async/screenshots/analyze/', views.AnalyzeScreenshotAsyncView.as_view(), name='analyze_screenshot_async'),
+    path('async/screenshots/batch-analyze/', views.BatchAnalyzeScreenshotsAsyncView.as_view(),
+         name='batch_analyze_screenshots_async'),
     path('screenshots/generate-report/', views.GenerateReportView.as_view(), name='generate_report'),
+    path('metrics/', views.AIMetricsView.as_view(), name='ai_metrics'),
 ]
\ No newline at end of file
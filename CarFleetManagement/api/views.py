@@ -1,21 +1,40 @@
-from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse, StreamingHttpResponse
 from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.settings import api_settings
+import asyncio
 import os
-import json
+from datetime import datetime
 
-from .openrouter_client import get_client
-from .report_generator import generate_report
+from asgiref.sync import sync_to_async
+
+from .base_client import analyze_many_async, iter_analyses
+from .catalog import find_screenshots
+from .image_prep import InvalidImageError, validate_image
+from .jobs import build_jobs, enqueue_batch
+from .metrics import get_metrics
+from .models import AnalysisJob
+from .renderers import EventStreamRenderer, NDJSONRenderer, format_ndjson, format_sse
+from .results import query_results
+from .router import get_client
+from .report_generator import ScreenshotAnalysisReport
 
 
 class AnalyzeScreenshotView(APIView):
-    """API view for analyzing a single screenshot using OpenRouter API."""
+    """API view for analyzing a single screenshot with the fastest healthy AI provider."""
     
     parser_classes = (MultiPartParser, FormParser)
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
     
     def post(self, request, format=None):
         # Check if screenshot file is provided
@@ -25,40 +44,78 @@ class AnalyzeScreenshotView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE stay in memory; larger ones are
+        # spooled by Django to a uniquely named temporary file, removed with the request
         screenshot = request.FILES['screenshot']
         prompt = request.data.get('prompt', None)
         
-        # Save the screenshot temporarily
-        temp_dir = os.path.join(settings.BASE_DIR, 'temp_screenshots')
-        os.makedirs(temp_dir, exist_ok=True)
+        # Reject bogus and oversized images from their header, before anything is decoded
+        try:
+            validate_image(screenshot)
+        except InvalidImageError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        screenshot_path = os.path.join(temp_dir, screenshot.name)
-        with open(screenshot_path, 'wb+') as destination:
-            for chunk in screenshot.chunks():
-                destination.write(chunk)
+        if _wants_stream(request):
+            return self._stream(screenshot, prompt)
         
         try:
             # Analyze the screenshot
             client = get_client()
-            analysis = client.analyze_screenshot(screenshot_path, prompt=prompt)
-            
-            # Clean up the temporary file
-            os.remove(screenshot_path)
+            analysis = client.analyze_screenshot(screenshot, prompt=prompt)
             
             return Response(analysis)
         except Exception as e:
-            # Clean up the temporary file
-            if os.path.exists(screenshot_path):
-                os.remove(screenshot_path)
-            
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    def _stream(self, screenshot, prompt):
+        """Relay the analysis to the HTTP client as Server-Sent Events.
+        
+        Each chunk of the answer is sent as a ``delta`` event; the final
+        ``result`` event carries the complete result in the same shape as the
+        non-streaming response.
+        """
+        def events():
+            try:
+                # Flush the response headers before the upstream request starts
+                yield ": stream opened\n\n"
+                client = get_client()
+                for kind, data in client.analyze_screenshot_stream(screenshot, prompt=prompt):
+                    if kind == 'delta':
+                        yield format_sse('delta', {"content": data})
+                    else:
+                        yield format_sse('result', data)
+            except Exception as e:
+                yield format_sse('result', {"error": str(e)})
+        
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def _wants_stream(request):
+    """Return whether the client asked for a Server-Sent Events response."""
+    if str(request.data.get('stream', '')).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.META.get('HTTP_ACCEPT', '')
 
 
 class BatchAnalyzeScreenshotsView(APIView):
-    """API view for analyzing multiple screenshots in the debug_screenshots directory."""
+    """API view for queuing the analysis of multiple screenshots in the debug_screenshots directory.
+    
+    The screenshots are analyzed by the analysis_worker command; the response
+    points to the job's status and results endpoints. Clients asking for
+    ``application/x-ndjson`` instead get the results streamed as they complete.
+    """
+    
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
     
     def post(self, request, format=None):
         language = request.data.get('language', None)
@@ -74,16 +131,8 @@ class BatchAnalyzeScreenshotsView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Get all PNG files in the directory
-        screenshots = [f for f in os.listdir(screenshots_dir) if f.endswith('.png')]
-        
-        # Apply filters if specified
-        if language:
-            screenshots = [s for s in screenshots if f"_{language}_" in s]
-        if theme:
-            screenshots = [s for s in screenshots if f"_{theme}_" in s]
-        if page:
-            screenshots = [s for s in screenshots if s.startswith(f"{page}_")]
+        # Get the PNG files in the directory matching the filters
+        screenshots = find_screenshots(screenshots_dir, language=language, theme=theme, page=page)
         
         if not screenshots:
             return Response(
@@ -91,45 +140,276 @@ class BatchAnalyzeScreenshotsView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        try:
-            # Get OpenRouter client
-            client = get_client()
-            
-            # Process each screenshot
-            results = {}
-            for screenshot in screenshots:
-                screenshot_path = os.path.join(screenshots_dir, screenshot)
+        if _wants_ndjson(request):
+            return self._stream(screenshots_dir, screenshots)
+        
+        job = enqueue_batch(screenshots_dir, screenshots, {'language': language, 'theme': theme, 'page': page})
+        
+        data = _job_status(request, job)
+        response = Response(data, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = data['status_url']
+        return response
+    
+    def _stream(self, screenshots_dir, screenshots):
+        """Analyze the screenshots in this request and stream the results as NDJSON.
+        
+        Each line is ``{"screenshot": ..., "result": ...}`` for one screenshot,
+        in completion order; near-identical screenshots get a line with the
+        shared result as soon as it is available. The last line is
+        ``{"summary": ...}`` with the counts of the batch. Results are not
+        kept once sent, so memory does not grow with the batch.
+        """
+        def lines():
+            total = len(screenshots)
+            sent = errors = duplicates_skipped = 0
+            try:
+                # Imported here because NumPy would otherwise load with the API views
+                from .dedup import deduplicate
                 
-                # Extract metadata from filename (format: page_lang_theme_timestamp.png)
-                parts = screenshot.replace('.png', '').split('_')
-                if len(parts) >= 3:
-                    page_name = parts[0]
-                    lang = parts[1]
-                    theme_name = parts[2]
-                    
-                    # Create a custom prompt based on metadata
-                    prompt = f"""Analyze this UI screenshot of the {page_name} page in {lang} language with {theme_name} theme.
-                    Identify any issues with:
-                    1. Text rendering and translations
-                    2. Layout and alignment
-                    3. Theme consistency (colors, contrast)
-                    4. Responsive design issues
-                    5. UI element spacing and positioning
-                    
-                    Provide a concise summary of findings and recommendations for improvement."""
-                else:
-                    prompt = None  # Use default prompt
+                unique_jobs, duplicates = deduplicate(build_jobs(screenshots_dir, screenshots))
+                duplicates_skipped = len(duplicates)
+                copies = {}
+                for key, source in duplicates.items():
+                    copies.setdefault(source, []).append(key)
                 
-                # Analyze the screenshot
-                analysis = client.analyze_screenshot(screenshot_path, prompt=prompt)
-                results[screenshot] = analysis
+                for key, result in iter_analyses(get_client(), unique_jobs):
+                    for screenshot in [key, *copies.pop(key, ())]:
+                        sent += 1
+                        errors += 'error' in result
+                        yield format_ndjson({"screenshot": screenshot, "result": result})
+                error = None
+            except Exception as e:
+                error = str(e)
             
-            return Response(results)
-        except Exception as e:
+            yield format_ndjson({"summary": {
+                "total": total,
+                "completed": sent,
+                "errors": errors,
+                "duplicates_skipped": duplicates_skipped,
+                "error": error,
+            }})
+        
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+        # Lets clients show progress from the first line
+        response['X-Total-Screenshots'] = str(len(screenshots))
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+def _wants_ndjson(request):
+    """Return whether the client asked for batch results streamed as NDJSON."""
+    if str(request.data.get('stream', '')).lower() in ('1', 'true', 'yes'):
+        return True
+    return 'application/x-ndjson' in request.META.get('HTTP_ACCEPT', '')
+
+
+class AnalysisJobView(APIView):
+    """API view reporting the status and progress of a batch analysis job."""
+    
+    def get(self, request, job_id, format=None):
+        job = get_object_or_404(AnalysisJob, pk=job_id)
+        return Response(_job_status(request, job))
+
+
+class AnalysisJobResultsView(APIView):
+    """API view returning the results of a finished batch analysis job."""
+    
+    def get(self, request, job_id, format=None):
+        job = get_object_or_404(AnalysisJob, pk=job_id)
+        
+        if job.status == AnalysisJob.FAILED:
             return Response(
-                {"error": str(e)},
+                {"error": job.error},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        if job.status != AnalysisJob.SUCCEEDED:
+            return Response(
+                {"error": "The job has not finished yet", **_job_status(request, job)},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        response = Response(job.results)
+        response['X-Duplicates-Skipped'] = str(job.duplicates_skipped)
+        return response
+
+
+def _job_status(request, job):
+    """Describe a batch analysis job for the job endpoints."""
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "total": job.total,
+        "completed": job.completed,
+        "duplicates_skipped": job.duplicates_skipped,
+        "error": job.error or None,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "status_url": request.build_absolute_uri(reverse('analysis_job', args=[job.id])),
+        "results_url": request.build_absolute_uri(reverse('analysis_job_results', args=[job.id])),
+    }
+
+
+class AnalysisResultsView(APIView):
+    """API view listing stored analysis results, newest first, with keyset pagination.
+    
+    Filters: ``screenshot``, ``page``, ``language``, ``theme``, ``provider`` and
+    ``model`` (exact values), ``since`` and ``until`` (ISO dates or datetimes).
+    ``limit`` sets the page size; ``cursor`` is the ``next_cursor`` of the
+    previous page.
+    """
+    
+    filter_names = ('screenshot', 'page', 'language', 'theme', 'provider', 'model')
+    
+    def get(self, request, format=None):
+        filters = {name: request.query_params.get(name) for name in self.filter_names}
+        try:
+            for name in ('since', 'until'):
+                filters[name] = _parse_time(request.query_params.get(name))
+            limit = int(request.query_params.get('limit', 50))
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            limit = min(limit, getattr(settings, 'AI_RESULTS_MAX_PAGE_SIZE', 500))
+            rows, next_cursor = query_results(filters, request.query_params.get('cursor'), limit)
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        next_url = None
+        if next_cursor is not None:
+            params = request.query_params.copy()
+            params['cursor'] = next_cursor
+            next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+        
+        return Response({
+            "results": [_result_data(row) for row in rows],
+            "next_cursor": next_cursor,
+            "next": next_url,
+        })
+
+
+def _parse_time(value):
+    """Parse an ISO date or datetime query parameter; dates mean midnight."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _result_data(row):
+    """Describe a stored analysis result for the results endpoint."""
+    return {
+        "id": row.pk,
+        "screenshot": row.screenshot,
+        "page": row.page,
+        "language": row.language,
+        "theme": row.theme,
+        "provider": row.provider or None,
+        "model": row.model or None,
+        "prompt_hash": row.prompt_hash or None,
+        "latency": row.latency,
+        "prompt_tokens": row.prompt_tokens,
+        "completion_tokens": row.completion_tokens,
+        "content": row.content,
+        "error": row.error or None,
+        "source": row.source,
+        "created_at": row.created_at,
+    }
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AnalyzeScreenshotAsyncView(View):
+    """Async view for analyzing a single screenshot under ASGI.
+    
+    Takes the same parameters as AnalyzeScreenshotView (without streaming).
+    The upstream request is awaited on the event loop, so a worker holds many
+    analyses in flight instead of one per thread.
+    """
+    
+    async def post(self, request):
+        # Check if screenshot file is provided
+        if 'screenshot' not in request.FILES:
+            return JsonResponse({"error": "No screenshot file provided"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        screenshot = request.FILES['screenshot']
+        prompt = request.POST.get('prompt') or None
+        
+        # Only the header is read, so this does not hold up the event loop
+        try:
+            validate_image(screenshot)
+        except InvalidImageError as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            client = get_client()
+            analysis = await client.analyze_screenshot_async(screenshot, prompt=prompt)
+            return JsonResponse(analysis)
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchAnalyzeScreenshotsAsyncView(View):
+    """Async view analyzing multiple screenshots in the debug_screenshots directory under ASGI.
+    
+    Takes the same filters as BatchAnalyzeScreenshotsView but answers with the
+    results rather than a job: the requests are awaited concurrently on the
+    event loop, so the long wait does not tie up a worker thread.
+    """
+    
+    async def post(self, request):
+        language = request.POST.get('language') or None
+        theme = request.POST.get('theme') or None
+        page = request.POST.get('page') or None
+        
+        screenshots_dir = os.path.join(settings.BASE_DIR, 'debug_screenshots')
+        
+        # Validate screenshots directory
+        if not os.path.isdir(screenshots_dir):
+            return JsonResponse(
+                {"error": f"Screenshots directory not found: {screenshots_dir}"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        screenshots = await sync_to_async(find_screenshots)(
+            screenshots_dir, language=language, theme=theme, page=page
+        )
+        
+        if not screenshots:
+            return JsonResponse(
+                {"warning": "No screenshots found matching the specified criteria"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        try:
+            client = get_client()
+            
+            # Imported here because NumPy would otherwise load in every Django process
+            from .dedup import deduplicate, expand_results
+            
+            # Hashing decodes every image, so it runs in a worker thread
+            unique_jobs, duplicates = await asyncio.to_thread(
+                deduplicate, build_jobs(screenshots_dir, screenshots)
+            )
+            results = await analyze_many_async(client, unique_jobs)
+            results = expand_results(results, duplicates)
+            
+            response = JsonResponse(results)
+            response['X-Duplicates-Skipped'] = str(len(duplicates))
+            return response
+        except Exception as e:
+            return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 class GenerateReportView(APIView):
@@ -145,32 +425,24 @@ class GenerateReportView(APIView):
             )
         
         try:
-            # Save analysis data to a temporary file
-            temp_dir = os.path.join(settings.BASE_DIR, 'temp_analysis')
-            os.makedirs(temp_dir, exist_ok=True)
-            
-            analysis_file = os.path.join(temp_dir, 'temp_analysis.json')
-            with open(analysis_file, 'w') as f:
-                json.dump(analysis_data, f)
-            
-            # Generate the report
-            report_path = generate_report(analysis_file)
-            
-            # Read the report content
-            with open(report_path, 'r') as f:
-                report_content = f.read()
-            
-            # Clean up temporary files
-            os.remove(analysis_file)
-            os.remove(report_path)
-            
-            # Return the report as HTML
-            return HttpResponse(
-                report_content,
-                content_type='text/html'
+            # Render straight from the posted data; the head of the report is sent
+            # while the page sections are still being generated
+            report = ScreenshotAnalysisReport(analysis_data=analysis_data)
+            return StreamingHttpResponse(report.iter_html(), content_type='text/html')
+        except ValueError as e:
+            return Response(
+                {"error": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
             return Response(
                 {"error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+class AIMetricsView(APIView):
+    """API view exposing the per-phase timing, payload and token usage histograms of the AI clients."""
+    
+    def get(self, request, format=None):
+        return Response(get_metrics().snapshot())
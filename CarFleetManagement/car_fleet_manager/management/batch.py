@@ -0,0 +1,183 @@
+"""Shared pipeline of the commands that analyze a directory of screenshots.
+
+analyze_screenshots, gemini_analyze batch and openrouter_analyze batch only
+differ in the client they use and in a few options; the arguments they share
+and the pipeline that runs a batch (catalog lookup, jobs, deduplication,
+incremental regions or packing, concurrent analysis and the results file)
+live here.
+"""
+
+import asyncio
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.base_client import analyze_groups, analyze_many, analyze_many_async
+from api.catalog import find_screenshots
+from api.dedup import deduplicate, expand_results
+from api.incremental import IncrementalBatch
+from api.jobs import build_jobs
+from api.metrics import format_client_stats
+from api.packing import group_jobs
+
+
+class BatchAnalysisCommand(BaseCommand):
+    """Base class of the batch screenshot analysis commands."""
+
+    def add_batch_arguments(self, parser, output_default):
+        """Add the filter, concurrency, deduplication, incremental, packing and output options.
+
+        Args:
+            parser: Parser (or subcommand parser) of the batch command
+            output_default (str): Default results file
+        """
+        parser.add_argument(
+            '--language',
+            choices=[lang_code for lang_code, _ in settings.LANGUAGES],
+            help='Filter screenshots by language'
+        )
+        parser.add_argument('--theme', choices=['light', 'dark'], help='Filter screenshots by theme')
+        parser.add_argument('--page', help='Filter screenshots by page name')
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.AI_BATCH_CONCURRENCY,
+            help='Number of screenshots analyzed concurrently'
+        )
+        parser.add_argument(
+            '--prep-workers',
+            type=int,
+            default=settings.AI_PREP_WORKERS,
+            help='Number of processes preparing images ahead of analysis (0 to disable)'
+        )
+        parser.add_argument(
+            '--dedup-threshold',
+            type=int,
+            default=settings.AI_DEDUP_THRESHOLD,
+            help='Maximum perceptual hash distance for screenshots to share one analysis (-1 to disable)'
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only analyze the regions that changed since the baseline screenshot'
+        )
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Store the analyzed screenshots as the new baselines'
+        )
+        parser.add_argument(
+            '--pack',
+            choices=['theme', 'language'],
+            help='Analyze related screenshots in one multi-image request: light and dark '
+                 'of a page (theme) or all languages of a page (language)'
+        )
+        parser.add_argument('--output', default=output_default, help='Output file for analysis results')
+
+    def run_batch(self, screenshots_dir, options, get_client, provider_name=None):
+        """Analyze the screenshots of a directory and save the results to the output file.
+
+        Args:
+            screenshots_dir (str): Directory containing the screenshots
+            options (dict): Command options, including those added by add_batch_arguments
+            get_client (callable): Returns the client to analyze the screenshots with
+            provider_name (str, optional): Provider named in the progress output
+        """
+        pack = options['pack']
+        incremental = options['incremental']
+        use_async = options.get('use_async', False)
+        output_file = options['output']
+
+        if not os.path.isdir(screenshots_dir):
+            self.stdout.write(self.style.ERROR(f"Screenshots directory not found: {screenshots_dir}"))
+            return
+
+        # Look up the matching screenshots in the catalog
+        screenshots = find_screenshots(
+            screenshots_dir, language=options['language'], theme=options['theme'], page=options['page']
+        )
+
+        if not screenshots:
+            self.stdout.write(self.style.WARNING("No screenshots found matching the specified criteria"))
+            return
+
+        if pack and incremental:
+            self.stdout.write(self.style.ERROR("--pack cannot be combined with --incremental"))
+            return
+        if pack and use_async:
+            self.stdout.write(self.style.ERROR("--pack cannot be combined with --async"))
+            return
+
+        suffix = f" with {provider_name}" if provider_name else ''
+        self.stdout.write(f"Found {len(screenshots)} screenshots to analyze{suffix}")
+
+        client = get_client()
+
+        # Build the analysis jobs, with a prompt matching each screenshot's metadata
+        jobs = build_jobs(screenshots_dir, screenshots)
+
+        # Near-identical screenshots are analyzed once and share the result
+        unique_jobs, duplicates = deduplicate(jobs, threshold=options['dedup_threshold'])
+        if duplicates:
+            self.stdout.write(f"Skipping {len(duplicates)} near-identical screenshots")
+
+        # In incremental mode only the regions that changed since the baseline are analyzed
+        batch = None
+        pending = unique_jobs
+        if incremental:
+            batch = IncrementalBatch(default_prompt=client.default_prompt, update_baseline=options['update_baseline'])
+            pending, unchanged = batch.build_jobs(unique_jobs)
+            self.stdout.write(
+                f"{len(unchanged)} screenshots unchanged since their baseline, "
+                f"{len(pending)} images to analyze"
+            )
+
+        # Analyze the screenshots concurrently; the client's rate limiter still applies
+        completed = []
+
+        def report_progress(screenshot, analysis):
+            completed.append(screenshot)
+            self.stdout.write(f"Analyzed screenshot {len(completed)}/{len(pending)}: {screenshot}")
+            self._write_preview(analysis)
+
+        concurrency = options['concurrency']
+        if pack:
+            groups = group_jobs(unique_jobs, by=pack)
+            self.stdout.write(f"Packing {len(unique_jobs)} screenshots into {len(groups)} groups")
+            results = analyze_groups(client, groups, max_workers=concurrency, on_result=report_progress)
+        else:
+            try:
+                if use_async:
+                    results = asyncio.run(
+                        analyze_many_async(client, pending, max_workers=concurrency, on_result=report_progress)
+                    )
+                else:
+                    results = analyze_many(
+                        client, pending, max_workers=concurrency, prep_workers=options['prep_workers'],
+                        on_result=report_progress
+                    )
+                if batch:
+                    results = batch.assemble(results)
+            finally:
+                if batch:
+                    batch.close()
+        results = expand_results(results, duplicates)
+
+        # Save results to file
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f"Analysis complete. Results saved to {output_file}"))
+        for line in format_client_stats(client):
+            self.stdout.write(line)
+
+    def _write_preview(self, analysis):
+        """Display a preview of an analysis, or its error."""
+        if 'choices' in analysis and analysis['choices']:
+            content = analysis['choices'][0]['message']['content']
+            preview = content[:150] + '...' if len(content) > 150 else content
+            self.stdout.write(self.style.SUCCESS(f"Analysis: {preview}"))
+        elif 'error' in analysis:
+            self.stdout.write(self.style.ERROR(f"Error: {analysis['error']}"))
@@ -0,0 +1,82 @@
+"""Management command to run queued batch screenshot analyses.
+
+The batch analysis API endpoint only queues jobs; this worker claims them one
+at a time, analyzes their screenshots with the configured AI providers and
+stores the results for the job endpoints. Run several workers to process
+several jobs at once.
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import close_old_connections
+from api.jobs import claim_job, default_worker_name, run_job
+from api.models import AnalysisJob
+from api.router import get_client
+
+class Command(BaseCommand):
+    help = 'Run queued batch screenshot analysis jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=settings.AI_BATCH_CONCURRENCY,
+            help='Number of screenshots of a job analyzed concurrently'
+        )
+        parser.add_argument(
+            '--prep-workers',
+            type=int,
+            default=settings.AI_PREP_WORKERS,
+            help='Number of processes preparing images ahead of analysis (0 to disable)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=settings.AI_JOB_POLL_INTERVAL,
+            help='Seconds to wait before checking an empty queue again'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of waiting for new jobs'
+        )
+        parser.add_argument('--name', help='Worker name recorded in claimed jobs (default: host:pid)')
+
+    def handle(self, *args, **options):
+        worker = options['name'] or default_worker_name()
+        self.stdout.write(f"Worker {worker} waiting for jobs")
+
+        processed = 0
+        job = None
+        try:
+            while True:
+                close_old_connections()
+                job = claim_job(worker)
+                if job is None:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f"Running job {job.id}: {job.total} screenshots")
+                run_job(
+                    job, get_client(), max_workers=options['concurrency'], prep_workers=options['prep_workers']
+                )
+                processed += 1
+                if job.status == AnalysisJob.SUCCEEDED:
+                    self.stdout.write(self.style.SUCCESS(f"Job {job.id} succeeded: {job.completed} screenshots analyzed"))
+                elif job.status == AnalysisJob.RUNNING:
+                    self.stdout.write(self.style.WARNING(f"Job {job.id} was claimed by another worker"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"Job {job.id} failed: {job.error}"))
+                job = None
+        except KeyboardInterrupt:
+            if job is not None:
+                # Hand the interrupted job back to the queue rather than waiting for it to go stale
+                AnalysisJob.objects.filter(pk=job.pk, worker=worker, status=AnalysisJob.RUNNING).update(
+                    status=AnalysisJob.QUEUED
+                )
+                self.stdout.write(self.style.WARNING(f"Interrupted; job {job.id} queued again"))
+
+        self.stdout.write(f"Worker {worker} stopped after {processed} jobs")
@@ -0,0 +1,29 @@
+"""Management command to load analysis JSON files into the results store.
+
+The batch commands write their results to JSON files such as
+screenshot_analysis.json. Ingesting them makes past runs queryable through
+the results API endpoint; ingesting a file again updates its results.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from api.results import ingest_file
+
+class Command(BaseCommand):
+    help = 'Load analysis results from JSON files into the results store'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Analysis JSON files written by the batch commands')
+        parser.add_argument('--provider', default='', help='Provider of results that do not name it (e.g. gemini)')
+        parser.add_argument('--model', default='', help='Model of results that do not name it')
+    
+    def handle(self, *args, **options):
+        total = 0
+        for path in options['files']:
+            try:
+                count = ingest_file(path, provider=options['provider'], model=options['model'])
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not ingest {path}: {e}")
+            total += count
+            self.stdout.write(f"Ingested {count} results from {path}")
+        
+        self.stdout.write(self.style.SUCCESS(f"Ingested {total} results"))
@@ -7,12 +7,12 @@ and image resizing to prevent hitting API limits.
 
 import os
 import json
-from django.core.management.base import BaseCommand
 from django.conf import settings
 from api.openrouter_client import get_client
 from api.report_generator import generate_report
+from car_fleet_manager.management.batch import BatchAnalysisCommand
 
-class Command(BaseCommand):
+class Command(BatchAnalysisCommand):
     help = 'Analyze screenshots using OpenRouter API and generate reports'
     
     def add_arguments(self, parser):
@@ -31,14 +31,7 @@ class Command(BaseCommand):
             default=os.path.join(settings.BASE_DIR, 'debug_screenshots'),
             help='Directory containing screenshots'
         )
-        batch_parser.add_argument('--language', help='Filter screenshots by language')
-        batch_parser.add_argument('--theme', choices=['light', 'dark'], help='Filter screenshots by theme')
-        batch_parser.add_argument('--page', help='Filter screenshots by page name')
-        batch_parser.add_argument(
-            '--output', 
-            default='screenshot_analysis.json',
-            help='Output file for analysis results'
-        )
+        self.add_batch_arguments(batch_parser, output_default='screenshot_analysis.json')
         
         # Generate a report from analysis results
         report_parser = subparsers.add_parser('report', help='Generate a report from analysis results')
@@ -79,12 +72,7 @@ class Command(BaseCommand):
         analysis = client.analyze_screenshot(screenshot_path, prompt=prompt)
         
         # Display a preview of the analysis
-        if 'choices' in analysis and analysis['choices']:
-            content = analysis['choices'][0]['message']['content']
-            preview = content[:150] + '...' if len(content) > 150 else content
-            self.stdout.write(self.style.SUCCESS(f"Analysis: {preview}"))
-        elif 'error' in analysis:
-            self.stdout.write(self.style.ERROR(f"Error: {analysis['error']}"))
+        self._write_preview(analysis)
         
         # Save results to file if specified
         if output_file:
@@ -94,79 +82,7 @@ class Command(BaseCommand):
     
     def _handle_batch(self, options):
         """Handle the 'batch' command."""
-        screenshots_dir = options['dir']
-        language = options['language']
-        theme = options['theme']
-        page = options['page']
-        output_file = options['output']
-        
-        if not os.path.isdir(screenshots_dir):
-            self.stdout.write(self.style.ERROR(f"Screenshots directory not found: {screenshots_dir}"))
-            return
-        
-        # Get all PNG files in the directory
-        screenshots = [f for f in os.listdir(screenshots_dir) if f.endswith('.png')]
-        
-        # Apply filters if specified
-        if language:
-            screenshots = [s for s in screenshots if f"_{language}_" in s]
-        if theme:
-            screenshots = [s for s in screenshots if f"_{theme}_" in s]
-        if page:
-            screenshots = [s for s in screenshots if s.startswith(f"{page}_")]
-        
-        if not screenshots:
-            self.stdout.write(self.style.WARNING("No screenshots found matching the specified criteria"))
-            return
-        
-        self.stdout.write(f"Found {len(screenshots)} screenshots to analyze")
-        
-        # Get OpenRouter client
-        client = get_client()
-        
-        # Process each screenshot
-        results = {}
-        for i, screenshot in enumerate(screenshots, 1):
-            self.stdout.write(f"Analyzing screenshot {i}/{len(screenshots)}: {screenshot}")
-            screenshot_path = os.path.join(screenshots_dir, screenshot)
-            
-            # Extract metadata from filename (format: page_lang_theme_timestamp.png)
-            parts = screenshot.replace('.png', '').split('_')
-            if len(parts) >= 3:
-                page_name = parts[0]
-                lang = parts[1]
-                theme_name = parts[2]
-                
-                # Create a custom prompt based on metadata
-                prompt = f"""Analyze this UI screenshot of the {page_name} page in {lang} language with {theme_name} theme.
-                Identify any issues with:
-                1. Text rendering and translations
-                2. Layout and alignment
-                3. Theme consistency (colors, contrast)
-                4. Responsive design issues
-                5. UI element spacing and positioning
-                
-                Provide a concise summary of findings and recommendations for improvement."""
-            else:
-                prompt = None  # Use default prompt
-            
-            # Analyze the screenshot
-            analysis = client.analyze_screenshot(screenshot_path, prompt=prompt)
-            results[screenshot] = analysis
-            
-            # Display a preview of the analysis
-            if 'choices' in analysis and analysis['choices']:
-                content = analysis['choices'][0]['message']['content']
-                preview = content[:150] + '...' if len(content) > 150 else content
-                self.stdout.write(self.style.SUCCESS(f"Analysis: {preview}"))
-            elif 'error' in analysis:
-                self.stdout.write(self.style.ERROR(f"Error: {analysis['error']}"))
-        
-        # Save results to file
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
-        
-        self.stdout.write(self.style.SUCCESS(f"Analysis complete. Results saved to {output_file}"))
+        self.run_batch(options['dir'], options, get_client)
     
     def _handle_report(self, options):
         """Handle the 'report' command."""
@@ -165,3 +165,110 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# AI screenshot analysis
+# Results of analyze_screenshot are cached on (image hash, prompt, model) so
+# re-running a batch over unchanged screenshots does not hit the provider again.
+
+AI_CACHE_DIR = BASE_DIR / ".ai_cache"
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", 30 * 24 * 60 * 60))  # seconds
+AI_CACHE_MEMORY_ENTRIES = 256
+AI_CACHE_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+# Number of screenshots analyzed concurrently by batch runs. The per-provider
+# rate limit still applies across all of them.
+AI_BATCH_CONCURRENCY = int(os.environ.get("AI_BATCH_CONCURRENCY", 4))
+
+# SQLite database holding the per-provider rate limit state shared by all
+# worker processes and management commands on this host.
+AI_RATE_LIMIT_DB = AI_CACHE_DIR / "rate_limits.sqlite3"
+
+# Lock table coalescing identical analyses (same image, prompt and model) in
+# flight at once in any process on this host into one upstream request. A claim
+# not finished within the lease is assumed abandoned by a crashed process.
+AI_SINGLEFLIGHT_DB = AI_CACHE_DIR / "inflight.sqlite3"
+AI_SINGLEFLIGHT_LEASE = 300  # seconds
+
+# OpenRouter HTTP connection pool. The pool should be at least as large as
+# AI_BATCH_CONCURRENCY. HTTP/2 requires the httpx and h2 packages.
+OPENROUTER_POOL_SIZE = 10
+OPENROUTER_CONNECT_TIMEOUT = 10  # seconds
+OPENROUTER_READ_TIMEOUT = 120  # seconds
+OPENROUTER_HTTP2 = os.environ.get("OPENROUTER_HTTP2", "").lower() in ("1", "true", "yes")
+
+# Images that fit the resolution limit and byte budget are sent untouched;
+# larger ones are re-encoded (JPEG or WEBP) at the highest quality that fits.
+AI_IMAGE_BYTE_BUDGET = 1024 * 1024  # bytes, before base64 encoding
+AI_IMAGE_FORMAT = "JPEG"
+AI_IMAGE_QUALITY = 85
+AI_IMAGE_MIN_QUALITY = 50
+
+# Number of processes preparing images ahead of the network stage in batch
+# commands. 0 prepares images in the request threads.
+AI_PREP_WORKERS = int(os.environ.get("AI_PREP_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Near-identical screenshots (perceptual hashes within this Hamming distance,
+# out of 64 bits) are analyzed once and share the result. -1 disables it.
+AI_DEDUP_THRESHOLD = int(os.environ.get("AI_DEDUP_THRESHOLD", 4))
+AI_DEDUP_HASH = "dhash"  # or "phash"
+
+# Incremental analysis: baselines per page/language/theme, and how changed
+# regions are detected and cropped.
+AI_BASELINE_DIR = AI_CACHE_DIR / "baselines"
+AI_DIFF_PIXEL_THRESHOLD = 24  # minimum per-channel difference of a changed pixel
+AI_DIFF_CONTEXT = 32  # pixels of context around each changed region
+AI_DIFF_MAX_CHANGED_RATIO = 0.5  # analyze the whole screenshot above this changed fraction
+
+# Provider routing: providers in order of preference (those without an API key
+# are skipped), when a provider counts as unhealthy, and hedging of
+# interactive requests.
+AI_PROVIDERS = ["openrouter", "gemini"]
+AI_ROUTER_MAX_ERROR_RATE = 0.5  # recent error rate above which a provider is avoided
+AI_ROUTER_COOLDOWN = 30  # seconds a provider is avoided after a 429/5xx
+AI_ROUTER_HEDGE = os.environ.get("AI_ROUTER_HEDGE", "").lower() in ("1", "true", "yes")
+AI_ROUTER_HEDGE_DELAY = 8.0  # hedge delay until a provider has enough samples for a p95
+AI_ROUTER_HEDGE_POOL_SIZE = 32  # threads running hedged requests, two per request at most
+
+# Retries of transient upstream failures (429, 5xx, network errors) with
+# exponential backoff and jitter, and the per-provider circuit breaker.
+AI_RETRY_MAX_ATTEMPTS = 3  # attempts per request, including the first
+AI_RETRY_BASE_DELAY = 1.0  # seconds before the first retry
+AI_RETRY_MAX_DELAY = 30.0  # longest wait; a longer Retry-After is not waited for
+AI_CIRCUIT_FAILURE_THRESHOLD = 5  # consecutive failures that open the circuit
+AI_CIRCUIT_RESET_TIMEOUT = 30.0  # seconds before a trial request is let through
+
+# Gemini model and generation parameters. The client keeps one configured model
+# for its lifetime; unset parameters are left to the model defaults.
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_MAX_OUTPUT_TOKENS = None  # e.g. 1024 to cap the length of each analysis
+GEMINI_TEMPERATURE = None  # e.g. 0.2 for more repeatable analyses
+
+# Batch analysis job queue, drained by "manage.py analysis_worker". A running
+# job without progress for AI_JOB_STALE_SECONDS is assumed abandoned by its
+# worker and claimed again.
+AI_JOB_POLL_INTERVAL = 2.0  # seconds between checks of an empty queue
+AI_JOB_STALE_SECONDS = 600
+AI_JOB_SAVE_INTERVAL = 5.0  # seconds between saves of a running job's progress
+
+# Screenshot uploads up to this size are analyzed straight from memory; larger
+# ones are spooled by Django to a uniquely named temporary file.
+FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024
+
+# Uploaded screenshots are checked from their header before being decoded:
+# other formats and images over these dimensions are rejected with 400.
+AI_UPLOAD_FORMATS = ["image/png", "image/jpeg", "image/webp", "image/gif"]
+AI_UPLOAD_MAX_DIMENSION = 16384  # pixels, largest side
+AI_UPLOAD_MAX_PIXELS = 40_000_000  # width x height, e.g. 8K is 33 million
+
+# Connections of the httpx AsyncClient used by the async API endpoints, per
+# ASGI worker. Bounds the OpenRouter requests a worker keeps in flight.
+OPENROUTER_ASYNC_POOL_SIZE = 100
+
+# Screenshot catalog queried by the batch analyses. A directory is listed again
+# when its modification time changes or its last scan is older than this, to
+# pick up screenshots overwritten in place.
+AI_CATALOG_MAX_AGE = 300  # seconds
+
+# Largest page of the stored analysis results endpoint.
+AI_RESULTS_MAX_PAGE_SIZE = 500